@@ -0,0 +1,116 @@
+"""
+.. module:: AsyncEvaluator
+    :synopsis: AsyncEvaluator evaluates CPU snapshots of the tagger's weights in the background worker process while
+    the training goes on.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import copy
+import os
+import queue
+import sys
+import traceback
+
+import torch.multiprocessing as multiprocessing
+
+from classes.evaluator import Evaluator
+
+def evaluate_snapshots(tagger, datasets_bank, eval_params, save_fn, tasks_queue, results_queue):
+    # Worker process: snapshots are scored in the order of epochs, so the best dev score is tracked here exactly as
+    # in the main process; the best snapshot is saved by the worker itself. Errors are sent back to the main process.
+    epoch = None
+    try:
+        sys.stdout = open(os.devnull, 'w')
+        best_f1_dev = -1
+        while True:
+            task = tasks_queue.get()
+            if task is None:
+                break
+            epoch, epoch_loss, state_dict = task
+            tagger.load_state_dict(state_dict)
+            tagger.train() # drops the inference state derived from the previous snapshot, e.g. cached char features
+            tagger.eval()
+            scores = Evaluator.get_evaluation_epoch(tagger, datasets_bank, best_f1_dev=best_f1_dev, **eval_params)
+            f1_dev = scores[1]
+            if f1_dev > best_f1_dev:
+                best_f1_dev = f1_dev
+                if save_fn is not None:
+                    tagger.save_tagger(save_fn)
+            results_queue.put((epoch, epoch_loss) + scores)
+    except Exception:
+        results_queue.put((epoch, None, traceback.format_exc()))
+
+class AsyncEvaluator():
+    def __init__(self, tagger, datasets_bank, eval_params, save_fn=None, max_pending_num=2):
+        # The worker gets the CPU copies of the tagger and of the pre-indexed datasets
+        eval_tagger = AsyncEvaluator.get_cpu_tagger_copy(tagger)
+        eval_datasets_bank = copy.copy(datasets_bank)
+        for name in ['indexed_train', 'indexed_dev', 'indexed_test']:
+            indexed_dataset = copy.copy(getattr(datasets_bank, name))
+            if indexed_dataset is not None:
+                indexed_dataset.gpu = -1
+            setattr(eval_datasets_bank, name, indexed_dataset)
+        context = multiprocessing.get_context('spawn') # the main process may already use CUDA
+        self.tasks_queue = context.Queue(maxsize=max_pending_num) # training waits if evaluation falls behind
+        self.results_queue = context.Queue()
+        self.worker = context.Process(target=evaluate_snapshots, args=(eval_tagger, eval_datasets_bank, eval_params,
+                                                                       save_fn, self.tasks_queue, self.results_queue))
+        self.worker.daemon = True
+        self.worker.start()
+        self.pending_num = 0
+
+    @staticmethod
+    def get_cpu_tagger_copy(tagger):
+        tagger.cpu()
+        tagger_copy = copy.deepcopy(tagger)
+        tagger.self_ensure_gpu()
+        tagger_copy.gpu = -1
+        for module in tagger_copy.modules():
+            for seq_indexer_name in ['word_seq_indexer', 'tag_seq_indexer', 'char_seq_indexer']:
+                if getattr(module, seq_indexer_name, None) is not None:
+                    getattr(module, seq_indexer_name).gpu = -1
+        return tagger_copy
+
+    def submit(self, epoch, tagger, epoch_loss):
+        state_dict = {name: tensor.detach().cpu().clone() for name, tensor in tagger.state_dict().items()}
+        while True:
+            try:
+                self.tasks_queue.put((epoch, epoch_loss, state_dict), timeout=1.0)
+                break
+            except queue.Full:
+                self.check_worker()
+        self.pending_num += 1
+
+    def check_worker(self):
+        if not self.worker.is_alive():
+            raise RuntimeError('Evaluation worker process has stopped unexpectedly, exit code: %s.' %
+                               self.worker.exitcode)
+
+    def get_results(self, wait_all=False):
+        # Returns the results of already scored snapshots, or of all submitted snapshots if wait_all
+        results = list()
+        while self.pending_num > 0 and (wait_all or not self.results_queue.empty()):
+            try:
+                result = self.results_queue.get(timeout=1.0)
+            except queue.Empty:
+                self.check_worker()
+                continue
+            self.pending_num -= 1
+            if result[1] is None:
+                raise RuntimeError('Evaluation of epoch %s has failed in the worker process:\n%s' % (result[0],
+                                                                                                   result[2]))
+            results.append(result)
+        return results
+
+    def close(self, timeout=60.0):
+        # The worker is stopped after the pending snapshots, it is terminated if it has hung or can not get the task
+        if self.worker.is_alive():
+            try:
+                self.tasks_queue.put(None, timeout=timeout)
+                self.worker.join(timeout)
+            except queue.Full:
+                pass
+        if self.worker.is_alive():
+            self.worker.terminate()
+            self.worker.join()
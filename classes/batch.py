@@ -0,0 +1,36 @@
+"""
+.. module:: Batch
+    :synopsis: Batch stores the batch of sequences converted to tensors of integer indices. Mask, lengths and sort
+    permutation of the batch are computed once when the batch is built, and the batch is passed through the layers.
+    Batches that are already sorted by length are detected, so the recurrent layers skip the permutations.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import numpy as np
+import torch
+
+class Batch():
+    def __init__(self, word_idx_tensor, seq_len_list, char_idx_tensor=None, tag_idx_tensor=None, word_sequences=None):
+        self.word_idx_tensor = word_idx_tensor # batch_size x max_seq_len
+        self.char_idx_tensor = char_idx_tensor # batch_size x max_seq_len x word_len
+        self.tag_idx_tensor = tag_idx_tensor # batch_size x max_seq_len
+        self.seq_len_list = seq_len_list
+        self.word_sequences = word_sequences # original words are optional, they are used by the char features cache
+        self.batch_size, self.max_seq_len = word_idx_tensor.shape
+        device = word_idx_tensor.device
+        # Lengths are known on the host, so the layers do not read them back from the mask on the device
+        seq_len_array = np.asarray(seq_len_list, dtype=np.int64)
+        mask_array = np.arange(self.max_seq_len)[np.newaxis, :] < seq_len_array[:, np.newaxis]
+        self.seq_len_tensor = torch.from_numpy(seq_len_array).to(device) # batch_size
+        self.mask_tensor = torch.from_numpy(mask_array.astype(np.float32)).to(device) # batch_size x max_seq_len
+        # Flat indices of the real (not padded) words, batch_size*max_seq_len positions
+        self.real_words_index_tensor = torch.from_numpy(mask_array.reshape(-1).nonzero()[0]).to(device)
+        # Sort by decreasing length as required for packing, the stable sort keeps the order of equal lengths
+        sort_indices = np.argsort(-seq_len_array, kind='mergesort')
+        reverse_sort_indices = np.empty_like(sort_indices)
+        reverse_sort_indices[sort_indices] = np.arange(len(sort_indices))
+        self.sorted_seq_len_list = seq_len_array[sort_indices].tolist()
+        self.is_sorted = bool(np.all(seq_len_array[:-1] >= seq_len_array[1:])) # e.g. inference batches, sorted train
+        self.sort_index_tensor = torch.from_numpy(sort_indices).to(device) # batch_size
+        self.reverse_sort_index_tensor = torch.from_numpy(reverse_sort_indices).to(device) # batch_size
@@ -0,0 +1,40 @@
+"""
+.. module:: BatchPrefetcher
+    :synopsis: BatchPrefetcher builds the train batches (index tensors, mask, lengths) in the background worker threads
+    while the training loop processes the previous batches.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class BatchPrefetcher():
+    def __init__(self, get_batch_fn, workers_num=1, queue_size=-1):
+        self.get_batch_fn = get_batch_fn
+        self.workers_num = workers_num
+        self.queue_size = queue_size if queue_size > 0 else 2*workers_num
+        self.executor = ThreadPoolExecutor(max_workers=workers_num) if workers_num > 0 else None
+
+    def get_batches(self, batches_indices):
+        # Batches are yielded in the order of batches_indices whatever the timing of the workers is, so the training
+        # is deterministic under the seed; at most queue_size batches are built or waiting ahead of the loop
+        if self.executor is None:
+            for batch_indices in batches_indices:
+                yield self.get_batch_fn(batch_indices)
+            return
+        futures = deque()
+        try:
+            for batch_indices in batches_indices:
+                if len(futures) == self.queue_size:
+                    yield futures.popleft().result()
+                futures.append(self.executor.submit(self.get_batch_fn, batch_indices))
+            while len(futures) > 0:
+                yield futures.popleft().result()
+        finally:
+            for future in futures: # the loop was interrupted
+                future.cancel()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
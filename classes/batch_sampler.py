@@ -0,0 +1,83 @@
+"""
+.. module:: BucketBatchSampler
+    :synopsis: BucketBatchSampler groups sequences of similar lengths into the train batches limited by the number of
+    tokens instead of the number of sequences. ShuffleBufferBatchSampler does the same within the bounded shuffle buffer
+    which is filled by the blocks of consecutive sequences, for the corpora which are read from disk.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import numpy as np
+
+class BucketBatchSampler():
+    def __init__(self, seq_len_list, max_tokens, bucket_width=5, max_batch_size=-1, seed=0):
+        self.seq_len_list = [int(seq_len) for seq_len in seq_len_list]
+        self.max_tokens = max_tokens
+        self.bucket_width = bucket_width
+        self.max_batch_size = max_batch_size
+        self.random_state = np.random.RandomState(seed)
+        self.padding_ratio = 0.0
+        self.tokens_num = sum(self.seq_len_list)
+
+    def get_batches_indices(self):
+        # Shuffle all sequences, then sort them by bucket ids: the order of sequences inside each bucket stays random
+        seq_len_array = np.asarray(self.seq_len_list, dtype=np.int64)
+        indices = self.random_state.permutation(len(self.seq_len_list))
+        indices = indices[np.argsort(seq_len_array[indices] // self.bucket_width, kind='mergesort')].tolist()
+        batches_indices = self.cut_batches(indices)
+        # Shuffle batches across the buckets
+        self.random_state.shuffle(batches_indices)
+        padded_tokens_num = sum([len(batch_indices) * max([self.seq_len_list[idx] for idx in batch_indices])
+                                 for batch_indices in batches_indices])
+        self.padding_ratio = 1.0 - self.tokens_num / max(padded_tokens_num, 1)
+        return batches_indices
+
+    def cut_batches(self, indices):
+        # Cut batches, number of tokens in the padded batch must not exceed max_tokens (if it is positive)
+        batches_indices = list()
+        batch_indices, batch_max_seq_len = list(), 0
+        for idx in indices:
+            seq_len = self.seq_len_list[idx]
+            max_seq_len = max(batch_max_seq_len, seq_len)
+            if len(batch_indices) > 0 and ((len(batch_indices) + 1) * max_seq_len > self.max_tokens > 0 or
+                                           len(batch_indices) == self.max_batch_size):
+                batches_indices.append(batch_indices)
+                batch_indices, max_seq_len = list(), seq_len
+            batch_indices.append(idx)
+            batch_max_seq_len = max_seq_len
+        if len(batch_indices) > 0:
+            batches_indices.append(batch_indices)
+        return batches_indices
+
+class ShuffleBufferBatchSampler(BucketBatchSampler):
+    def __init__(self, seq_len_list, max_tokens, buffer_size, block_size=1000, bucket_width=5, max_batch_size=-1,
+                 seed=0):
+        super(ShuffleBufferBatchSampler, self).__init__(seq_len_list, max_tokens, bucket_width, max_batch_size, seed)
+        self.buffer_size = buffer_size
+        self.block_size = block_size
+
+    def get_batches_indices(self):
+        # Blocks of consecutive sequences are read in the random order; each time the buffer is full, its sequences
+        # are bucketed and batched as in BucketBatchSampler. So the batches of a window of the epoch touch only the
+        # blocks of the current buffer, which are read from disk sequentially.
+        seq_len_array = np.asarray(self.seq_len_list, dtype=np.int64)
+        data_num = len(self.seq_len_list)
+        blocks_begins = self.random_state.permutation(np.arange(0, data_num, self.block_size))
+        batches_indices = list()
+        padded_tokens_num = 0
+        buffer_blocks = list()
+        for n, block_begin in enumerate(blocks_begins.tolist()):
+            buffer_blocks.append(np.arange(block_begin, min(block_begin + self.block_size, data_num)))
+            if sum([len(block) for block in buffer_blocks]) < self.buffer_size and n < len(blocks_begins) - 1:
+                continue
+            indices = self.random_state.permutation(np.concatenate(buffer_blocks))
+            indices = indices[np.argsort(seq_len_array[indices] // self.bucket_width, kind='mergesort')].tolist()
+            buffer_batches_indices = self.cut_batches(indices)
+            self.random_state.shuffle(buffer_batches_indices)
+            for batch_indices in buffer_batches_indices:
+                batch_indices = np.asarray(batch_indices, dtype=np.int64)
+                padded_tokens_num += len(batch_indices) * int(seq_len_array[batch_indices].max())
+                batches_indices.append(batch_indices)
+            buffer_blocks = list()
+        self.padding_ratio = 1.0 - self.tokens_num / max(padded_tokens_num, 1)
+        return batches_indices
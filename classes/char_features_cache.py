@@ -0,0 +1,78 @@
+"""
+.. module:: CharFeaturesCache
+    :synopsis: CharFeaturesCache is a bounded LRU cache of character-level features of words for the inference mode.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+from collections import OrderedDict
+
+import torch
+
+class CharFeaturesCache():
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.features_dict = OrderedDict() # word -> features vector, from the least to the most recently used
+        self.weights_key = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getstate__(self):
+        # Cached features are never saved together with the tagger
+        state = self.__dict__.copy()
+        state['features_dict'] = OrderedDict()
+        state['weights_key'] = None
+        return state
+
+    def invalidate(self):
+        self.features_dict.clear()
+        self.weights_key = None
+
+    def check_weights(self, parameters):
+        # Moving weights to another device changes the key, so the cache is invalidated. In-place updates of weights
+        # (optimizer steps, loading the state dict) keep the key, the tagger invalidates the cache explicitly when it is
+        # switched to the train mode or its weights are loaded.
+        weights_key = tuple(p.data_ptr() for p in parameters)
+        if weights_key != self.weights_key:
+            self.invalidate()
+            self.weights_key = weights_key
+
+    def get_stats(self):
+        return {'size': len(self.features_dict), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def get_features(self, word_sequences, compute_features_fn, pad_features):
+        # compute_features_fn: list of words -> tensor of features, shape: words_num x features_dim
+        # pad_features: features of padded positions, shape: features_dim
+        batch_features_dict = dict()
+        missed_words = list()
+        for word_seq in word_sequences:
+            for word in word_seq:
+                if word in batch_features_dict:
+                    continue
+                if word in self.features_dict:
+                    self.features_dict.move_to_end(word)
+                    batch_features_dict[word] = self.features_dict[word]
+                    self.hits += 1
+                else:
+                    batch_features_dict[word] = None
+                    missed_words.append(word)
+                    self.misses += 1
+        if len(missed_words) > 0:
+            missed_features = compute_features_fn(missed_words).detach()
+            for word, features in zip(missed_words, missed_features):
+                batch_features_dict[word] = features
+                self.features_dict[word] = features
+            while len(self.features_dict) > self.max_size:
+                self.features_dict.popitem(last=False)
+                self.evictions += 1
+        # Assemble the batch, the last row is used for padded positions
+        batch_words = list(batch_features_dict.keys())
+        word2row = {word: i for i, word in enumerate(batch_words)}
+        features_tensor = torch.stack([batch_features_dict[word] for word in batch_words] + [pad_features.detach()])
+        max_seq_len = max([len(word_seq) for word_seq in word_sequences])
+        rows = [[word2row[word] for word in word_seq] + [len(batch_words)] * (max_seq_len - len(word_seq))
+                for word_seq in word_sequences]
+        rows_tensor = torch.tensor(rows, dtype=torch.long, device=features_tensor.device)
+        return features_tensor[rows_tensor] # shape: batch_num x max_seq_len x features_dim
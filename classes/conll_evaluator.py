@@ -0,0 +1,149 @@
+"""
+.. module:: ConllEvaluator
+    :synopsis: ConllEvaluator computes chunk-level precision, recall and F1 scores in process, it reproduces the output
+    of the standard CoNNL perl script "conlleval" (author: Erik Tjong Kim Sang, version: 2004-01-26).
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import re
+
+import numpy as np
+
+class ConllEvaluator():
+    boundary = '-X-' # sentence boundary, words equal to it are processed as sentence breaks as well
+    header_str = '\nCoNNL evaluation, in-process port of the standard perl script (author: Erik Tjong Kim Sang ' \
+                 '<erikt@uia.ua.ac.be>, version: 2004-01-26):\n'
+
+    @staticmethod
+    def split_tag(tag):
+        # "B-PER" -> ("B", "PER"), the type may contain hyphens; tags without a hyphen have the empty type
+        match = re.match('^([^-]*)-(.*)$', tag)
+        if match is None:
+            return tag, ''
+        prefix, tag_type = match.group(1), match.group(2)
+        return prefix, tag_type if tag_type != '0' else '' # "0" is the false value in perl
+
+    @staticmethod
+    def is_end_of_chunk(prev_prefix, prefix, prev_type, tag_type):
+        # Checks if a chunk ended between the previous and current word
+        if (prev_prefix, prefix) in [('B', 'B'), ('B', 'O'), ('I', 'B'), ('I', 'O'), ('E', 'E'), ('E', 'I'), ('E', 'O')]:
+            return True
+        if prev_prefix != 'O' and prev_prefix != '.' and prev_type != tag_type:
+            return True
+        return prev_prefix in [']', '[']
+
+    @staticmethod
+    def is_start_of_chunk(prev_prefix, prefix, prev_type, tag_type):
+        # Checks if a chunk started between the previous and current word
+        if (prev_prefix, prefix) in [('B', 'B'), ('I', 'B'), ('O', 'B'), ('O', 'I'), ('E', 'E'), ('E', 'I'), ('O', 'E')]:
+            return True
+        if prefix != 'O' and prefix != '.' and prev_type != tag_type:
+            return True
+        return prefix in ['[', ']']
+
+    @staticmethod
+    def get_counts(word_sequences, targets_tag_sequences, outputs_tag_sequences):
+        # Each sentence is followed by the boundary, all tags are converted to indices of (prefix, type) pairs
+        pair2idx_dict = {('O', ''): 0}
+        tag2idx_dict = dict()
+        targets_idx, outputs_idx, is_boundary = list(), list(), list()
+        for words, targets_tags, outputs_tags in zip(word_sequences, targets_tag_sequences, outputs_tag_sequences):
+            for word, target_tag, output_tag in zip(words, targets_tags, outputs_tags):
+                if word == ConllEvaluator.boundary:
+                    targets_idx.append(0)
+                    outputs_idx.append(0)
+                    is_boundary.append(True)
+                    continue
+                for tag in [target_tag, output_tag]:
+                    if tag not in tag2idx_dict:
+                        tag2idx_dict[tag] = pair2idx_dict.setdefault(ConllEvaluator.split_tag(tag), len(pair2idx_dict))
+                targets_idx.append(tag2idx_dict[target_tag])
+                outputs_idx.append(tag2idx_dict[output_tag])
+                is_boundary.append(False)
+            targets_idx.append(0)
+            outputs_idx.append(0)
+            is_boundary.append(True)
+        pairs = sorted(pair2idx_dict.keys(), key=lambda pair: pair2idx_dict[pair])
+        types_list = sorted(set(tag_type for _, tag_type in pairs))
+        pair_types = np.asarray([types_list.index(tag_type) for _, tag_type in pairs], dtype=np.int64)
+        # Start/end of chunk tables for all pairs of (previous tag, current tag)
+        start_table = np.asarray([[ConllEvaluator.is_start_of_chunk(prev[0], curr[0], prev[1], curr[1]) for curr in pairs]
+                                  for prev in pairs], dtype=bool)
+        end_table = np.asarray([[ConllEvaluator.is_end_of_chunk(prev[0], curr[0], prev[1], curr[1]) for curr in pairs]
+                                for prev in pairs], dtype=bool)
+        targets_idx = np.asarray(targets_idx, dtype=np.int64)
+        outputs_idx = np.asarray(outputs_idx, dtype=np.int64)
+        is_boundary = np.asarray(is_boundary, dtype=bool)
+        prev_targets_idx = np.concatenate([[0], targets_idx[:-1]])
+        prev_outputs_idx = np.concatenate([[0], outputs_idx[:-1]])
+        targets_start = start_table[prev_targets_idx, targets_idx]
+        outputs_start = start_table[prev_outputs_idx, outputs_idx]
+        targets_end = end_table[prev_targets_idx, targets_idx]
+        outputs_end = end_table[prev_outputs_idx, outputs_idx]
+        targets_types = pair_types[targets_idx]
+        outputs_types = pair_types[outputs_idx]
+        # Candidate correct chunk starts where both chunks start with the same type, it is correct if the first
+        # position after it where any of chunks ends or types differ is the end of both chunks (or the end of data)
+        candidates = np.nonzero(targets_start & outputs_start & (targets_types == outputs_types))[0]
+        stops = np.nonzero(targets_end | outputs_end | (targets_types != outputs_types))[0]
+        data_len = len(targets_idx)
+        candidates_stops = np.append(stops, data_len)[np.searchsorted(stops, candidates, side='right')]
+        candidates_stops = np.unique(candidates_stops)
+        is_correct_stop = np.ones(len(candidates_stops), dtype=bool)
+        inner_stops = candidates_stops < data_len
+        is_correct_stop[inner_stops] = targets_end[candidates_stops[inner_stops]] & \
+                                       outputs_end[candidates_stops[inner_stops]]
+        correct_chunks_types = targets_types[candidates_stops[is_correct_stop] - 1]
+        types_num = len(types_list)
+        counts = dict()
+        counts['types_list'] = types_list
+        counts['tokens_num'] = int((~is_boundary).sum())
+        counts['correct_tags_num'] = int(((targets_idx == outputs_idx) & ~is_boundary).sum())
+        counts['found_correct'] = np.bincount(targets_types[targets_start], minlength=types_num).tolist()
+        counts['found_guessed'] = np.bincount(outputs_types[outputs_start], minlength=types_num).tolist()
+        counts['correct_chunk'] = np.bincount(correct_chunks_types, minlength=types_num).tolist()
+        return counts
+
+    @staticmethod
+    def get_scores(correct_chunk, found_guessed, found_correct):
+        precision = 100*correct_chunk/found_guessed if found_guessed > 0 else 0.0
+        recall = 100*correct_chunk/found_correct if found_correct > 0 else 0.0
+        f1 = 2*precision*recall/(precision + recall) if precision + recall > 0 else 0.0
+        return precision, recall, f1
+
+    @staticmethod
+    def get_report_str(counts):
+        correct_chunk = sum(counts['correct_chunk'])
+        found_guessed = sum(counts['found_guessed'])
+        found_correct = sum(counts['found_correct'])
+        precision, recall, f1 = ConllEvaluator.get_scores(correct_chunk, found_guessed, found_correct)
+        report_str = 'processed %d tokens with %d phrases; ' % (counts['tokens_num'], found_correct)
+        report_str += 'found: %d phrases; correct: %d.\n' % (found_guessed, correct_chunk)
+        if counts['tokens_num'] > 0:
+            report_str += 'accuracy: %6.2f%%; ' % (100*counts['correct_tags_num']/counts['tokens_num'])
+            report_str += 'precision: %6.2f%%; recall: %6.2f%%; FB1: %6.2f\n' % (precision, recall, f1)
+        # Types are listed as in perl: sorted keys of both hashes, repeats of the empty type are not removed
+        sorted_types = list()
+        keys = [k for k, n in enumerate(counts['found_correct']) if n > 0] + \
+               [k for k, n in enumerate(counts['found_guessed']) if n > 0]
+        last_type = None
+        for tag_type in sorted([counts['types_list'][k] for k in keys]):
+            if not last_type or last_type != tag_type:
+                sorted_types.append(tag_type)
+            last_type = tag_type
+        for tag_type in sorted_types:
+            k = counts['types_list'].index(tag_type)
+            precision, recall, f1 = ConllEvaluator.get_scores(counts['correct_chunk'][k], counts['found_guessed'][k],
+                                                              counts['found_correct'][k])
+            report_str += '%17s: precision: %6.2f%%; recall: %6.2f%%; FB1: %6.2f  %d\n' % (tag_type, precision, recall,
+                                                                                          f1, counts['found_guessed'][k])
+        return report_str
+
+    @staticmethod
+    def get_f1(word_sequences, targets_tag_sequences, outputs_tag_sequences):
+        counts = ConllEvaluator.get_counts(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+        _, _, f1 = ConllEvaluator.get_scores(sum(counts['correct_chunk']), sum(counts['found_guessed']),
+                                             sum(counts['found_correct']))
+        # F1 score is rounded the same way as in the text output of the perl script
+        return float('%1.2f' % f1), ConllEvaluator.header_str + ConllEvaluator.get_report_str(counts)
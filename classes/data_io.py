@@ -5,30 +5,31 @@
 .. moduleauthor:: Artem Chernodub
 """
 
-import codecs
 from classes.utils import is_number, get_words_num
 
 class DataIO():
     @staticmethod
-    def read_CoNNL_dat_abs(fn, verbose, column_no=-1):
-        word_sequences = list()
-        tag_sequences = list()
+    def read_CoNNL_dat_abs_stream(fn, column_no=-1):
+        # Yields (words, tags) of the documents one by one from the buffered stream, each line with less than 3 columns
+        # ends the document
         curr_words = list()
         curr_tags = list()
-        with codecs.open(fn, 'r', 'utf-8') as f:
-            lines = f.readlines()
-        for k, line in enumerate(lines):
-            elements = line.strip().split('\t')
-            if len(elements) < 3: # end of the document
-                word_sequences.append(curr_words)
-                tag_sequences.append(curr_tags)
-                curr_words = list()
-                curr_tags = list()
-                continue
-            word = elements[1]
-            tag = elements[2].split(':')[0]
-            curr_words.append(word)
-            curr_tags.append(tag)
+        with open(fn, 'r', encoding='utf-8') as f:
+            for line in f:
+                elements = line.strip().split('\t')
+                if len(elements) < 3: # end of the document
+                    yield curr_words, curr_tags
+                    curr_words = list()
+                    curr_tags = list()
+                    continue
+                word = elements[1]
+                tag = elements[2].split(':')[0]
+                curr_words.append(word)
+                curr_tags.append(tag)
+
+    @staticmethod
+    def read_CoNNL_dat_abs(fn, verbose, column_no=-1):
+        word_sequences, tag_sequences = DataIO.get_sequences_from_stream(DataIO.read_CoNNL_dat_abs_stream(fn, column_no))
         if verbose:
             print('Loading from %s: %d samples, %d words.' % (fn, len(word_sequences), get_words_num(word_sequences)))
         return word_sequences, tag_sequences
@@ -42,30 +43,30 @@ class DataIO():
                 text_file.write('\n')
 
     @staticmethod
-    def read_CoNNL_2003(fn, verbose, column_no=-1):
-        word_sequences = list()
-        tag_sequences = list()
-        with codecs.open(fn, 'r', 'utf-8') as f:
-            lines = f.readlines()
+    def read_CoNNL_2003_stream(fn, column_no=-1):
+        # Yields (words, tags) of the sentences one by one from the buffered stream
         curr_words = list()
         curr_tags = list()
-        for k in range(len(lines)):
-            line = lines[k].strip()
-            if len(line) == 0 or line.startswith('-DOCSTART-'): # new sentence or new document
-                if len(curr_words) > 0:
-                    word_sequences.append(curr_words)
-                    tag_sequences.append(curr_tags)
-                    curr_words = list()
-                    curr_tags = list()
-                continue
-            strings = line.split(' ')
-            word = strings[0]
-            tag = strings[column_no] # be default, we take the last tag
-            curr_words.append(word)
-            curr_tags.append(tag)
-            if k == len(lines) - 1:
-                word_sequences.append(curr_words)
-                tag_sequences.append(curr_tags)
+        with open(fn, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line.startswith('-DOCSTART-'): # new sentence or new document
+                    if len(curr_words) > 0:
+                        yield curr_words, curr_tags
+                        curr_words = list()
+                        curr_tags = list()
+                    continue
+                strings = line.split(' ')
+                word = strings[0]
+                tag = strings[column_no] # be default, we take the last tag
+                curr_words.append(word)
+                curr_tags.append(tag)
+        if len(curr_words) > 0: # the last sentence without the empty line after it
+            yield curr_words, curr_tags
+
+    @staticmethod
+    def read_CoNNL_2003(fn, verbose, column_no=-1):
+        word_sequences, tag_sequences = DataIO.get_sequences_from_stream(DataIO.read_CoNNL_2003_stream(fn, column_no))
         if verbose:
             print('Loading from %s: %d samples, %d words.' % (fn, len(word_sequences), get_words_num(word_sequences)))
         return word_sequences, tag_sequences
@@ -85,10 +86,27 @@ class DataIO():
 
     @staticmethod
     def __is_CoNNL_dat_abs(fn):
-        with codecs.open(fn, 'r', 'utf-8') as f:
-            c = f.readlines()[0][0]
+        # Only the first line of the file is read
+        with open(fn, 'r', encoding='utf-8') as f:
+            c = f.readline()[0]
             return is_number(c)
 
+    @staticmethod
+    def get_sequences_from_stream(word_tag_sequences):
+        word_sequences = list()
+        tag_sequences = list()
+        for words, tags in word_tag_sequences:
+            word_sequences.append(words)
+            tag_sequences.append(tags)
+        return word_sequences, tag_sequences
+
+    @staticmethod
+    def read_CoNNL_universal_stream(fn, column_no=-1):
+        if DataIO.__is_CoNNL_dat_abs(fn):
+            return DataIO.read_CoNNL_dat_abs_stream(fn, column_no)
+        else:
+            return DataIO.read_CoNNL_2003_stream(fn, column_no)
+
     @staticmethod
     def read_CoNNL_universal(fn, verbose=True, column_no=-1):
         if DataIO.__is_CoNNL_dat_abs(fn):
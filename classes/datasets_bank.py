@@ -8,6 +8,9 @@
 from random import randint
 import numpy as np
 from classes.utils import argsort_sequences_by_lens, get_sequences_by_indices
+from classes.indexed_dataset import IndexedDataset
+from classes.mmap_corpus import IndexedMmapCorpus
+from classes.vocabulary import Vocabulary
 
 class DatasetsBank():
     """
@@ -15,15 +18,20 @@ class DatasetsBank():
 
     def __init__(self, verbose=True):
         self.verbose = verbose
-        self.unique_words_list = list()
+        self.vocabulary = Vocabulary()
+        self.corpus_train = None
+        self.indexed_train = None
+        self.indexed_dev = None
+        self.indexed_test = None
+
+    @property
+    def unique_words_list(self):
+        return self.vocabulary.get_words_list()
 
     def __add_to_unique_words_list(self, word_sequences):
-        for word_seq in word_sequences:
-            for word in word_seq:
-                if word not in self.unique_words_list:
-                    self.unique_words_list.append(word)
+        self.vocabulary.add_word_sequences(word_sequences)
         if self.verbose:
-            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.unique_words_list)))
+            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.vocabulary)))
 
     def add_train_sequences(self, word_sequences_train, tag_sequences_train):
         self.train_data_num = len(word_sequences_train)
@@ -31,6 +39,16 @@ class DatasetsBank():
         self.tag_sequences_train = tag_sequences_train
         self.__add_to_unique_words_list(word_sequences_train)
 
+    def add_train_corpus(self, corpus_train):
+        # Train sequences are decoded from the memory-mapped corpus on demand, its words are counted in advance
+        self.corpus_train = corpus_train
+        self.train_data_num = len(corpus_train)
+        self.word_sequences_train = corpus_train.word_sequences
+        self.tag_sequences_train = corpus_train.tag_sequences
+        self.vocabulary.add_words_counts(corpus_train.words_list, corpus_train.word_counts.tolist())
+        if self.verbose:
+            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.vocabulary)))
+
     def add_dev_sequences(self, word_sequences_dev, tag_sequences_dev):
         self.word_sequences_dev = word_sequences_dev
         self.tag_sequences_dev = tag_sequences_dev
@@ -41,30 +59,59 @@ class DatasetsBank():
         self.tag_sequences_test = tag_sequences_test
         self.__add_to_unique_words_list(word_sequences_test)
 
+    def index_sequences(self, tagger):
+        # Convert words, characters and tags of all subsets to indices once, batches are sliced from them later
+        if self.corpus_train is not None:
+            self.indexed_train = IndexedMmapCorpus(tagger, self.corpus_train)
+        else:
+            self.indexed_train = IndexedDataset(tagger, self.word_sequences_train, self.tag_sequences_train)
+        self.indexed_dev = IndexedDataset(tagger, self.word_sequences_dev, self.tag_sequences_dev)
+        self.indexed_test = IndexedDataset(tagger, self.word_sequences_test, self.tag_sequences_test)
+        if self.verbose:
+            print('DatasetsBank: %d/%d/%d words are indexed in train/dev/test.' % (len(self.indexed_train.word_idx),
+                                                                                  len(self.indexed_dev.word_idx),
+                                                                                  len(self.indexed_test.word_idx)))
+
     def __get_train_batch(self, batch_indices):
         word_sequences_train_batch = [self.word_sequences_train[i] for i in batch_indices]
         tag_sequences_train_batch = [self.tag_sequences_train[i] for i in batch_indices]
         return word_sequences_train_batch, tag_sequences_train_batch
 
-    def get_train_batches(self, batch_size):
+    def get_train_batches_indices(self, batch_size):
         random_indices = np.random.permutation(np.arange(self.train_data_num))
-        for k in range(self.train_data_num // batch_size): # oh yes, we drop the last batch
-            batch_indices = random_indices[k:k + batch_size].tolist()
+        return [random_indices[k*batch_size:(k + 1)*batch_size].tolist()
+                for k in range(self.train_data_num // batch_size)] # oh yes, we drop the last batch
+
+    def get_train_batches(self, batch_size):
+        for batch_indices in self.get_train_batches_indices(batch_size):
             word_sequences_train_batch, tag_sequences_train_batch = self.__get_train_batch(batch_indices)
             yield word_sequences_train_batch, tag_sequences_train_batch
 
+    def get_indexed_train_batches(self, batch_size):
+        return self.get_indexed_train_batches_by_indices(self.get_train_batches_indices(batch_size))
+
+    def get_indexed_train_batches_by_indices(self, batches_indices):
+        for batch_indices in batches_indices:
+            yield self.indexed_train.get_batch(batch_indices)
+
 class DatasetsBankSorted():
     def __init__(self, verbose=True):
         self.verbose = verbose
-        self.unique_words_list = list()
+        self.vocabulary = Vocabulary()
+        self.corpus_train = None
+        self.train_sort_indices = None
+        self.indexed_train = None
+        self.indexed_dev = None
+        self.indexed_test = None
+
+    @property
+    def unique_words_list(self):
+        return self.vocabulary.get_words_list()
 
     def __add_to_unique_words_list(self, word_sequences):
-        for word_seq in word_sequences:
-            for word in word_seq:
-                if word not in self.unique_words_list:
-                    self.unique_words_list.append(word)
+        self.vocabulary.add_word_sequences(word_sequences)
         if self.verbose:
-            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.unique_words_list)))
+            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.vocabulary)))
 
     def add_train_sequences(self, word_sequences_train, tag_sequences_train):
         sort_indices, _ = argsort_sequences_by_lens(word_sequences_train)
@@ -73,6 +120,17 @@ class DatasetsBankSorted():
         self.train_data_num = len(word_sequences_train)
         self.__add_to_unique_words_list(word_sequences_train)
 
+    def add_train_corpus(self, corpus_train):
+        # Memory-mapped train sequences keep the order of the file, they are sorted by lengths through the indices
+        self.corpus_train = corpus_train
+        self.train_sort_indices = np.argsort(-corpus_train.seq_len, kind='mergesort')
+        self.train_data_num = len(corpus_train)
+        self.word_sequences_train = corpus_train.word_sequences
+        self.tag_sequences_train = corpus_train.tag_sequences
+        self.vocabulary.add_words_counts(corpus_train.words_list, corpus_train.word_counts.tolist())
+        if self.verbose:
+            print('DatasetsBank: len(unique_words_list) = %d unique words.' % (len(self.vocabulary)))
+
     def add_dev_sequences(self, word_sequences_dev, tag_sequences_dev):
         self.word_sequences_dev = word_sequences_dev
         self.tag_sequences_dev = tag_sequences_dev
@@ -83,9 +141,26 @@ class DatasetsBankSorted():
         self.tag_sequences_test = tag_sequences_test
         self.__add_to_unique_words_list(word_sequences_test)
 
+    def index_sequences(self, tagger):
+        # Convert words, characters and tags of all subsets to indices once, batches are sliced from them later
+        if self.corpus_train is not None:
+            self.indexed_train = IndexedMmapCorpus(tagger, self.corpus_train)
+        else:
+            self.indexed_train = IndexedDataset(tagger, self.word_sequences_train, self.tag_sequences_train)
+        self.indexed_dev = IndexedDataset(tagger, self.word_sequences_dev, self.tag_sequences_dev)
+        self.indexed_test = IndexedDataset(tagger, self.word_sequences_test, self.tag_sequences_test)
+        if self.verbose:
+            print('DatasetsBank: %d/%d/%d words are indexed in train/dev/test.' % (len(self.indexed_train.word_idx),
+                                                                                  len(self.indexed_dev.word_idx),
+                                                                                  len(self.indexed_test.word_idx)))
+
     def __get_train_batch(self, batch_size, batch_no, rand_seed=0):
         i = batch_no * batch_size + rand_seed
         j = min((batch_no + 1) * batch_size, self.train_data_num + 1) + rand_seed
+        if self.train_sort_indices is not None:
+            batch_indices = self.train_sort_indices[i:j].tolist()
+            return [self.word_sequences_train[k] for k in batch_indices], \
+                   [self.tag_sequences_train[k] for k in batch_indices]
         return self.word_sequences_train[i:j], self.tag_sequences_train[i:j]
 
     def get_train_batches(self, batch_size):
@@ -95,6 +170,24 @@ class DatasetsBankSorted():
         for k in random_indices:
             yield self.__get_train_batch(batch_size, batch_no=k, rand_seed=rand_seed)
 
+    def get_train_batches_indices(self, batch_size):
+        # Batches of the indexed train data are the random slices of the sorted sequences
+        rand_seed = randint(0, batch_size - 1)
+        batch_num = self.train_data_num // batch_size
+        random_indices = np.random.permutation(np.arange(batch_num - 1)).tolist()
+        batches_indices = [np.arange(k * batch_size + rand_seed, min((k + 1) * batch_size + rand_seed,
+                                                                     self.train_data_num)) for k in random_indices]
+        if self.train_sort_indices is not None:
+            batches_indices = [self.train_sort_indices[batch_indices] for batch_indices in batches_indices]
+        return batches_indices
+
+    def get_indexed_train_batches(self, batch_size):
+        return self.get_indexed_train_batches_by_indices(self.get_train_batches_indices(batch_size))
+
+    def get_indexed_train_batches_by_indices(self, batches_indices):
+        for batch_indices in batches_indices:
+            yield self.indexed_train.get_batch(batch_indices)
+
     def __get_train_batch_regularized(self, batch_size, rand_batch_size, batch_no):
         i = batch_no * batch_size
         j = min((batch_no + 1) * batch_size, self.train_data_num + 1)
@@ -0,0 +1,133 @@
+"""
+.. module:: EmbeddingsCache
+    :synopsis: EmbeddingsCache parses the text file with pretrained embeddings once into the binary cache (list of words
+    and float32 .npy matrix) and memory-maps this cache for the next runs, or keeps the parsed embeddings in memory.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+def parse_embeddings_chunk(args):
+    # Parses lines that start inside the byte range [start, end) of the text file with embeddings
+    emb_fn, emb_delimiter, start, end = args
+    words_list, vectors_list = list(), list()
+    with open(emb_fn, 'rb') as f:
+        if start > 0:
+            f.seek(start - 1)
+            f.readline() # skip the tail of the line which belongs to the previous chunk
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            values = line.decode('utf-8').split(emb_delimiter)
+            if len(values) < 5:
+                continue
+            words_list.append(values[0])
+            vectors_list.append([value for value in values[1:] if value and not value.isspace()])
+    if len(vectors_list) == 0:
+        return words_list, np.zeros((0, 0), dtype=np.float32)
+    # Values are parsed as float64 and then rounded to float32, the same as torch.FloatTensor(list of floats)
+    return words_list, np.asarray(vectors_list, dtype=np.float64).astype(np.float32)
+
+class EmbeddingsCache():
+    def __init__(self, emb_fn, emb_delimiter, workers_num=1, chunk_size=64*1024*1024, use_cache=True, verbose=True):
+        self.emb_fn = emb_fn
+        self.emb_delimiter = emb_delimiter
+        self.workers_num = workers_num
+        self.chunk_size = chunk_size
+        self.use_cache = use_cache
+        self.verbose = verbose
+        # Cache files are written next to the embeddings file, the first line of the words file keeps the size and the
+        # modification time of the embeddings file and the delimiter the cache was built with
+        self.words_fn = emb_fn + '.words.txt'
+        self.matrix_fn = emb_fn + '.npy'
+        if self.use_cache and self.is_cache_valid():
+            self.load_cache()
+        else:
+            words_list, chunks_matrices, emb_dim = self.parse_embeddings_file()
+            if self.use_cache and self.write_cache(words_list, chunks_matrices, emb_dim):
+                self.load_cache()
+            else:
+                self.words_list = words_list
+                self.matrix = np.concatenate(chunks_matrices) # words_num x emb_dim
+        self.word2row_dict = dict()
+        for row, word in enumerate(self.words_list): # the first occurrence of the word in the embeddings file wins
+            if word not in self.word2row_dict:
+                self.word2row_dict[word] = row
+
+    def get_source_info(self):
+        stat = os.stat(self.emb_fn)
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'delimiter': self.emb_delimiter}
+
+    def is_cache_valid(self):
+        if not os.path.isfile(self.words_fn) or not os.path.isfile(self.matrix_fn):
+            return False
+        try:
+            with open(self.words_fn, 'r', encoding='utf-8', newline='') as f:
+                source_info = json.loads(f.readline())
+        except (OSError, ValueError):
+            return False
+        return source_info == self.get_source_info()
+
+    def get_chunks_args(self):
+        file_size = os.path.getsize(self.emb_fn)
+        chunks_num = max(1, min(max(1, self.workers_num) * 4, -(-file_size // self.chunk_size)))
+        bounds = np.linspace(0, file_size, chunks_num + 1).astype(np.int64).tolist()
+        return [(self.emb_fn, self.emb_delimiter, bounds[i], bounds[i + 1]) for i in range(chunks_num)]
+
+    def parse_embeddings_file(self):
+        chunks_args = self.get_chunks_args()
+        if self.workers_num > 1 and len(chunks_args) > 1:
+            with Pool(min(self.workers_num, len(chunks_args))) as pool:
+                chunks = pool.map(parse_embeddings_chunk, chunks_args)
+        else:
+            chunks = [parse_embeddings_chunk(chunk_args) for chunk_args in chunks_args]
+        words_list = [word for chunk_words_list, _ in chunks for word in chunk_words_list]
+        emb_dim = max([chunk_matrix.shape[1] for _, chunk_matrix in chunks])
+        if self.verbose:
+            print('EmbeddingsCache: %d words with %d-dimensional vectors are read from %s.' % (len(words_list), emb_dim,
+                                                                                           self.emb_fn))
+        chunks_matrices = [chunk_matrix.reshape(len(chunk_words_list), emb_dim) for chunk_words_list, chunk_matrix in chunks]
+        return words_list, chunks_matrices, emb_dim
+
+    def write_cache(self, words_list, chunks_matrices, emb_dim):
+        try:
+            matrix = np.lib.format.open_memmap(self.matrix_fn + '.tmp', mode='w+', dtype=np.float32,
+                                               shape=(len(words_list), emb_dim))
+            row = 0
+            for chunk_matrix in chunks_matrices:
+                matrix[row:row + chunk_matrix.shape[0]] = chunk_matrix
+                row += chunk_matrix.shape[0]
+            matrix.flush()
+            del matrix
+            with open(self.words_fn + '.tmp', 'w', encoding='utf-8', newline='') as f:
+                f.write(json.dumps(self.get_source_info()) + '\n')
+                f.write('\n'.join(words_list))
+            os.replace(self.matrix_fn + '.tmp', self.matrix_fn)
+            os.replace(self.words_fn + '.tmp', self.words_fn)
+            return True
+        except OSError as e:
+            # Read-only location of the embeddings file, the parsed embeddings are kept in memory
+            if self.verbose:
+                print('EmbeddingsCache: can not write the cache next to %s (%s).' % (self.emb_fn, str(e)))
+            for fn in [self.matrix_fn + '.tmp', self.words_fn + '.tmp']:
+                if os.path.isfile(fn):
+                    os.remove(fn)
+            return False
+
+    def load_cache(self):
+        with open(self.words_fn, 'r', encoding='utf-8', newline='') as f:
+            f.readline()
+            words_str = f.read()
+        self.words_list = words_str.split('\n') if len(words_str) > 0 else list()
+        self.matrix = np.load(self.matrix_fn, mmap_mode='r') # words_num x emb_dim
+        if self.verbose:
+            print('EmbeddingsCache: %d words are loaded from %s.' % (len(self.words_list), self.matrix_fn))
+
+    def get_emb_vector(self, word):
+        return np.array(self.matrix[self.word2row_dict[word]])
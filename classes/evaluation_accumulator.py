@@ -0,0 +1,73 @@
+"""
+.. module:: EvaluationAccumulator
+    :synopsis: EvaluationAccumulator keeps running chunk-level and token-level counts, it can be fed batch by batch and
+    merged with accumulators of other workers or shards.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+from classes.conll_evaluator import ConllEvaluator
+
+class EvaluationAccumulator():
+    def __init__(self):
+        self.found_correct = dict() # chunk type -> number of target chunks (TP + FN)
+        self.found_guessed = dict() # chunk type -> number of output chunks (TP + FP)
+        self.correct_chunk = dict() # chunk type -> number of correct chunks (TP)
+        self.conll_tokens_num = 0 # tokens without sentence boundaries, as counted by conlleval
+        self.conll_correct_tags_num = 0
+        self.tokens_num = 0
+        self.correct_tokens_num = 0
+
+    def add(self, word_sequences, targets_tag_sequences, outputs_tag_sequences):
+        # Sentences are independent, so the counts of the batch are simply added to the running counts
+        counts = ConllEvaluator.get_counts(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+        for k, tag_type in enumerate(counts['types_list']):
+            for counts_dict, key in [(self.found_correct, 'found_correct'), (self.found_guessed, 'found_guessed'),
+                                     (self.correct_chunk, 'correct_chunk')]:
+                if counts[key][k] > 0:
+                    counts_dict[tag_type] = counts_dict.get(tag_type, 0) + counts[key][k]
+        self.conll_tokens_num += counts['tokens_num']
+        self.conll_correct_tags_num += counts['correct_tags_num']
+        for targets_tag_seq, outputs_tag_seq in zip(targets_tag_sequences, outputs_tag_sequences):
+            self.tokens_num += len(targets_tag_seq)
+            self.correct_tokens_num += sum(target_tag == output_tag for target_tag, output_tag
+                                           in zip(targets_tag_seq, outputs_tag_seq))
+
+    def merge(self, accumulator):
+        for counts_dict, other_counts_dict in [(self.found_correct, accumulator.found_correct),
+                                               (self.found_guessed, accumulator.found_guessed),
+                                               (self.correct_chunk, accumulator.correct_chunk)]:
+            for tag_type, n in other_counts_dict.items():
+                counts_dict[tag_type] = counts_dict.get(tag_type, 0) + n
+        self.conll_tokens_num += accumulator.conll_tokens_num
+        self.conll_correct_tags_num += accumulator.conll_correct_tags_num
+        self.tokens_num += accumulator.tokens_num
+        self.correct_tokens_num += accumulator.correct_tokens_num
+        return self
+
+    def __add__(self, accumulator):
+        return EvaluationAccumulator().merge(self).merge(accumulator)
+
+    def get_TP_FP_FN(self, tag_type=None):
+        if tag_type is None:
+            TP = sum(self.correct_chunk.values())
+            return TP, sum(self.found_guessed.values()) - TP, sum(self.found_correct.values()) - TP
+        TP = self.correct_chunk.get(tag_type, 0)
+        return TP, self.found_guessed.get(tag_type, 0) - TP, self.found_correct.get(tag_type, 0) - TP
+
+    def get_f1(self):
+        TP, FP, FN = self.get_TP_FP_FN()
+        _, _, f1 = ConllEvaluator.get_scores(TP, TP + FP, TP + FN)
+        return float('%1.2f' % f1) # rounded as in the text output of conlleval
+
+    def get_accuracy(self):
+        return (self.correct_tokens_num / max(self.tokens_num, 1)) * 100
+
+    def get_connl_str(self):
+        types_list = sorted(set(self.found_correct.keys()) | set(self.found_guessed.keys()))
+        counts = {'types_list': types_list, 'tokens_num': self.conll_tokens_num,
+                  'correct_tags_num': self.conll_correct_tags_num}
+        for counts_dict, key in [(self.found_correct, 'found_correct'), (self.found_guessed, 'found_guessed'),
+                                 (self.correct_chunk, 'correct_chunk')]:
+            counts[key] = [counts_dict.get(tag_type, 0) for tag_type in types_list]
+        return ConllEvaluator.header_str + ConllEvaluator.get_report_str(counts)
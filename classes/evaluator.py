@@ -5,12 +5,14 @@
 .. moduleauthor:: Artem Chernodub
 """
 
+import itertools
 import os
 import os.path
 import random
 import time
-from sklearn.metrics import accuracy_score # f1_score, precision_score, recall_score
+from classes.conll_evaluator import ConllEvaluator
 from classes.data_io import DataIO
+from classes.evaluation_accumulator import EvaluationAccumulator
 from classes.tag_component import TagComponent
 
 class Evaluator():
@@ -18,9 +20,10 @@ class Evaluator():
     def get_accuracy_from_sequences_token_level(targets_tag_sequences, outputs_tag_sequences, tag_seq_indexer):
         targets_idx = tag_seq_indexer.items2idx(targets_tag_sequences)
         outputs_idx = tag_seq_indexer.items2idx(outputs_tag_sequences)
-        y_true = [i for sequence in targets_idx for i in sequence]
-        y_pred = [i for sequence in outputs_idx for i in sequence]
-        return accuracy_score(y_true, y_pred) * 100
+        tokens_num = sum(len(sequence) for sequence in targets_idx)
+        correct_tokens_num = sum(i == j for targets_seq, outputs_seq in zip(targets_idx, outputs_idx)
+                                 for i, j in zip(targets_seq, outputs_seq))
+        return (correct_tokens_num / max(tokens_num, 1)) * 100
 
     @staticmethod
     def get_acuracy_token_level(tagger, word_sequences, targets_tag_sequences, outputs_tag_sequences=None):
@@ -33,6 +36,15 @@ class Evaluator():
 
     @staticmethod
     def get_f1_connl_script(tagger, word_sequences, targets_tag_sequences, outputs_tag_sequences=None, fn_out=None):
+        if outputs_tag_sequences is None:
+            outputs_tag_sequences = tagger.predict_tags_from_words(word_sequences)
+        if fn_out is not None:
+            DataIO.write_CoNNL_2003_two_columns(fn_out, word_sequences, targets_tag_sequences, outputs_tag_sequences)
+        return ConllEvaluator.get_f1(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+
+    @staticmethod
+    def get_f1_connl_perl_script(tagger, word_sequences, targets_tag_sequences, outputs_tag_sequences=None, fn_out=None):
+        # Runs the original perl script, it may be used to check the in-process evaluation
         if fn_out == None:
             fn_out = 'out_temp_%04d.txt' % random.randint(0, 10000)
         if os.path.isfile(fn_out):
@@ -49,73 +61,100 @@ class Evaluator():
         f1 = float(connl_str.split('\n')[3].split(':')[-1].strip())
         return f1, connl_str
 
+    @staticmethod
+    def get_accumulator(tagger, word_sequences, targets_tag_sequences, indexed_dataset=None, indices=None,
+                        batch_size=-1):
+        # Tags and scores the dataset or its subset selected by indices, pre-indexed data is used if available
+        if indices is not None:
+            word_sequences = [word_sequences[i] for i in indices]
+            targets_tag_sequences = [targets_tag_sequences[i] for i in indices]
+        if indexed_dataset is not None:
+            outputs_tag_sequences = tagger.predict_tags_from_indexed_dataset(indexed_dataset, batch_size=batch_size,
+                                                                             indices=indices)
+        else:
+            outputs_tag_sequences = tagger.predict_tags_from_words(word_sequences, batch_size=batch_size)
+        accumulator = EvaluationAccumulator()
+        accumulator.add(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+        return accumulator
+
     @staticmethod
     def get_evaluation_train_dev_test(tagger, datasets_bank, batch_size=-1):
         if batch_size == -1:
             batch_size = tagger.batch_size
-        outputs_tag_sequences_train = tagger.predict_tags_from_words(word_sequences=datasets_bank.word_sequences_train,
-                                                                     batch_size=batch_size)
-        outputs_tag_sequences_dev = tagger.predict_tags_from_words(word_sequences=datasets_bank.word_sequences_dev,
-                                                                     batch_size=batch_size)
-        outputs_tag_sequences_test = tagger.predict_tags_from_words(word_sequences=datasets_bank.word_sequences_test,
-                                                                     batch_size=batch_size)
-        f1_train, _ = Evaluator.get_f1_connl_script(tagger=tagger,
-                                                    word_sequences=datasets_bank.word_sequences_train,
-                                                    targets_tag_sequences=datasets_bank.tag_sequences_train,
-                                                    outputs_tag_sequences=outputs_tag_sequences_train)
-        f1_dev, _ = Evaluator.get_f1_connl_script(tagger=tagger,
-                                                  word_sequences=datasets_bank.word_sequences_dev,
-                                                  targets_tag_sequences=datasets_bank.tag_sequences_dev,
-                                                  outputs_tag_sequences=outputs_tag_sequences_dev)
-        f1_test, test_connl_str = Evaluator.get_f1_connl_script(tagger=tagger,
-                                                   word_sequences=datasets_bank.word_sequences_test,
-                                                   targets_tag_sequences=datasets_bank.tag_sequences_test,
-                                                   outputs_tag_sequences=outputs_tag_sequences_test)
+        accumulator_train = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_train,
+                                                      datasets_bank.tag_sequences_train, datasets_bank.indexed_train,
+                                                      batch_size=batch_size)
+        accumulator_dev = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_dev,
+                                                    datasets_bank.tag_sequences_dev, datasets_bank.indexed_dev,
+                                                    batch_size=batch_size)
+        accumulator_test = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_test,
+                                                     datasets_bank.tag_sequences_test, datasets_bank.indexed_test,
+                                                     batch_size=batch_size)
+        f1_train, f1_dev, f1_test = accumulator_train.get_f1(), accumulator_dev.get_f1(), accumulator_test.get_f1()
+        acc_train, acc_dev = accumulator_train.get_accuracy(), accumulator_dev.get_accuracy()
+        acc_test = accumulator_test.get_accuracy()
+        test_connl_str = accumulator_test.get_connl_str()
+        return f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test, test_connl_str
 
-        acc_train = Evaluator.get_acuracy_token_level(tagger=tagger,
-                                                      word_sequences=datasets_bank.word_sequences_train,
-                                                      targets_tag_sequences=datasets_bank.tag_sequences_train,
-                                                      outputs_tag_sequences=outputs_tag_sequences_train)
-        acc_dev = Evaluator.get_acuracy_token_level(tagger=tagger,
-                                                    word_sequences=datasets_bank.word_sequences_dev,
-                                                    targets_tag_sequences=datasets_bank.tag_sequences_dev,
-                                                    outputs_tag_sequences=outputs_tag_sequences_dev)
-        acc_test = Evaluator.get_acuracy_token_level(tagger=tagger,
-                                                     word_sequences=datasets_bank.word_sequences_test,
-                                                     targets_tag_sequences=datasets_bank.tag_sequences_test,
-                                                     outputs_tag_sequences=outputs_tag_sequences_test)
+    @staticmethod
+    def get_evaluation_epoch(tagger, datasets_bank, eval_train_num=-1, eval_train_indices=None,
+                             eval_test_on_dev_improvement=False, best_f1_dev=-1, batch_size=100):
+        # Scores of one epoch according to the evaluation schedule, skipped scores are None
+        f1_train, acc_train = None, None
+        if eval_train_num != 0:
+            accumulator_train = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_train,
+                                                          datasets_bank.tag_sequences_train, datasets_bank.indexed_train,
+                                                          indices=eval_train_indices, batch_size=batch_size)
+            f1_train, acc_train = accumulator_train.get_f1(), accumulator_train.get_accuracy()
+        accumulator_dev = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_dev,
+                                                    datasets_bank.tag_sequences_dev, datasets_bank.indexed_dev,
+                                                    batch_size=batch_size)
+        f1_dev, acc_dev = accumulator_dev.get_f1(), accumulator_dev.get_accuracy()
+        f1_test, acc_test, test_connl_str = None, None, None
+        if not eval_test_on_dev_improvement or f1_dev > best_f1_dev:
+            accumulator_test = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_test,
+                                                         datasets_bank.tag_sequences_test, datasets_bank.indexed_test,
+                                                         batch_size=batch_size)
+            f1_test, acc_test = accumulator_test.get_f1(), accumulator_test.get_accuracy()
+            test_connl_str = accumulator_test.get_connl_str()
         return f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test, test_connl_str
 
+    @staticmethod
+    def get_accumulator_from_stream(tagger, word_tag_sequences, batch_size=-1, window_size=-1, chunk_size=1000,
+                                    accumulator=None):
+        # word_tag_sequences is any iterable of (words, target tags) pairs, it is tagged and scored on the fly;
+        # only the look-ahead window of the tagger and chunk_size scored sequences are kept in memory
+        if accumulator is None:
+            accumulator = EvaluationAccumulator()
+        pairs_for_tagger, pairs_for_scoring = itertools.tee(word_tag_sequences)
+        outputs_tag_sequences = tagger.predict_tags_stream((word_seq for word_seq, _ in pairs_for_tagger),
+                                                           batch_size=batch_size, window_size=window_size)
+        chunk = list()
+        for (word_seq, targets_tag_seq), outputs_tag_seq in zip(pairs_for_scoring, outputs_tag_sequences):
+            chunk.append((word_seq, targets_tag_seq, outputs_tag_seq))
+            if len(chunk) == chunk_size:
+                accumulator.add(*zip(*chunk))
+                chunk = list()
+        if len(chunk) > 0:
+            accumulator.add(*zip(*chunk))
+        return accumulator
+
     @staticmethod
     def get_f1_components_from_words(targets_tag_sequences, outputs_tag_sequences, match_alpha_ratio=0.999):
-        targets_tag_components_sequences = TagComponent.extract_tag_components_sequences(targets_tag_sequences)
-        outputs_tag_components_sequences = TagComponent.extract_tag_components_sequences(outputs_tag_sequences)
-        return Evaluator.__get_f1_components_from_sequences(targets_tag_components_sequences,
-                                                            outputs_tag_components_sequences,
-                                                            match_alpha_ratio)
+        # Pairs of target and output sequences share the same range of global positions
+        seq_len_list = [max(len(targets_tags), len(outputs_tags)) for targets_tags, outputs_tags
+                        in zip(targets_tag_sequences, outputs_tag_sequences)]
+        class2idx_dict = dict()
+        targets_spans = TagComponent.extract_spans(targets_tag_sequences, class2idx_dict, seq_len_list)
+        outputs_spans = TagComponent.extract_spans(outputs_tag_sequences, class2idx_dict, seq_len_list)
+        return Evaluator.__get_f1_components_from_spans(targets_spans, outputs_spans, match_alpha_ratio)
 
     @staticmethod
-    def __get_f1_components_from_sequences(targets_tag_components_sequences, outputs_tag_components_sequences, match_alpha_ratio):
-        TP, FN, FP = 0, 0, 0
-        for targets_tag_components, outputs_tag_components in zip(targets_tag_components_sequences, outputs_tag_components_sequences):
-            for target_tc in targets_tag_components:
-                found = False
-                for output_tc in outputs_tag_components:
-                    if output_tc.is_equal(target_tc, match_alpha_ratio):
-                        found = True
-                        break
-                if found:
-                    TP += 1
-                else:
-                    FN += 1
-            for output_tc in outputs_tag_components:
-                found = False
-                for target_tc in targets_tag_components:
-                    if target_tc.is_equal(output_tc, match_alpha_ratio):
-                        found = True
-                        break
-                if not found:
-                    FP += 1
+    def __get_f1_components_from_spans(targets_spans, outputs_spans, match_alpha_ratio):
+        is_matched_targets, is_matched_outputs = TagComponent.match_spans(targets_spans, outputs_spans, match_alpha_ratio)
+        TP = int(is_matched_targets.sum())
+        FN = len(targets_spans) - TP
+        FP = len(outputs_spans) - int(is_matched_outputs.sum())
         Precision = (TP / max(TP + FP, 1))*100
         Recall = (TP / max(TP + FN, 1))*100
         F1 = (2 * TP / max(2 * TP + FP + FN, 1))*100
@@ -0,0 +1,71 @@
+"""
+.. module:: IndexedDataset
+    :synopsis: IndexedDataset stores the dataset as flat arrays of word, char and tag indices and slices batches from them.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import numpy as np
+import torch
+
+from classes.batch import Batch
+
+class IndexedDataset():
+    def __init__(self, tagger, word_sequences, tag_sequences, chunk_size=1000):
+        # Sequences are converted to indices by the tagger once, in chunks, and stored without padding
+        self.gpu = tagger.gpu
+        self.word_sequences = word_sequences
+        self.data_num = len(word_sequences)
+        self.seq_len = np.asarray([len(word_seq) for word_seq in word_sequences], dtype=np.int32)
+        self.offsets = np.zeros(self.data_num + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(self.seq_len)
+        self.word_pad_idx = tagger.word_seq_indexer.pad_idx
+        self.tag_pad_idx = tagger.tag_seq_indexer.pad_idx
+        word_idx_list, char_idx_list, tag_idx_list = list(), list(), list()
+        for i in range(0, self.data_num, chunk_size):
+            batch = tagger.get_batch(word_sequences[i:i + chunk_size], tag_sequences[i:i + chunk_size])
+            real_words_mask = batch.mask_tensor > 0
+            word_idx_list.append(batch.word_idx_tensor[real_words_mask].cpu().numpy().astype(np.int32))
+            tag_idx_list.append(batch.tag_idx_tensor[real_words_mask].cpu().numpy().astype(np.int32))
+            if batch.char_idx_tensor is not None:
+                char_idx_list.append(batch.char_idx_tensor[real_words_mask].cpu().numpy().astype(np.int32))
+        self.word_idx = np.concatenate(word_idx_list) # words_num
+        self.tag_idx = np.concatenate(tag_idx_list) # words_num
+        self.char_idx = np.concatenate(char_idx_list) if len(char_idx_list) > 0 else None # words_num x word_len
+        # Optional tables convert the values of flat arrays to indices, e.g. ids of unique words to word/char indices
+        self.word_idx_table, self.tag_idx_table, self.char_idx_table = None, None, None
+
+    def __get_tensor(self, flat_array, rows, cols, positions, shape, pad_idx, table=None):
+        array = np.zeros(shape, dtype=np.int64)
+        if pad_idx != 0:
+            array.fill(pad_idx)
+        values = flat_array[positions]
+        array[rows, cols] = table[values] if table is not None else values
+        tensor = torch.from_numpy(array)
+        if self.gpu >= 0:
+            tensor = tensor.cuda(device=self.gpu)
+        return tensor
+
+    def get_batch(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        seq_len = self.seq_len[indices]
+        batch_size, max_seq_len = len(indices), int(seq_len.max())
+        # Coordinates of all real words in the batch and their positions in the flat arrays
+        rows = np.repeat(np.arange(batch_size), seq_len)
+        cols = np.arange(rows.shape[0]) - np.repeat(np.cumsum(seq_len) - seq_len, seq_len)
+        positions = np.repeat(self.offsets[indices], seq_len) + cols
+        word_idx_tensor = self.__get_tensor(self.word_idx, rows, cols, positions, (batch_size, max_seq_len),
+                                            self.word_pad_idx, self.word_idx_table)
+        tag_idx_tensor = self.__get_tensor(self.tag_idx, rows, cols, positions, (batch_size, max_seq_len),
+                                           self.tag_pad_idx, self.tag_idx_table)
+        char_idx_tensor = None
+        if self.char_idx is not None:
+            word_len = (self.char_idx_table if self.char_idx_table is not None else self.char_idx).shape[1]
+            char_idx_tensor = self.__get_tensor(self.char_idx, rows, cols, positions, (batch_size, max_seq_len, word_len),
+                                                0, self.char_idx_table)
+        return Batch(word_idx_tensor, seq_len.tolist(), char_idx_tensor=char_idx_tensor, tag_idx_tensor=tag_idx_tensor,
+                     word_sequences=[self.word_sequences[i] for i in indices])
+
+    def get_batches(self, batch_size):
+        for i in range(0, self.data_num, batch_size):
+            yield self.get_batch(np.arange(i, min(i + batch_size, self.data_num)))
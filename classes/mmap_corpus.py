@@ -0,0 +1,189 @@
+"""
+.. module:: MmapCorpus
+    :synopsis: MmapCorpus converts the text file with tagged sequences once into the compact columnar format on disk
+    (flat arrays of word ids, tag ids and offsets of sequences) and memory-maps it, so the corpus may be larger than
+    RAM and it is reopened almost instantly.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import json
+import os
+
+import numpy as np
+
+from classes.data_io import DataIO
+from classes.indexed_dataset import IndexedDataset
+
+class MmapCorpus():
+    def __init__(self, fn, corpus_dir=None, chunk_size=100000, verbose=True):
+        self.fn = fn
+        self.corpus_dir = corpus_dir if corpus_dir is not None else fn + '.corpus'
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        if not self.is_corpus_valid():
+            self.build_corpus()
+        self.load_corpus()
+
+    def __getstate__(self):
+        # Memory-mapped arrays are not pickled, the copy of the corpus reopens the files
+        return {'fn': self.fn, 'corpus_dir': self.corpus_dir, 'chunk_size': self.chunk_size, 'verbose': False}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.load_corpus()
+
+    def __len__(self):
+        return self.data_num
+
+    def get_path(self, name):
+        return os.path.join(self.corpus_dir, name)
+
+    def get_source_info(self):
+        stat = os.stat(self.fn)
+        return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+    def is_corpus_valid(self):
+        if not os.path.isfile(self.get_path('meta.json')):
+            return False
+        with open(self.get_path('meta.json'), 'r') as f:
+            try:
+                meta = json.load(f)
+            except ValueError:
+                return False
+        return meta.get('source_info') == self.get_source_info()
+
+    def build_corpus(self):
+        # The text file is streamed sentence by sentence, ids are flushed to disk by chunks of sequences; only the
+        # dictionaries of unique words and tags are kept in memory
+        os.makedirs(self.corpus_dir, exist_ok=True)
+        word2id_dict, tag2id_dict = dict(), dict()
+        word_counts = list()
+        seq_len_list = list()
+        tokens_num, data_num = 0, 0
+        with open(self.get_path('word_ids.bin'), 'wb') as f_words, open(self.get_path('tag_ids.bin'), 'wb') as f_tags, \
+                open(self.get_path('offsets.bin'), 'wb') as f_offsets:
+            f_offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+            word_ids, tag_ids = list(), list()
+            for words, tags in DataIO.read_CoNNL_universal_stream(self.fn):
+                for word, tag in zip(words, tags):
+                    word_id = word2id_dict.setdefault(word, len(word2id_dict))
+                    if word_id == len(word_counts):
+                        word_counts.append(0)
+                    word_counts[word_id] += 1
+                    word_ids.append(word_id)
+                    tag_ids.append(tag2id_dict.setdefault(tag, len(tag2id_dict)))
+                seq_len_list.append(len(words))
+                if len(seq_len_list) == self.chunk_size:
+                    tokens_num, data_num = self.__write_chunk(f_words, f_tags, f_offsets, word_ids, tag_ids,
+                                                              seq_len_list, tokens_num, data_num)
+                    word_ids, tag_ids, seq_len_list = list(), list(), list()
+            tokens_num, data_num = self.__write_chunk(f_words, f_tags, f_offsets, word_ids, tag_ids, seq_len_list,
+                                                      tokens_num, data_num)
+        for name, items_dict in [('words.txt', word2id_dict), ('tags.txt', tag2id_dict)]:
+            with open(self.get_path(name), 'w', encoding='utf-8', newline='') as f:
+                f.write('\n'.join(items_dict.keys())) # dictionaries keep the order of the first appearance
+        np.save(self.get_path('word_counts.npy'), np.asarray(word_counts, dtype=np.int64))
+        # Meta file is written last, the corpus is valid only if its conversion is finished
+        with open(self.get_path('meta.json'), 'w') as f:
+            json.dump({'source_info': self.get_source_info(), 'data_num': data_num, 'tokens_num': tokens_num,
+                       'words_num': len(word2id_dict), 'tags_num': len(tag2id_dict)}, f)
+        if self.verbose:
+            print('MmapCorpus: %d sequences, %d tokens, %d unique words are converted from %s to %s.' %
+                  (data_num, tokens_num, len(word2id_dict), self.fn, self.corpus_dir))
+
+    def __write_chunk(self, f_words, f_tags, f_offsets, word_ids, tag_ids, seq_len_list, tokens_num, data_num):
+        f_words.write(np.asarray(word_ids, dtype=np.int32).tobytes())
+        f_tags.write(np.asarray(tag_ids, dtype=np.int32).tobytes())
+        f_offsets.write((tokens_num + np.cumsum(np.asarray(seq_len_list, dtype=np.int64))).tobytes())
+        return tokens_num + len(word_ids), data_num + len(seq_len_list)
+
+    def __load_array(self, name, dtype, length):
+        if length == 0: # empty files can not be memory-mapped
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.get_path(name), dtype=dtype, mode='r', shape=(length,))
+
+    def load_corpus(self):
+        with open(self.get_path('meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.data_num, self.tokens_num = meta['data_num'], meta['tokens_num']
+        self.words_list = self.__load_items_list('words.txt', meta['words_num'])
+        self.tags_list = self.__load_items_list('tags.txt', meta['tags_num'])
+        self.word_counts = np.load(self.get_path('word_counts.npy'))
+        self.word_ids = self.__load_array('word_ids.bin', np.int32, self.tokens_num) # tokens_num
+        self.tag_ids = self.__load_array('tag_ids.bin', np.int32, self.tokens_num) # tokens_num
+        self.offsets = self.__load_array('offsets.bin', np.int64, self.data_num + 1) # data_num + 1
+        self.seq_len = np.diff(self.offsets).astype(np.int32) # data_num
+        self.word_sequences = MmapCorpusSequences(self, 'word_ids', 'words_list')
+        self.tag_sequences = MmapCorpusSequences(self, 'tag_ids', 'tags_list')
+        if self.verbose:
+            print('MmapCorpus: %d sequences, %d tokens are loaded from %s.' % (self.data_num, self.tokens_num,
+                                                                              self.corpus_dir))
+
+    def __load_items_list(self, name, items_num):
+        with open(self.get_path(name), 'r', encoding='utf-8', newline='') as f:
+            items_str = f.read()
+        return items_str.split('\n') if items_num > 0 else list()
+
+class MmapCorpusSequences():
+    # Read-only list of sequences of strings, it is decoded from the memory-mapped ids on demand; arrays are referenced
+    # by names, so the pickled copy does not contain them
+    def __init__(self, corpus, ids_name, items_list_name):
+        self.corpus = corpus
+        self.ids_name = ids_name
+        self.items_list_name = items_list_name
+
+    def __len__(self):
+        return self.corpus.data_num
+
+    def __getitem__(self, i):
+        ids, items_list, offsets = getattr(self.corpus, self.ids_name), getattr(self.corpus, self.items_list_name), \
+                                   self.corpus.offsets
+        return [items_list[item_id] for item_id in ids[offsets[i]:offsets[i + 1]].tolist()]
+
+    def __iter__(self):
+        # Sequences are read by chunks of consecutive positions in the file
+        ids, items_list = getattr(self.corpus, self.ids_name), getattr(self.corpus, self.items_list_name)
+        for i in range(0, len(self), self.corpus.chunk_size):
+            offsets = self.corpus.offsets[i:i + self.corpus.chunk_size + 1]
+            items_ids = ids[offsets[0]:offsets[-1]].tolist()
+            offsets = (offsets - offsets[0]).tolist()
+            for begin, end in zip(offsets[:-1], offsets[1:]):
+                yield [items_list[item_id] for item_id in items_ids[begin:end]]
+
+class IndexedMmapCorpus(IndexedDataset):
+    def __init__(self, tagger, corpus, chunk_size=10000):
+        # Words, characters and tags are indexed by the tagger once for each unique word/tag of the corpus, ids of
+        # the tokens are converted by these tables when the batch is sliced from the memory-mapped arrays
+        self.gpu = tagger.gpu
+        self.corpus = corpus
+        self.word_sequences = corpus.word_sequences
+        self.data_num = corpus.data_num
+        self.seq_len = corpus.seq_len
+        self.word_pad_idx = tagger.word_seq_indexer.pad_idx
+        self.tag_pad_idx = tagger.tag_seq_indexer.pad_idx
+        self.tag_idx_table = np.asarray(tagger.tag_seq_indexer.items2idx([corpus.tags_list])[0], dtype=np.int64)
+        word_idx_list, char_idx_list = list(), list()
+        for i in range(0, len(corpus.words_list), chunk_size):
+            batch = tagger.get_batch([corpus.words_list[i:i + chunk_size]])
+            word_idx_list.append(batch.word_idx_tensor[0].cpu().numpy().astype(np.int64))
+            if batch.char_idx_tensor is not None:
+                char_idx_list.append(batch.char_idx_tensor[0].cpu().numpy().astype(np.int64))
+        self.word_idx_table = np.concatenate(word_idx_list) if len(word_idx_list) > 0 else np.zeros(0, dtype=np.int64)
+        self.char_idx_table = np.concatenate(char_idx_list) if len(char_idx_list) > 0 else None # words_num x word_len
+
+    @property
+    def offsets(self):
+        return self.corpus.offsets
+
+    @property
+    def word_idx(self):
+        return self.corpus.word_ids
+
+    @property
+    def tag_idx(self):
+        return self.corpus.tag_ids
+
+    @property
+    def char_idx(self):
+        return self.corpus.word_ids if self.char_idx_table is not None else None
@@ -23,7 +23,7 @@ class Report():
     def write_epoch_scores(self, epoch, scores):
         self.text += '\n %10s |' % ('%d'% epoch)
         for n, score in enumerate(scores):
-            self.text += ' %10s ' % ('%1.2f' % score)
+            self.text += ' %10s ' % ('%1.2f' % score if score is not None else '-') # None for the skipped scores
             if n < len(scores) - 1: self.text += '|'
         self.__save()
 
@@ -5,6 +5,8 @@
 .. moduleauthor:: Artem Chernodub
 """
 
+import numpy as np
+
 class TagComponent():
     def __init__(self, pos_begin, tag):
         self.pos_begin = pos_begin
@@ -46,10 +48,9 @@ class TagComponent():
     def match(tc1, tc2, match_ratio):
         if tc1.tag_class_name != tc2.tag_class_name:
             return False
-        tc1_positions = set(range(tc1.pos_begin, tc1.pos_end + 1))
-        tc2_positions = set(range(tc2.pos_begin, tc2.pos_end + 1))
-        common_positions = tc1_positions.intersection(tc2_positions)
-        return (float(len(common_positions)) / max(len(tc1_positions), len(tc2_positions)) >= match_ratio)
+        common_positions_num = max(0, min(tc1.pos_end, tc2.pos_end) - max(tc1.pos_begin, tc2.pos_begin) + 1)
+        return (float(common_positions_num) / max(tc1.pos_end - tc1.pos_begin + 1, tc2.pos_end - tc2.pos_begin + 1) >=
+                match_ratio)
 
     @staticmethod
     def extract_tag_components_sequences_debug(word_sequences, tag_sequences):
@@ -99,3 +100,51 @@ class TagComponent():
         word_sequences = sequences_indexer.word2idx(word_sequences_idx)
         tag_sequences = sequences_indexer.tag2idx(tag_sequences_idx)
         return TagComponent.extract_tag_components_sequences_debug(word_sequences, tag_sequences)
+
+    @staticmethod
+    def extract_spans(tag_sequences, class2idx_dict, seq_len_list=None):
+        # Tag components of all sequences as the integer array spans_num x 3 of (pos_begin, pos_end, class idx), where
+        # positions are global positions in the concatenation of sequences. Each sequence takes seq_len + 1 positions,
+        # so the spans of different sequences never overlap and the same seq_len_list aligns targets and outputs.
+        # Class indices are added to class2idx_dict.
+        if seq_len_list is None:
+            seq_len_list = [len(tags) for tags in tag_sequences]
+        tag2class_idx_dict = dict()
+        classes_idx = list()
+        for tags, seq_len in zip(tag_sequences, seq_len_list):
+            for tag in tags:
+                if tag not in tag2class_idx_dict:
+                    tag_class_name = TagComponent.get_tag_class_name(tag)
+                    if tag_class_name == 'O':
+                        tag2class_idx_dict[tag] = -1
+                    else:
+                        tag2class_idx_dict[tag] = class2idx_dict.setdefault(tag_class_name, len(class2idx_dict))
+                classes_idx.append(tag2class_idx_dict[tag])
+            classes_idx.extend([-1] * (seq_len + 1 - len(tags)))
+        classes_idx = np.asarray(classes_idx, dtype=np.int64)
+        # The component is the run of words with the same tag class name, "O" words are not components
+        is_begin = np.concatenate([[True], classes_idx[1:] != classes_idx[:-1]]) & (classes_idx != -1)
+        is_end = np.concatenate([classes_idx[:-1] != classes_idx[1:], [True]]) & (classes_idx != -1)
+        pos_begin = np.nonzero(is_begin)[0]
+        return np.stack([pos_begin, np.nonzero(is_end)[0], classes_idx[pos_begin]], axis=1)
+
+    @staticmethod
+    def match_spans(spans_1, spans_2, match_ratio):
+        # Boolean arrays of the spans which are matched by any span of the other array, see TagComponent.match. Spans
+        # of each array are sorted and do not overlap, so the spans_2 overlapping the span_1 are the contiguous range
+        # found by binary search; only the overlapping pairs are compared (match_ratio is expected to be positive).
+        lo = np.searchsorted(spans_2[:, 1], spans_1[:, 0], side='left') # first span_2 with pos_end >= pos_begin of span_1
+        hi = np.searchsorted(spans_2[:, 0], spans_1[:, 1], side='right') # first span_2 with pos_begin > pos_end of span_1
+        pairs_nums = np.maximum(hi - lo, 0)
+        pairs_offsets = np.cumsum(pairs_nums) - pairs_nums
+        idx_1 = np.repeat(np.arange(len(spans_1)), pairs_nums)
+        idx_2 = np.arange(pairs_nums.sum()) - np.repeat(pairs_offsets - lo, pairs_nums)
+        pairs_1, pairs_2 = spans_1[idx_1], spans_2[idx_2]
+        common_positions_num = np.minimum(pairs_1[:, 1], pairs_2[:, 1]) - np.maximum(pairs_1[:, 0], pairs_2[:, 0]) + 1
+        max_len = np.maximum(pairs_1[:, 1] - pairs_1[:, 0], pairs_2[:, 1] - pairs_2[:, 0]) + 1
+        is_match = (pairs_1[:, 2] == pairs_2[:, 2]) & (common_positions_num.astype(np.float64) / max_len >= match_ratio)
+        is_matched_1 = np.zeros(len(spans_1), dtype=bool)
+        is_matched_2 = np.zeros(len(spans_2), dtype=bool)
+        is_matched_1[idx_1[is_match]] = True
+        is_matched_2[idx_2[is_match]] = True
+        return is_matched_1, is_matched_2
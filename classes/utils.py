@@ -7,6 +7,7 @@
 
 import datetime
 import itertools
+from math import ceil
 
 def info(t, name=''):
     print(name, '|', t.type(), '|', t.shape)
@@ -47,4 +48,22 @@ def argsort_sequences_by_lens(list_in):
     reverse_sort_indices = [-1 for _ in range(data_num)]
     for i in range(data_num):
         reverse_sort_indices[sort_indices[i]] = i
-    return sort_indices, reverse_sort_indices
\ No newline at end of file
+    return sort_indices, reverse_sort_indices
+
+def get_inference_batches_indices(seq_len_list, batch_size, max_tokens=-1):
+    # Sequences sorted by length are packed into batches, each padded batch has at most max_tokens tokens; by default
+    # the budget is the same as for batch_size sequences of the average length
+    if max_tokens == -1:
+        max_tokens = batch_size * max(1, ceil(sum(seq_len_list) / max(len(seq_len_list), 1)))
+    batches_indices = list()
+    batch_indices, batch_max_seq_len = list(), 0
+    for i in argsort([-seq_len for seq_len in seq_len_list]):
+        max_seq_len = max(batch_max_seq_len, seq_len_list[i])
+        if len(batch_indices) > 0 and (len(batch_indices) + 1) * max_seq_len > max_tokens:
+            batches_indices.append(batch_indices)
+            batch_indices, max_seq_len = list(), seq_len_list[i]
+        batch_indices.append(i)
+        batch_max_seq_len = max_seq_len
+    if len(batch_indices) > 0:
+        batches_indices.append(batch_indices)
+    return batches_indices
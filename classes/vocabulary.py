@@ -0,0 +1,46 @@
+"""
+.. module:: Vocabulary
+    :synopsis: Vocabulary collects unique words in the order of their first appearance and counts their frequencies.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+from collections import OrderedDict
+
+class Vocabulary():
+    def __init__(self):
+        self.word2count_dict = OrderedDict() # word -> frequency, in the order of the first appearance of words
+        self.words_total_num = 0
+
+    def __len__(self):
+        return len(self.word2count_dict)
+
+    def __contains__(self, word):
+        return word in self.word2count_dict
+
+    def add_word_sequences(self, word_sequences):
+        # Vocabulary may be updated by any number of calls, e.g. while the data is streamed
+        word2count_dict = self.word2count_dict
+        for word_seq in word_sequences:
+            for word in word_seq:
+                word2count_dict[word] = word2count_dict.get(word, 0) + 1
+            self.words_total_num += len(word_seq)
+
+    def add_words_counts(self, words_list, counts_list):
+        # Adds the precomputed counts, e.g. of the converted corpus, without iterating over its words
+        word2count_dict = self.word2count_dict
+        for word, count in zip(words_list, counts_list):
+            word2count_dict[word] = word2count_dict.get(word, 0) + count
+            self.words_total_num += count
+
+    def get_count(self, word):
+        return self.word2count_dict.get(word, 0)
+
+    def get_words_list(self, min_count=1):
+        if min_count <= 1:
+            return list(self.word2count_dict.keys())
+        return [word for word, count in self.word2count_dict.items() if count >= min_count]
+
+    def get_most_common(self, n=None):
+        words_counts = sorted(self.word2count_dict.items(), key=lambda item: item[1], reverse=True)
+        return words_counts if n is None else words_counts[:n]
@@ -5,6 +5,7 @@
 .. moduleauthor:: Artem Chernodub
 """
 
+import torch
 import torch.nn as nn
 
 class LayerBase(nn.Module):
@@ -24,5 +25,27 @@ class LayerBase(nn.Module):
         return input_tensor*mask_tensor.unsqueeze(-1).expand_as(input_tensor)
 
     def get_seq_len_list_from_mask_tensor(self, mask_tensor):
-        batch_size = mask_tensor.shape[0]
-        return [int(mask_tensor[k].sum().item()) for k in range(batch_size)]
+        return [int(seq_len) for seq_len in mask_tensor.sum(dim=1).tolist()]
+
+    def sort_by_seq_len_list(self, seq_len_list):
+        data_num = len(seq_len_list)
+        sort_indices = sorted(range(len(seq_len_list)), key=seq_len_list.__getitem__, reverse=True)
+        reverse_sort_indices = [-1 for _ in range(data_num)]
+        for i in range(data_num):
+            reverse_sort_indices[sort_indices[i]] = i
+        sort_index = self.tensor_ensure_gpu(torch.tensor(sort_indices, dtype=torch.long))
+        reverse_sort_index = self.tensor_ensure_gpu(torch.tensor(reverse_sort_indices, dtype=torch.long))
+        return sorted(seq_len_list, reverse=True), sort_index, reverse_sort_index
+
+    def get_sorted_seq_len_list(self, mask_tensor, batch=None):
+        # Returns lengths in decreasing order, the index to sort the batch by length and the index to restore its order;
+        # both indices are None if the batch is already sorted. Lengths and permutation are precomputed by the batch.
+        if batch is not None:
+            if batch.is_sorted:
+                return batch.seq_len_list, None, None
+            return batch.sorted_seq_len_list, self.tensor_ensure_gpu(batch.sort_index_tensor), \
+                   self.tensor_ensure_gpu(batch.reverse_sort_index_tensor)
+        seq_len_list = self.get_seq_len_list_from_mask_tensor(mask_tensor)
+        if all(seq_len_list[i] >= seq_len_list[i + 1] for i in range(len(seq_len_list) - 1)):
+            return seq_len_list, None, None
+        return self.sort_by_seq_len_list(seq_len_list)
@@ -21,9 +21,9 @@ class LayerBiGRU(LayerBiRNNBase):
                           batch_first=True,
                           bidirectional=True)
 
-    def forward(self, input_tensor, mask_tensor): #input_tensor shape: batch_size x max_seq_len x dim
+    def forward(self, input_tensor, mask_tensor, batch=None): #input_tensor shape: batch_size x max_seq_len x dim
         batch_size, max_seq_len, _ = input_tensor.shape
-        input_packed, reverse_sort_index = self.pack(input_tensor, mask_tensor)
+        input_packed, reverse_sort_index = self.pack(input_tensor, mask_tensor, batch)
         h0 = self.tensor_ensure_gpu(torch.zeros(self.num_layers * self.num_directions, batch_size, self.hidden_dim))
         output_packed, _ = self.rnn(input_packed, h0)
         output_tensor = self.unpack(output_packed, max_seq_len, reverse_sort_index)
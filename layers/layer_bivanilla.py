@@ -21,7 +21,7 @@ class LayerBiVanilla(LayerBiRNNBase):
                           batch_first=True,
                           bidirectional=True)
 
-    def forward(self, input_tensor, mask_tensor): #input_tensor shape: batch_size x max_seq_len x dim
+    def forward(self, input_tensor, mask_tensor, batch=None): #input_tensor shape: batch_size x max_seq_len x dim
         batch_size, max_seq_len, _ = input_tensor.shape
         h0 = self.tensor_ensure_gpu(torch.zeros(self.num_layers * self.num_directions, batch_size, self.hidden_dim))
         output, _ = self.rnn(input_tensor, h0)
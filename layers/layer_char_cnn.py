@@ -27,10 +27,20 @@ class LayerCharCNN(LayerBase):
     def is_cuda(self):
         return self.conv1d.weight.is_cuda
 
-    def forward(self, char_embeddings_feature): # batch_num x max_seq_len x char_embeddings_dim x word_len
+    def forward(self, char_embeddings_feature, mask_tensor=None, batch=None): # batch_num x max_seq_len x char_embeddings_dim x word_len
         batch_num, max_seq_len, char_embeddings_dim, word_len = char_embeddings_feature.shape
-        max_pooling_out = self.tensor_ensure_gpu(torch.zeros(batch_num, max_seq_len,
-                                                             self.char_cnn_filter_num * self.char_embeddings_dim, dtype=torch.float))
-        for k in range(max_seq_len):
-            max_pooling_out[:, k, :], _ = torch.max(self.conv1d(char_embeddings_feature[:, k, :, :]), dim=2)
-        return max_pooling_out # shape: batch_num x max_seq_len x filter_num*char_embeddings_dim
+        # All words of the batch are processed by the single convolution
+        char_embeddings_feature = char_embeddings_feature.contiguous().view(batch_num * max_seq_len, char_embeddings_dim,
+                                                                            word_len)
+        if mask_tensor is None:
+            max_pooling_out, _ = torch.max(self.conv1d(char_embeddings_feature), dim=2)
+            return max_pooling_out.view(batch_num, max_seq_len, -1)
+        # Padded words consist of zero char embeddings, so their convolution output is just the bias
+        if batch is not None:
+            real_words_index = self.tensor_ensure_gpu(batch.real_words_index_tensor)
+        else:
+            real_words_index = self.tensor_ensure_gpu(mask_tensor).contiguous().view(-1).nonzero().view(-1)
+        max_pooling_real, _ = torch.max(self.conv1d(char_embeddings_feature.index_select(0, real_words_index)), dim=2)
+        max_pooling_out = self.conv1d.bias.unsqueeze(0).expand(batch_num * max_seq_len, self.output_dim)
+        max_pooling_out = max_pooling_out.index_copy(0, real_words_index, max_pooling_real)
+        return max_pooling_out.view(batch_num, max_seq_len, -1) # shape: batch_num x max_seq_len x filter_num*char_embeddings_dim
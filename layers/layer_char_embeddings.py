@@ -15,7 +15,8 @@ from seq_indexers.seq_indexer_char import SeqIndexerBaseChar
 
 
 class LayerCharEmbeddings(LayerBase):
-    def __init__(self, gpu, char_embeddings_dim, freeze_char_embeddings=False, word_len=20, unique_characters_list=None):
+    def __init__(self, gpu, char_embeddings_dim, freeze_char_embeddings=False, word_len=20, unique_characters_list=None,
+                 word_seq_indexer=None):
         super(LayerCharEmbeddings, self).__init__(gpu)
         self.gpu = gpu
         self.char_embeddings_dim = char_embeddings_dim
@@ -32,18 +33,67 @@ class LayerCharEmbeddings(LayerBase):
                                        embedding_dim=char_embeddings_dim,
                                        padding_idx=0)
         # nn.init.uniform_(self.embeddings.weight, -0.5, 0.5) # Option: Ma, 2016
+        # Char indices of all words from the vocabulary are prepared lazily, shape: words_num x word_len. The table is
+        # derived from the vocabulary, so it is neither saved to the state dict nor pickled.
+        self.word_seq_indexer = word_seq_indexer
+        self.word_char_idx_table = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['word_char_idx_table'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Layers saved by the older versions convert words to char indices directly
+        state.setdefault('word_seq_indexer', None)
+        state['word_char_idx_table'] = None
+        state['_buffers'].pop('word_char_idx_table', None)
+        super(LayerCharEmbeddings, self).__setstate__(state)
+
+    def get_word_char_idx_table(self, word_seq_indexer):
+        words_list = word_seq_indexer.get_items_list()
+        word_char_idx_table = self.char_seq_indexer.get_char_tensor([[c for c in word] for word in words_list],
+                                                                    self.word_len).cpu()
+        # Padded positions have no characters
+        word_char_idx_table[word_seq_indexer.pad_idx, :] = 0
+        return word_char_idx_table
 
     def is_cuda(self):
         return self.embeddings.weight.is_cuda
 
-    def forward(self, word_sequences):
+    def get_char_idx_tensor(self, word_sequences):
+        if self.word_seq_indexer is None:
+            return self.get_char_idx_tensor_slow(word_sequences)
+        max_seq_len = max([len(word_seq) for word_seq in word_sequences])
+        word_idx_tensor = self.tensor_ensure_gpu(self.word_seq_indexer.items2tensor(word_sequences)) # batch_num x max_seq_len
+        if self.word_char_idx_table is None or self.word_char_idx_table.device != self.embeddings.weight.device:
+            self.word_char_idx_table = self.tensor_ensure_gpu(self.get_word_char_idx_table(self.word_seq_indexer))
+        char_idx_tensor = self.word_char_idx_table[word_idx_tensor] # batch_num x max_seq_len x word_len
+        # Out-of-vocabulary words are converted to char indices directly
+        seq_len_tensor = self.tensor_ensure_gpu(torch.tensor([len(word_seq) for word_seq in word_sequences]))
+        real_words_mask = torch.arange(max_seq_len, device=seq_len_tensor.device).unsqueeze(0) < seq_len_tensor.unsqueeze(1)
+        oov_mask = (word_idx_tensor == self.word_seq_indexer.pad_idx)
+        if self.word_seq_indexer.unk is not None:
+            oov_mask = oov_mask | (word_idx_tensor == self.word_seq_indexer.unk_idx)
+        oov_positions = (oov_mask & real_words_mask).nonzero().tolist()
+        if len(oov_positions) > 0:
+            oov_char_seq = [[c for c in word_sequences[k][n]] for k, n in oov_positions]
+            oov_char_seq_tensor = self.tensor_ensure_gpu(self.char_seq_indexer.get_char_tensor(oov_char_seq, self.word_len))
+            oov_positions_tensor = self.tensor_ensure_gpu(torch.tensor(oov_positions, dtype=torch.long))
+            char_idx_tensor[oov_positions_tensor[:, 0], oov_positions_tensor[:, 1]] = oov_char_seq_tensor
+        return char_idx_tensor
+
+    def get_char_idx_tensor_slow(self, word_sequences):
         batch_num = len(word_sequences)
         max_seq_len = max([len(word_seq) for word_seq in word_sequences])
         char_sequences = [[[c for c in word] for word in word_seq] for word_seq in word_sequences]
-        input_tensor = self.tensor_ensure_gpu(torch.zeros(batch_num, max_seq_len, self.word_len, dtype=torch.long))
+        char_idx_tensor = self.tensor_ensure_gpu(torch.zeros(batch_num, max_seq_len, self.word_len, dtype=torch.long))
         for n, curr_char_seq in enumerate(char_sequences):
             curr_seq_len = len(curr_char_seq)
             curr_char_seq_tensor = self.char_seq_indexer.get_char_tensor(curr_char_seq, self.word_len) # curr_seq_len x word_len
-            input_tensor[n, :curr_seq_len, :] = curr_char_seq_tensor
-        char_embeddings_feature = self.embeddings(input_tensor)
+            char_idx_tensor[n, :curr_seq_len, :] = curr_char_seq_tensor
+        return char_idx_tensor
+
+    def forward(self, char_idx_tensor): # shape: batch_num x max_seq_len x word_len
+        char_embeddings_feature = self.embeddings(char_idx_tensor)
         return char_embeddings_feature.permute(0, 1, 3, 2) # shape: batch_num x max_seq_len x char_embeddings_dim x word_len
@@ -13,7 +13,12 @@ import torch.nn as nn
 from layers.layer_base import LayerBase
 
 class LayerCRF(LayerBase):
-    def __init__(self, gpu, states_num, pad_idx, sos_idx, tag_seq_indexer, verbose=True):
+    # Forward algorithm uses the exp-matmul step instead of the broadcasted log-sum-exp from this number of states;
+    # sums of the exp-matmul step below matmul_min_sum_exp are treated as underflowed and recomputed exactly
+    matmul_min_states_num = 48
+    matmul_min_sum_exp = 1e-20
+
+    def __init__(self, gpu, states_num, pad_idx, sos_idx, tag_seq_indexer, verbose=True, sparse_transitions=False):
         super(LayerCRF, self).__init__(gpu)
         self.states_num = states_num
         self.pad_idx = pad_idx
@@ -21,6 +26,7 @@ class LayerCRF(LayerBase):
         self.tag_seq_indexer = tag_seq_indexer
         self.tag_seq_indexer.add_tag('<sos>')
         self.verbose = verbose
+        self.sparse_transitions = sparse_transitions
         # Transition matrix contains log probabilities from state j to state i
         self.transition_matrix = nn.Parameter(torch.zeros(states_num, states_num, dtype=torch.float))
         nn.init.normal_(self.transition_matrix, -1, 0.1)
@@ -29,6 +35,13 @@ class LayerCRF(LayerBase):
         self.transition_matrix.data[:, self.pad_idx] = -9999.0
         self.transition_matrix.data[self.pad_idx, :] = -9999.0
         self.transition_matrix.data[self.pad_idx, self.pad_idx] = 0.0
+        if sparse_transitions:
+            self.init_sparse_transitions()
+
+    def __setstate__(self, state):
+        # Layers saved by the older versions have no sparse transitions
+        state.setdefault('sparse_transitions', False)
+        super(LayerCRF, self).__setstate__(state)
 
     def get_empirical_transition_matrix(self, tag_sequences_train, tag_seq_indexer=None):
         if tag_seq_indexer is None:
@@ -55,21 +68,104 @@ class LayerCRF(LayerBase):
                 if empirical_transition_matrix[i, j] == 0:
                     self.transition_matrix.data[i, j] = -9999.0
                 #self.transition_matrix.data[i, j] = torch.log(empirical_transition_matrix[i, j].float() + 10**-32)
+        if self.sparse_transitions:
+            self.init_sparse_transitions()
         if self.verbose:
             print('Empirical transition matrix from the train dataset:')
             self.pretty_print_transition_matrix(empirical_transition_matrix)
             print('\nInitialized transition matrix:')
             self.pretty_print_transition_matrix(self.transition_matrix.data)
 
+    def init_sparse_transitions(self):
+        # CSR-style index of legal predecessors for each state, transitions initialized by -9999 are illegal.
+        # Index is rebuilt when the transition matrix is re-initialized, buffers of the previous buckets are removed.
+        for name in [name for name in self._buffers if name.startswith('sparse_bucket_')]:
+            del self._buffers[name]
+        legal_transitions = (self.transition_matrix.data.cpu() > -9999.0 / 2).long()
+        predecessors_num = legal_transitions.sum(dim=1)
+        predecessors_offsets = torch.cat([torch.zeros(1, dtype=torch.long), torch.cumsum(predecessors_num, dim=0)])
+        predecessors_indices = legal_transitions.nonzero()[:, 1]
+        self.register_buffer('predecessors_offsets', self.tensor_ensure_gpu(predecessors_offsets))
+        self.register_buffer('predecessors_indices', self.tensor_ensure_gpu(predecessors_indices))
+        # States are grouped to buckets by number of predecessors (up to the power of 2), predecessors of the states
+        # within the bucket are padded to the same length. Thus, the amount of work per time step is at most twice the
+        # number of legal transitions. States without predecessors are left out, their scores are -9999.
+        buckets = dict()
+        for state in range(self.states_num):
+            curr_predecessors_num = int(predecessors_num[state])
+            if curr_predecessors_num > 0:
+                bucket_width = 2 ** (curr_predecessors_num - 1).bit_length()
+                buckets.setdefault(bucket_width, list()).append(state)
+        states_order = list()
+        for b, bucket_width in enumerate(sorted(buckets.keys())):
+            bucket_states = buckets[bucket_width]
+            bucket_predecessors = torch.zeros(len(bucket_states), bucket_width, dtype=torch.long)
+            bucket_padding = torch.zeros(len(bucket_states), bucket_width, dtype=torch.float).fill_(-float('inf'))
+            for i, state in enumerate(bucket_states):
+                curr_predecessors = predecessors_indices[predecessors_offsets[state]:predecessors_offsets[state + 1]]
+                bucket_predecessors[i, :len(curr_predecessors)] = curr_predecessors
+                bucket_padding[i, :len(curr_predecessors)] = 0.0
+            self.register_buffer('sparse_bucket_states_%d' % b,
+                                 self.tensor_ensure_gpu(torch.tensor(bucket_states, dtype=torch.long)))
+            self.register_buffer('sparse_bucket_predecessors_%d' % b, self.tensor_ensure_gpu(bucket_predecessors))
+            self.register_buffer('sparse_bucket_padding_%d' % b, self.tensor_ensure_gpu(bucket_padding))
+            states_order.extend(bucket_states)
+        self.sparse_buckets_num = len(buckets)
+        # Maps the state to its column in the concatenated outputs of buckets, the last column is for dead states
+        sparse_reverse_order = torch.zeros(self.states_num, dtype=torch.long).fill_(len(states_order))
+        for i, state in enumerate(states_order):
+            sparse_reverse_order[state] = i
+        self.register_buffer('sparse_reverse_order', self.tensor_ensure_gpu(sparse_reverse_order))
+        if self.verbose:
+            print('Sparse transitions: %d legal transitions of %d, %d buckets.' % (len(predecessors_indices),
+                                                                                  self.states_num ** 2,
+                                                                                  self.sparse_buckets_num))
+
+    def get_sparse_buckets(self):
+        # Returns list of (states, predecessors, transition scores) for each bucket
+        sparse_buckets = list()
+        for b in range(self.sparse_buckets_num):
+            bucket_states = getattr(self, 'sparse_bucket_states_%d' % b)
+            bucket_predecessors = getattr(self, 'sparse_bucket_predecessors_%d' % b)
+            bucket_padding = getattr(self, 'sparse_bucket_padding_%d' % b)
+            bucket_transition = self.transition_matrix[bucket_states.unsqueeze(1), bucket_predecessors] + bucket_padding
+            sparse_buckets.append((bucket_states, bucket_predecessors, bucket_transition))
+        return sparse_buckets
+
+    def sparse_step(self, score, sparse_buckets, reduce='logsumexp'):
+        # score: batch_num x states_num, scores of the previous time step
+        # Returns scores reduced over legal predecessors for each state and backpointers (for reduce='max' only)
+        batch_num = score.shape[0]
+        curr_scores_list = list()
+        curr_backpointers_list = list()
+        for bucket_states, bucket_predecessors, bucket_transition in sparse_buckets:
+            bucket_score = score.index_select(1, bucket_predecessors.view(-1)).view(batch_num,
+                                                                                  *bucket_predecessors.shape)
+            bucket_score = bucket_score + bucket_transition.unsqueeze(0) # batch_num x bucket_size x bucket_width
+            if reduce == 'logsumexp':
+                curr_scores_list.append(log_sum_exp(bucket_score))
+            else:
+                bucket_max_values, bucket_max_indices = torch.max(bucket_score, 2)
+                curr_scores_list.append(bucket_max_values)
+                curr_backpointers_list.append(torch.gather(bucket_predecessors.unsqueeze(0).expand(batch_num, -1, -1),
+                                                           dim=2, index=bucket_max_indices.unsqueeze(2)).squeeze(2))
+        curr_scores_list.append(score.new_zeros(batch_num, 1).fill_(-9999.0))
+        curr_score = torch.cat(curr_scores_list, dim=1).index_select(1, self.sparse_reverse_order)
+        if reduce == 'logsumexp':
+            return curr_score, None
+        curr_backpointers_list.append(score.new_zeros(batch_num, 1, dtype=torch.long).fill_(self.pad_idx))
+        curr_backpointers = torch.cat(curr_backpointers_list, dim=1).index_select(1, self.sparse_reverse_order)
+        return curr_score, curr_backpointers
+
     def pretty_print_transition_matrix(self, transition_matrix, tag_seq_indexer=None):
         if tag_seq_indexer is None:
             tag_seq_indexer = self.tag_seq_indexer
         str = '%10s' % ''
         for i in range(tag_seq_indexer.get_items_count()):
-            str += '%10s' % tag_seq_indexer.idx2item_dict[i]
+            str += '%10s' % tag_seq_indexer.get_item(i)
         str += '\n'
         for i in range(tag_seq_indexer.get_items_count()):
-            str += '\n%10s' % tag_seq_indexer.idx2item_dict[i]
+            str += '\n%10s' % tag_seq_indexer.get_item(i)
             for j in range(tag_seq_indexer.get_items_count()):
                 str += '%10s' % ('%1.1f' % transition_matrix[i, j])
         print(str)
@@ -82,69 +178,175 @@ class LayerCRF(LayerBase):
         # states_tensor: batch_num x max_seq_len
         # mask_tensor: batch_num x max_seq_len
         batch_num, max_seq_len = mask_tensor.shape
-        score = self.tensor_ensure_gpu(torch.zeros(batch_num, dtype=torch.float))
+        states_tensor = self.tensor_ensure_gpu(states_tensor)
         start_states_tensor = self.tensor_ensure_gpu(torch.zeros(batch_num, 1, dtype=torch.long).fill_(self.sos_idx))
         states_tensor = torch.cat([start_states_tensor, states_tensor], 1)
-        for n in range(max_seq_len):
-            curr_mask = mask_tensor[:, n]
-            curr_emission = self.tensor_ensure_gpu(torch.zeros(batch_num, dtype=torch.float))
-            curr_transition = self.tensor_ensure_gpu(torch.zeros(batch_num, dtype=torch.float))
-            for k in range(batch_num):
-                curr_emission[k] = features_rnn_compressed[k, n, states_tensor[k, n + 1]].unsqueeze(0)
-                curr_states_seq = states_tensor[k]
-                curr_transition[k] = self.transition_matrix[curr_states_seq[n + 1], curr_states_seq[n]].unsqueeze(0)
-            score = score + curr_emission*curr_mask + curr_transition*curr_mask
+        curr_states = states_tensor[:, 1:] # batch_num x max_seq_len
+        prev_states = states_tensor[:, :-1] # batch_num x max_seq_len
+        emission = torch.gather(features_rnn_compressed, dim=2, index=curr_states.unsqueeze(-1)).squeeze(-1)
+        transition = self.transition_matrix[curr_states, prev_states]
+        score = torch.sum((emission + transition) * mask_tensor, dim=1)
         return score
 
-    def denominator(self, features_rnn_compressed, mask_tensor):
+    def denominator(self, features_rnn_compressed, mask_tensor, batch=None):
         # features_rnn_compressed: batch x max_seq_len x states_num
         # mask_tensor: batch_num x max_seq_len
+        # Sequences are processed in the order of decreasing lengths, at step n only the first active_num rows are
+        # computed; scores of the finished sequences are put aside, so the work follows the real number of tokens
         batch_num, max_seq_len = mask_tensor.shape
+        sorted_seq_len_list, sort_index, reverse_sort_index = self.get_sorted_seq_len_list(mask_tensor, batch)
+        if sort_index is not None:
+            features_rnn_compressed = torch.index_select(features_rnn_compressed, dim=0, index=sort_index)
         score = self.tensor_ensure_gpu(torch.zeros(batch_num, self.states_num, dtype=torch.float).fill_(-9999.0))
         score[:, self.sos_idx] = 0.
+        if self.sparse_transitions:
+            sparse_buckets = self.get_sparse_buckets()
+        elif self.states_num >= self.matmul_min_states_num:
+            transition_max, _ = torch.max(self.transition_matrix, dim=1) # states_num
+            transition_exp = torch.exp(self.transition_matrix - transition_max.unsqueeze(1)) # states_num x states_num
+        finished_scores_list = list()
+        active_num = batch_num
         for n in range(max_seq_len):
-            curr_mask = mask_tensor[:, n].unsqueeze(-1).expand_as(score)
-            curr_score = score.unsqueeze(1).expand(-1, *self.transition_matrix.size())
-            curr_emission = features_rnn_compressed[:, n].unsqueeze(-1).expand_as(curr_score)
-            curr_transition = self.transition_matrix.unsqueeze(0).expand_as(curr_score)
-            #curr_score = torch.logsumexp(curr_score + curr_emission + curr_transition, dim=2)
-            curr_score = log_sum_exp(curr_score + curr_emission + curr_transition)
-            score = curr_score * curr_mask + score * (1 - curr_mask)
-        #score = torch.logsumexp(score, dim=1)
+            curr_active_num = active_num
+            while curr_active_num > 0 and sorted_seq_len_list[curr_active_num - 1] <= n:
+                curr_active_num -= 1
+            if curr_active_num < active_num:
+                finished_scores_list.append(score[curr_active_num:])
+                score = score[:curr_active_num]
+                active_num = curr_active_num
+            if active_num == 0:
+                break
+            if self.sparse_transitions:
+                curr_score, _ = self.sparse_step(score, sparse_buckets, reduce='logsumexp')
+            elif self.states_num >= self.matmul_min_states_num:
+                curr_score = self.matmul_step(score, transition_exp, transition_max)
+            else:
+                # All pairs of (current, previous) states, shape: active_num x states_num x states_num
+                curr_score = log_sum_exp(score.unsqueeze(1) + self.transition_matrix.unsqueeze(0))
+            score = curr_score + features_rnn_compressed[:active_num, n]
+        # Finished scores are in the order of decreasing indices of rows
+        score = torch.cat([score] + finished_scores_list[::-1], dim=0)
         score = log_sum_exp(score)
+        if reverse_sort_index is not None:
+            score = torch.index_select(score, dim=0, index=reverse_sort_index)
         return score
 
-    def decode_viterbi(self, features_rnn_compressed, mask_tensor):
+    def matmul_step(self, score, transition_exp, transition_max):
+        # Scaled form of log(sum_j(exp(score_j + transition_ij))): exponents are shifted by the maxima of scores and of
+        # transitions, so the sum over previous states is a matrix product. When all legal predecessors of the state
+        # are far below the maximum of the row, their terms underflow; these entries are recomputed by log-sum-exp.
+        max_score, _ = torch.max(score, dim=1, keepdim=True) # active_num x 1
+        sum_exp = torch.mm(torch.exp(score - max_score), transition_exp.t()) # active_num x states_num
+        curr_score = torch.log(sum_exp.clamp(min=self.matmul_min_sum_exp)) + max_score + transition_max.unsqueeze(0)
+        underflow_index = (sum_exp < self.matmul_min_sum_exp).nonzero() # underflowed_num x 2
+        if underflow_index.shape[0] > 0:
+            rows, states = underflow_index[:, 0], underflow_index[:, 1]
+            curr_score[rows, states] = log_sum_exp(score[rows] + self.transition_matrix[states])
+        return curr_score
+
+    def decode_viterbi(self, features_rnn_compressed, mask_tensor, batch=None):
+        best_path_tensor, seq_len_tensor = self.decode_viterbi_tensor(features_rnn_compressed, mask_tensor, batch)
+        seq_len_list = batch.seq_len_list if batch is not None else seq_len_tensor.tolist()
+        return [best_path[:seq_len] for best_path, seq_len in zip(best_path_tensor.tolist(), seq_len_list)]
+
+    def get_seq_len_tensor(self, mask_tensor, batch=None):
+        if batch is not None:
+            return self.tensor_ensure_gpu(batch.seq_len_tensor)
+        return mask_tensor.sum(dim=1).long()
+
+    def decode_viterbi_tensor(self, features_rnn_compressed, mask_tensor, batch=None):
         # features_rnn_compressed: batch x max_seq_len x states_num
         # mask_tensor: batch_num x max_seq_len
         batch_size, max_seq_len = mask_tensor.shape
-        seq_len_list = [int(mask_tensor[k].sum().item()) for k in range(batch_size)]
+        seq_len_tensor = self.get_seq_len_tensor(mask_tensor, batch)
         # Step 1. Calculate scores & backpointers
         score = self.tensor_ensure_gpu(torch.Tensor(batch_size, self.states_num).fill_(-9999.))
         score[:, self.sos_idx] = 0.0
-        backpointers = self.tensor_ensure_gpu(torch.LongTensor(batch_size, max_seq_len, self.states_num))
+        backpointers = self.tensor_ensure_gpu(torch.zeros(batch_size, max_seq_len, self.states_num, dtype=torch.long))
+        if self.sparse_transitions:
+            sparse_buckets = self.get_sparse_buckets()
         for n in range(max_seq_len):
             curr_emissions = features_rnn_compressed[:, n]
-            curr_score = self.tensor_ensure_gpu(torch.Tensor(batch_size, self.states_num))
-            curr_backpointers = self.tensor_ensure_gpu(torch.LongTensor(batch_size, self.states_num))
-            for curr_state in range(self.states_num):
-                T = self.transition_matrix[curr_state, :].unsqueeze(0).expand(batch_size, self.states_num)
-                max_values, max_indices = torch.max(score + T, 1)
-                curr_score[:, curr_state] = max_values
-                curr_backpointers[:, curr_state] = max_indices
+            if self.sparse_transitions:
+                # Legal predecessors only
+                curr_score, curr_backpointers = self.sparse_step(score, sparse_buckets, reduce='max')
+            else:
+                # All pairs of (current, previous) states, shape: batch_size x states_num x states_num
+                curr_score, curr_backpointers = torch.max(score.unsqueeze(1) + self.transition_matrix.unsqueeze(0), 2)
             curr_mask = mask_tensor[:, n].unsqueeze(1).expand(batch_size, self.states_num)
             score = score * (1 - curr_mask) + (curr_score + curr_emissions) * curr_mask
             backpointers[:, n, :] = curr_backpointers # shape: batch_size x max_seq_len x state_num
-        best_score_batch, last_best_state_batch = torch.max(score, 1)
-        # Step 2. Find the best path
-        best_path_batch = [[state] for state in last_best_state_batch.tolist()]
-        for k in range(batch_size):
-            curr_best_state = last_best_state_batch[k]
-            curr_seq_len = seq_len_list[k]
-            for n in reversed(range(1, curr_seq_len)):
-                curr_best_state = backpointers[k, n, curr_best_state].item()
-                best_path_batch[k].insert(0, curr_best_state)
-        return best_path_batch
+        _, last_best_state_batch = torch.max(score, 1)
+        # Step 2. Find the best path, padded positions are filled by pad_idx
+        mask_long = mask_tensor.long()
+        best_path_tensor = self.tensor_ensure_gpu(torch.zeros(batch_size, max_seq_len, dtype=torch.long).fill_(self.pad_idx))
+        curr_best_state = last_best_state_batch
+        for n in reversed(range(max_seq_len)):
+            curr_mask = mask_long[:, n]
+            best_path_tensor[:, n] = curr_best_state * curr_mask + best_path_tensor[:, n] * (1 - curr_mask)
+            prev_best_state = backpointers[:, n].gather(1, curr_best_state.unsqueeze(1)).squeeze(1)
+            curr_best_state = prev_best_state * curr_mask + curr_best_state * (1 - curr_mask)
+        return best_path_tensor, seq_len_tensor # shape: batch_size x max_seq_len, batch_size
+
+    def decode_viterbi_nbest(self, features_rnn_compressed, mask_tensor, k, batch=None):
+        # Returns up to k best paths and their scores for each sequence; hypotheses that are not legal paths (-inf
+        # scores or transitions initialized by -9999) are left out, so a sequence may have less than k paths
+        if self.sparse_transitions:
+            raise ValueError('N-best decoding is not supported for the CRF with sparse transitions.')
+        best_paths_tensor, best_scores_tensor, seq_len_tensor = self.decode_viterbi_nbest_tensor(features_rnn_compressed,
+                                                                                                 mask_tensor, k, batch)
+        seq_len_list = batch.seq_len_list if batch is not None else seq_len_tensor.tolist()
+        legal_transitions = (self.transition_matrix.data > -9999.0 / 2).tolist()
+        best_paths_batch, best_scores_batch = list(), list()
+        for best_paths, best_scores, seq_len in zip(best_paths_tensor.tolist(), best_scores_tensor.tolist(),
+                                                    seq_len_list):
+            legal_paths = [(best_path[:seq_len], score) for best_path, score in zip(best_paths, best_scores)
+                           if score > -float('inf') and self.is_legal_path(best_path[:seq_len], legal_transitions)]
+            best_paths_batch.append([best_path for best_path, _ in legal_paths])
+            best_scores_batch.append([score for _, score in legal_paths])
+        return best_paths_batch, best_scores_batch
+
+    def is_legal_path(self, path, legal_transitions):
+        prev_state = self.sos_idx
+        for curr_state in path:
+            if not legal_transitions[curr_state][prev_state]:
+                return False
+            prev_state = curr_state
+        return True
+
+    def decode_viterbi_nbest_tensor(self, features_rnn_compressed, mask_tensor, k, batch=None):
+        # features_rnn_compressed: batch x max_seq_len x states_num
+        # mask_tensor: batch_num x max_seq_len
+        # Each state keeps k hypotheses, hypothesis index is encoded as state * k + rank. Hypotheses that do not
+        # correspond to any real path have -inf scores, i.e. when a sentence has less than k possible paths.
+        batch_size, max_seq_len = mask_tensor.shape
+        seq_len_tensor = self.get_seq_len_tensor(mask_tensor, batch)
+        # Step 1. Calculate scores & backpointers
+        score = self.tensor_ensure_gpu(torch.Tensor(batch_size, self.states_num, k).fill_(-float('inf')))
+        score[:, self.sos_idx, 0] = 0.0
+        transition = self.transition_matrix.data.unsqueeze(0).unsqueeze(-1) # 1 x states_num x states_num x 1
+        identity_backpointers = self.tensor_ensure_gpu(torch.arange(self.states_num * k, dtype=torch.long))
+        identity_backpointers = identity_backpointers.view(1, self.states_num, k).expand(batch_size, -1, -1)
+        backpointers = self.tensor_ensure_gpu(torch.zeros(batch_size, max_seq_len, self.states_num, k,
+                                                          dtype=torch.long))
+        for n in range(max_seq_len):
+            curr_emissions = features_rnn_compressed[:, n].data.unsqueeze(-1)
+            # All pairs of (current state, previous hypothesis), shape: batch_size x states_num x states_num*k
+            curr_score = (score.unsqueeze(1) + transition).view(batch_size, self.states_num, self.states_num * k)
+            curr_score, curr_backpointers = torch.topk(curr_score, k, dim=2)
+            curr_mask = (mask_tensor[:, n] > 0).view(batch_size, 1, 1).expand(batch_size, self.states_num, k)
+            score = torch.where(curr_mask, curr_score + curr_emissions, score)
+            backpointers[:, n] = torch.where(curr_mask, curr_backpointers, identity_backpointers)
+        best_scores_tensor, curr_hypotheses = torch.topk(score.view(batch_size, self.states_num * k), k, dim=1)
+        # Step 2. Find the best paths, padded positions are filled by pad_idx
+        mask_long = mask_tensor.long().unsqueeze(1).expand(batch_size, k, max_seq_len)
+        best_paths_tensor = self.tensor_ensure_gpu(torch.zeros(batch_size, k, max_seq_len, dtype=torch.long))
+        for n in reversed(range(max_seq_len)):
+            curr_mask = mask_long[:, :, n]
+            best_paths_tensor[:, :, n] = (curr_hypotheses // k) * curr_mask + self.pad_idx * (1 - curr_mask)
+            curr_hypotheses = backpointers[:, n].view(batch_size, self.states_num * k).gather(1, curr_hypotheses)
+        return best_paths_tensor, best_scores_tensor, seq_len_tensor # batch_size x k x max_seq_len, batch_size x k,
+                                                                     # batch_size
 
 def log_sum_exp(x):
     max_score, _ = torch.max(x, -1)
@@ -23,7 +23,6 @@ class LayerWordEmbeddings(LayerBase):
     def is_cuda(self):
         return self.embeddings.weight.is_cuda
 
-    def forward(self, word_sequences):
-        input_tensor = self.tensor_ensure_gpu(self.word_seq_indexer.items2tensor(word_sequences)) # shape: batch_size x max_seq_len
-        word_embeddings_feature = self.embeddings(input_tensor) # shape: batch_size x max_seq_len x output_dim
+    def forward(self, word_idx_tensor): # shape: batch_size x max_seq_len
+        word_embeddings_feature = self.embeddings(word_idx_tensor) # shape: batch_size x max_seq_len x output_dim
         return word_embeddings_feature
\ No newline at end of file
@@ -11,9 +11,13 @@ import torch.nn as nn
 import torch.optim as optim
 from torch.optim.lr_scheduler import LambdaLR
 
+from classes.async_evaluator import AsyncEvaluator
+from classes.batch_prefetcher import BatchPrefetcher
+from classes.batch_sampler import BucketBatchSampler, ShuffleBufferBatchSampler
 from classes.data_io import DataIO
 from classes.datasets_bank import DatasetsBank, DatasetsBankSorted
 from classes.evaluator import Evaluator
+from classes.mmap_corpus import MmapCorpus
 from classes.report import Report
 from classes.utils import *
 from seq_indexers.seq_indexer_word import SeqIndexerWord
@@ -38,6 +42,10 @@ if __name__ == "__main__":
     parser.add_argument('--emb_fn', default='embeddings/glove.6B.100d.txt', help='Path to word embeddings file.')
     parser.add_argument('--emb_dim', type=int, default=100, help='Dimension of word embeddings file.')
     parser.add_argument('--emb_delimiter', default=' ', help='Delimiter for word embeddings file.')
+    parser.add_argument('--emb_workers_num', type=int, default=4, help='Number of processes to parse word embeddings '
+                                                                        'file, it is parsed once into the binary cache.')
+    parser.add_argument('--emb_cache', type=bool, default=True, help='Save the binary cache of word embeddings file '
+                        'next to it ("<emb_fn>.words.txt" and "<emb_fn>.npy"), False to parse the file on each run.')
     parser.add_argument('--freeze_word_embeddings', type=bool, default=False, help='False to continue training the \                                                                                    word embeddings.')
     parser.add_argument('--freeze_char_embeddings', type=bool, default=False,
                         help='False to continue training the char embeddings.')
@@ -52,18 +60,39 @@ if __name__ == "__main__":
     parser.add_argument('--word_len', type=int, default=20, help='Max length of words in characters for char CNNs.')
     parser.add_argument('--char_cnn_filter_num', type=int, default=30, help='Number of filters in Char CNN.')
     parser.add_argument('--char_window_size', type=int, default=3, help='Convolution1D size.')
+    parser.add_argument('--crf_sparse_transitions', type=bool, default=False,
+                        help='CRF computes scores only over legal transitions, for large tag sets.')
     parser.add_argument('--dropout_ratio', type=float, default=0.5, help='Dropout ratio.')
     parser.add_argument('--dataset_sort', type=bool, default=True, help='Sort sequences by length for training.')
     parser.add_argument('--clip_grad', type=float, default=5, help='Clipping gradients maximum L2 norm.')
     parser.add_argument('--opt_method', default='sgd', help='Optimization method: "sgd", "adam".')
     parser.add_argument('--batch_size', type=int, default=10, help='Batch size, samples.')
+    parser.add_argument('--batch_max_tokens', type=int, default=0, help='Max number of tokens in the padded train batch, '
+                        'sequences of similar lengths are batched together; 0 means batches of batch_size sequences.')
+    parser.add_argument('--shuffle_buffer_size', type=int, default=0, help='Number of train sequences in the shuffle '
+                        'buffer, it is filled by blocks of consecutive sequences and batched by lengths; 0 means '
+                        'shuffling of the whole train set.')
+    parser.add_argument('--prefetch_workers_num', type=int, default=1, help='Number of background threads that build '
+                        'the next train batches during the training step; 0 means building batches in the training loop.')
     parser.add_argument('--lr', type=float, default=0.01, help='Learning rate.')
     parser.add_argument('--lr_decay', type=float, default=0.05, help='Learning decay rate.') # 0.05
     parser.add_argument('--momentum', type=float, default=0.9, help='Learning momentum rate.')
+    parser.add_argument('--train_mmap', type=bool, default=False, help='Convert the train data once to the '
+                        'memory-mapped corpus and read the train sequences from disk on demand.')
+    parser.add_argument('--train_mmap_dir', type=str, default=None, help='Folder of the memory-mapped train corpus, '
+                        '"<fn_train>.corpus" next to the train data by default.')
     parser.add_argument('--verbose', type=bool, default=True, help='Show additional information.')
     parser.add_argument('--match_alpha_ratio', type=float, default='0.999',
                         help='Alpha ratio from non-strict matching, options: 0.999 or 0.5')
     parser.add_argument('--save_best', type=bool, default=False, help = 'Save best on dev model as a final model.')
+    parser.add_argument('--eval_every', type=int, default=1, help='Evaluate the tagger every N epochs.')
+    parser.add_argument('--eval_train_num', type=int, default=-1, help='Number of randomly selected train sequences to '
+                        'evaluate train scores, the subset is fixed for all epochs; -1 means the whole train set, 0 means '
+                        'no train evaluation.')
+    parser.add_argument('--eval_test_on_dev_improvement', type=bool, default=False,
+                        help='Evaluate test scores only when dev micro-f1 is improved.')
+    parser.add_argument('--eval_async', type=bool, default=False, help='Evaluate snapshots of the tagger in the '
+                        'background worker process while the training goes on.')
     parser.add_argument('--report_fn', type=str, default='%s_report.txt' % get_datetime_str(), help='Report filename.')
 
     args = parser.parse_args()
@@ -75,7 +104,12 @@ if __name__ == "__main__":
         torch.cuda.manual_seed(args.seed_num)
 
     # Load CoNNL data as sequences of strings of words and corresponding tags
-    word_sequences_train, tag_sequences_train = DataIO.read_CoNNL_universal(args.fn_train, verbose=True)
+    corpus_train = None
+    if args.train_mmap:
+        corpus_train = MmapCorpus(args.fn_train, corpus_dir=args.train_mmap_dir)
+        word_sequences_train, tag_sequences_train = corpus_train.word_sequences, corpus_train.tag_sequences
+    else:
+        word_sequences_train, tag_sequences_train = DataIO.read_CoNNL_universal(args.fn_train, verbose=True)
     word_sequences_dev, tag_sequences_dev = DataIO.read_CoNNL_universal(args.fn_dev, verbose=True)
     word_sequences_test, tag_sequences_test = DataIO.read_CoNNL_universal(args.fn_test, verbose=True)
 
@@ -85,7 +119,10 @@ if __name__ == "__main__":
         datasets_bank = DatasetsBankSorted(verbose=True)
     else:
         datasets_bank = DatasetsBank(verbose=True)
-    datasets_bank.add_train_sequences(word_sequences_train, tag_sequences_train)
+    if corpus_train is not None:
+        datasets_bank.add_train_corpus(corpus_train)
+    else:
+        datasets_bank.add_train_sequences(word_sequences_train, tag_sequences_train)
     datasets_bank.add_dev_sequences(word_sequences_dev, tag_sequences_dev)
     datasets_bank.add_test_sequences(word_sequences_test, tag_sequences_test)
 
@@ -97,13 +134,15 @@ if __name__ == "__main__":
                                           embeddings_dim=args.emb_dim, verbose=True)
         word_seq_indexer.load_items_from_embeddings_file_and_unique_words_list(emb_fn=args.emb_fn,
                                                                       emb_delimiter=args.emb_delimiter,
-                                                                      unique_words_list=datasets_bank.unique_words_list)
+                                                                      unique_words_list=datasets_bank.unique_words_list,
+                                                                      workers_num=args.emb_workers_num,
+                                                                      use_cache=args.emb_cache)
     if args.wsi is not None and not isfile(args.wsi):
         torch.save(word_seq_indexer, args.wsi)
 
     # Tag_seq_indexer converts lists of lists of tags to lists of lists of integer indices and back
     tag_seq_indexer = SeqIndexerTag(gpu=args.gpu)
-    tag_seq_indexer.load_items_from_tag_sequences(tag_sequences_train)
+    tag_seq_indexer.load_items_from_tag_sequences(tag_sequences_train if corpus_train is None else [corpus_train.tags_list])
 
     # Create or load pre-trained tagger
     if args.load is None:
@@ -111,6 +150,9 @@ if __name__ == "__main__":
     else:
         tagger = TaggerIO.load_tagger(args.load, args.gpu)
 
+    # Convert all datasets to indices once, train batches are sliced from the indexed data
+    datasets_bank.index_sequences(tagger)
+
     # Create optimizer
     if args.opt_method == 'sgd':
         optimizer = optim.SGD(list(tagger.parameters()), lr=args.lr, momentum=args.momentum)
@@ -124,10 +166,35 @@ if __name__ == "__main__":
     report = Report(args.report_fn, args, score_names=('train loss', 'f1-train', 'f1-dev', 'f1-test', 'acc. train',
                                                        'acc. dev', 'acc. test'))
     iterations_num = floor(datasets_bank.train_data_num / args.batch_size)
+    batch_sampler = None
+    if args.shuffle_buffer_size > 0:
+        batch_sampler = ShuffleBufferBatchSampler(datasets_bank.indexed_train.seq_len, max_tokens=args.batch_max_tokens,
+                                                  buffer_size=args.shuffle_buffer_size,
+                                                  max_batch_size=args.batch_size if args.batch_max_tokens <= 0 else -1,
+                                                  seed=args.seed_num)
+    elif args.batch_max_tokens > 0:
+        batch_sampler = BucketBatchSampler(datasets_bank.indexed_train.seq_len, max_tokens=args.batch_max_tokens,
+                                           seed=args.seed_num)
+    # Train batches are built by the background workers in the order of their indices
+    batch_prefetcher = BatchPrefetcher(datasets_bank.indexed_train.get_batch, workers_num=args.prefetch_workers_num)
+    # Train scores are evaluated on the fixed random subset of train sequences
+    eval_train_indices = None
+    if 0 < args.eval_train_num < datasets_bank.train_data_num:
+        eval_train_indices = np.sort(np.random.RandomState(args.seed_num).choice(datasets_bank.train_data_num,
+                                                                                 args.eval_train_num, replace=False))
+    eval_params = {'eval_train_num': args.eval_train_num, 'eval_train_indices': eval_train_indices,
+                   'eval_test_on_dev_improvement': args.eval_test_on_dev_improvement, 'batch_size': 100}
+    async_evaluator = None
+    if args.eval_async:
+        async_evaluator = AsyncEvaluator(tagger, datasets_bank, eval_params,
+                                         save_fn=args.save if args.save_best else None)
+    get_scores_str = lambda scores, fmt='%1.2f': ' / '.join([fmt % score if score is not None else 'N/A'
+                                                              for score in scores])
     best_f1_dev = -1
     best_epoch = -1
     best_f1_test = -1
     best_test_connl_str = 'N\A'
+    f1_test, test_connl_str, test_epoch = None, 'N\A', -1
     patience_counter = 0
     print('\nStart training...\n')
     for epoch in range(1, args.epoch_num + 1): ########
@@ -137,10 +204,15 @@ if __name__ == "__main__":
             tagger.train()
             if args.lr_decay > 0:
                 scheduler.step()
-            for i, (word_sequences_train_batch, tag_sequences_train_batch) in enumerate(datasets_bank.get_train_batches(args.batch_size)):
+            if batch_sampler is not None:
+                batches_indices = batch_sampler.get_batches_indices()
+                iterations_num = len(batches_indices)
+            else:
+                batches_indices = datasets_bank.get_train_batches_indices(args.batch_size)
+            for i, batch in enumerate(batch_prefetcher.get_batches(batches_indices)):
                 tagger.train()
                 tagger.zero_grad()
-                loss = tagger.get_loss(word_sequences_train_batch, tag_sequences_train_batch)
+                loss = tagger.get_loss_batch(batch)
                 loss.backward()
                 nn.utils.clip_grad_norm_(tagger.parameters(), args.clip_grad)
                 optimizer.step()
@@ -151,35 +223,69 @@ if __name__ == "__main__":
                                                                                             ceil(i*100.0/iterations_num),
                                                                                             loss_sum*100 / iterations_num),
                                                                                             end='', flush=True)
-        # Evaluate tagger
-        f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test, test_connl_str = Evaluator.get_evaluation_train_dev_test(tagger,
-                                                                                                          datasets_bank,
-                                                                                                          batch_size=100)
-        print('\n== eval epoch %d/%d train / dev / test | micro-f1: %1.2f / %1.2f / %1.2f, acc: %1.2f%% / %1.2f%% / %1.2f%%.'
-              %(epoch, args.epoch_num, f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test))
-        report.write_epoch_scores(epoch, (loss_sum*100 / iterations_num, f1_train, f1_dev, f1_test, acc_train, acc_dev,
-                                          acc_test))
-        # Save curr tagger if required
-        # tagger.save('tagger_NER_epoch_%03d.hdf5' % epoch)
-
-        # Early stopping
-        if f1_dev > best_f1_dev:
-            best_f1_dev = f1_dev
-            best_f1_test = f1_test
-            best_epoch = epoch
-            best_test_connl_str = test_connl_str
-            patience_counter = 0
-            if args.save is not None and args.save_best:
-                tagger.save_tagger(args.save)
-            print('## [BEST epoch], %d seconds.\n' % (time.time() - time_start))
+        if batch_sampler is not None:
+            print('\n-- padding ratio of train batches = %1.2f%%.' % (batch_sampler.padding_ratio*100), end='')
+        time_train = time.time() - time_start
+        is_eval_epoch = epoch % args.eval_every == 0 or epoch == args.epoch_num
+
+        # Evaluate tagger; in the async mode the results of previous epochs arrive while the training goes on
+        if async_evaluator is not None:
+            if is_eval_epoch:
+                async_evaluator.submit(epoch, tagger, loss_sum*100 / iterations_num)
+            evaluations = async_evaluator.get_results(wait_all=epoch == args.epoch_num)
+        elif is_eval_epoch:
+            evaluations = [(epoch, loss_sum*100 / iterations_num) +
+                           Evaluator.get_evaluation_epoch(tagger, datasets_bank, best_f1_dev=best_f1_dev, **eval_params)]
         else:
-            patience_counter += 1
-            print('## [no improvement micro-f1 on DEV during the last %d epochs (best_f1_dev=%1.2f), %d seconds].\n' %
-                                                                                                 (patience_counter,
-                                                                                                 best_f1_dev,
-                                                                                                 (time.time()-time_start)))
-        if patience_counter > args.patience and epoch > args.min_epoch_num:
+            evaluations = list()
+        time_eval = time.time() - time_start - time_train
+        if len(evaluations) == 0:
+            print('\n## [no evaluation], %d seconds of training.\n' % time_train)
+        early_stop = False
+        while len(evaluations) > 0:
+            eval_epoch, epoch_loss, f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test, epoch_test_connl_str = \
+                evaluations.pop(0)
+            if f1_test is not None:
+                test_connl_str, test_epoch = epoch_test_connl_str, eval_epoch
+            print('\n== eval epoch %d/%d train / dev / test | micro-f1: %s, acc: %s.' % (eval_epoch, args.epoch_num,
+                                                                                       get_scores_str((f1_train, f1_dev,
+                                                                                                       f1_test)),
+                                                                                       get_scores_str((acc_train, acc_dev,
+                                                                                                       acc_test), '%1.2f%%')))
+            report.write_epoch_scores(eval_epoch, (epoch_loss, f1_train, f1_dev, f1_test, acc_train, acc_dev, acc_test))
+            # Save curr tagger if required
+            # tagger.save('tagger_NER_epoch_%03d.hdf5' % epoch)
+
+            # Early stopping, patience is measured in epochs for any evaluation schedule
+            if f1_dev > best_f1_dev:
+                best_f1_dev = f1_dev
+                best_f1_test = f1_test
+                best_epoch = eval_epoch
+                best_test_connl_str = epoch_test_connl_str
+                patience_counter = 0
+                if args.save is not None and args.save_best and async_evaluator is None:
+                    tagger.save_tagger(args.save) # in the async mode the scored snapshot is saved by the worker
+                print('## [BEST epoch], %d seconds of training, %d seconds of evaluation.\n' % (time_train, time_eval))
+            else:
+                patience_counter = eval_epoch - best_epoch
+                print('## [no improvement micro-f1 on DEV during the last %d epochs (best_f1_dev=%1.2f), %d seconds of '
+                      'training, %d seconds of evaluation].\n' % (patience_counter, best_f1_dev, time_train, time_eval))
+            if patience_counter > args.patience and eval_epoch > args.min_epoch_num and not early_stop:
+                early_stop = True
+                if async_evaluator is not None: # snapshots which are already submitted are scored as well
+                    evaluations.extend(async_evaluator.get_results(wait_all=True))
+        if early_stop:
             break
+    batch_prefetcher.close()
+    if async_evaluator is not None:
+        async_evaluator.close()
+
+    # Test scores of the final tagger, if they were skipped at its epoch
+    if not args.save_best and test_epoch != epoch:
+        accumulator_test = Evaluator.get_accumulator(tagger, datasets_bank.word_sequences_test,
+                                                     datasets_bank.tag_sequences_test, datasets_bank.indexed_test,
+                                                     batch_size=100)
+        f1_test, test_connl_str = accumulator_test.get_f1(), accumulator_test.get_connl_str()
 
     # Save final trained tagger to disk, if it is not already saved according to "save best"
     if args.save is not None and not args.save_best:
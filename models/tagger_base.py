@@ -11,9 +11,13 @@
 import math
 import os.path
 
+import numpy as np
 import torch
 import torch.nn as nn
 
+from classes.batch import Batch
+from classes.utils import get_inference_batches_indices
+
 class TaggerBase(nn.Module):
     def __init__(self,  word_seq_indexer, tag_seq_indexer, gpu, batch_size):
         super(TaggerBase, self).__init__()
@@ -42,37 +46,79 @@ class TaggerBase(nn.Module):
     def forward(self, *input):
         pass
 
+    def get_batch(self, word_sequences, tag_sequences=None):
+        word_idx_tensor = self.tensor_ensure_gpu(self.word_seq_indexer.items2tensor(word_sequences))
+        tag_idx_tensor = None
+        if tag_sequences is not None:
+            tag_idx_tensor = self.tensor_ensure_gpu(self.tag_seq_indexer.items2tensor(tag_sequences))
+        return Batch(word_idx_tensor, [len(word_seq) for word_seq in word_sequences], tag_idx_tensor=tag_idx_tensor,
+                     word_sequences=word_sequences)
+
     def predict_idx_from_words(self, word_sequences):
+        return self.predict_idx_from_batch(self.get_batch(word_sequences))
+
+    def predict_idx_from_batch(self, batch):
         self.eval()
-        outputs_tensor = self.forward(word_sequences) # batch_size x num_class+1 x max_seq_len
-        output_idx_sequences = list()
-        for k in range(len(word_sequences)):
-            idx_seq = list()
-            for l in range(len(word_sequences[k])):
-                curr_output = outputs_tensor[k, 1:, l] # ignore the first component of output
-                max_no = curr_output.argmax(dim=0)
-                idx_seq.append(max_no.item() + 1)
-            output_idx_sequences.append(idx_seq)
-        return output_idx_sequences
-
-    def predict_tags_from_words(self, word_sequences, batch_size=-1):
+        outputs_tensor = self.forward_batch(batch) # batch_size x num_class+1 x max_seq_len
+        output_idx_tensor = outputs_tensor[:, 1:, :].argmax(dim=1) + 1 # ignore the first component of output
+        return [idx_seq[:seq_len] for idx_seq, seq_len in zip(output_idx_tensor.tolist(), batch.seq_len_list)]
+
+    def predict_tags_from_words(self, word_sequences, batch_size=-1, max_tokens=-1, verbose=True):
+        return self.predict_tags_sorted([len(word_seq) for word_seq in word_sequences],
+                                        lambda indices: self.get_batch([word_sequences[i] for i in indices]),
+                                        batch_size, max_tokens, verbose)
+
+    def predict_tags_from_indexed_dataset(self, indexed_dataset, batch_size=-1, max_tokens=-1, indices=None):
+        # Optional indices select the subset of the dataset, tags are returned in the order of indices
+        if indices is None:
+            return self.predict_tags_sorted(indexed_dataset.seq_len.tolist(), indexed_dataset.get_batch, batch_size,
+                                            max_tokens)
+        indices = np.asarray(indices, dtype=np.int64)
+        return self.predict_tags_sorted(indexed_dataset.seq_len[indices].tolist(),
+                                        lambda subset_indices: indexed_dataset.get_batch(indices[subset_indices]),
+                                        batch_size, max_tokens)
+
+    def predict_tags_stream(self, word_sequences, batch_size=-1, window_size=-1, max_tokens=-1):
+        # Generator, word_sequences may be any iterable: at most window_size sequences are read ahead and batched
+        # by their lengths, tags are yielded in the input order
+        if batch_size == -1:
+            batch_size = self.batch_size
+        if window_size == -1:
+            window_size = 100*batch_size
+        window_word_sequences = list()
+        for word_seq in word_sequences:
+            window_word_sequences.append(word_seq)
+            if len(window_word_sequences) == window_size:
+                for tag_seq in self.predict_tags_from_words(window_word_sequences, batch_size, max_tokens, verbose=False):
+                    yield tag_seq
+                window_word_sequences = list()
+        if len(window_word_sequences) > 0:
+            for tag_seq in self.predict_tags_from_words(window_word_sequences, batch_size, max_tokens, verbose=False):
+                yield tag_seq
+
+    def predict_tags_sorted(self, seq_len_list, get_batch_fn, batch_size=-1, max_tokens=-1, verbose=True):
+        return self.predict_sorted(seq_len_list, get_batch_fn,
+                                   lambda batch: self.tag_seq_indexer.idx2items(self.predict_idx_from_batch(batch)),
+                                   batch_size, max_tokens, verbose)
+
+    def predict_sorted(self, seq_len_list, get_batch_fn, predict_batch_fn, batch_size=-1, max_tokens=-1, verbose=True):
+        # Sequences are batched in the order of their lengths, predict_batch_fn returns the list of outputs for the
+        # sequences of the batch; outputs are returned in the original order
         if batch_size == -1:
             batch_size = self.batch_size
-        print('\n')
-        batch_num = math.floor(len(word_sequences) / batch_size)
-        output_tag_sequences = list()
-        for n in range(batch_num):
-            i = n*batch_size
-            if n < batch_num - 1:
-                j = (n + 1)*batch_size
-            else:
-                j = len(word_sequences)
-            curr_output_idx = self.predict_idx_from_words(word_sequences[i:j])
-            curr_output_tag_sequences = self.tag_seq_indexer.idx2items(curr_output_idx)
-            output_tag_sequences.extend(curr_output_tag_sequences)
-            print('\r++ predicting, batch %d/%d (%1.2f%%).' % (n + 1, batch_num, math.ceil(n * 100.0 / batch_num)),
-                  end='', flush=True)
-        return output_tag_sequences
+        if verbose:
+            print('\n')
+        batches_indices = get_inference_batches_indices(seq_len_list, batch_size, max_tokens)
+        batch_num = len(batches_indices)
+        outputs = [None for _ in seq_len_list]
+        for n, batch_indices in enumerate(batches_indices):
+            curr_outputs = predict_batch_fn(get_batch_fn(batch_indices))
+            for i, output in zip(batch_indices, curr_outputs):
+                outputs[i] = output
+            if verbose:
+                print('\r++ predicting, batch %d/%d (%1.2f%%).' % (n + 1, batch_num, math.ceil(n * 100.0 / batch_num)),
+                      end='', flush=True)
+        return outputs
 
     def get_mask_from_word_sequences(self, word_sequences):
         batch_num = len(word_sequences)
@@ -49,10 +49,13 @@ class TaggerBiRNN(TaggerBase):
         self.nll_loss = nn.NLLLoss(ignore_index=0) # "0" target values actually are zero-padded parts of sequences
 
     def forward(self, word_sequences):
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        z_word_embed = self.word_embeddings_layer(word_sequences)
+        return self.forward_batch(self.get_batch(word_sequences))
+
+    def forward_batch(self, batch):
+        mask = batch.mask_tensor
+        z_word_embed = self.word_embeddings_layer(batch.word_idx_tensor)
         z_word_embed_d = self.dropout(z_word_embed)
-        rnn_output_h = self.birnn_layer(z_word_embed_d, mask)
+        rnn_output_h = self.birnn_layer(z_word_embed_d, mask, batch)
         #rnn_output_h_d = self.dropout(rnn_output_h) # shape: batch_size x max_seq_len x rnn_hidden_dim*2
         #z_rnn_out = self.lin_layer(rnn_output_h_d).permute(0, 2, 1) # shape: batch_size x class_num + 1 x max_seq_len
         z_rnn_out = self.apply_mask(self.lin_layer(rnn_output_h), mask) # shape: batch_size x class_num + 1 x max_seq_len
@@ -60,7 +63,9 @@ class TaggerBiRNN(TaggerBase):
         return y
 
     def get_loss(self, word_sequences_train_batch, tag_sequences_train_batch):
-        outputs_tensor_train_batch_one_hot = self.forward(word_sequences_train_batch)
-        targets_tensor_train_batch = self.tag_seq_indexer.items2tensor(tag_sequences_train_batch)
-        loss = self.nll_loss(outputs_tensor_train_batch_one_hot, targets_tensor_train_batch)
+        return self.get_loss_batch(self.get_batch(word_sequences_train_batch, tag_sequences_train_batch))
+
+    def get_loss_batch(self, batch):
+        outputs_tensor_train_batch_one_hot = self.forward_batch(batch)
+        loss = self.nll_loss(outputs_tensor_train_batch_one_hot, batch.tag_idx_tensor)
         return loss
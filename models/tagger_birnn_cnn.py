@@ -15,12 +15,13 @@ from layers.layer_bilstm import LayerBiLSTM
 from layers.layer_bigru import LayerBiGRU
 from layers.layer_char_embeddings import LayerCharEmbeddings
 from layers.layer_char_cnn import LayerCharCNN
+from classes.char_features_cache import CharFeaturesCache
 
 class TaggerBiRNNCNN(TaggerBase):
     def __init__(self, word_seq_indexer, tag_seq_indexer, class_num, batch_size=1, rnn_hidden_dim=100,
                  freeze_word_embeddings=False, dropout_ratio=0.5, rnn_type='GRU', gpu=-1,
                  freeze_char_embeddings = False, char_embeddings_dim=25, word_len=20, char_cnn_filter_num=30,
-                 char_window_size=3):
+                 char_window_size=3, char_cache_size=100000):
         super(TaggerBiRNNCNN, self).__init__(word_seq_indexer, tag_seq_indexer, gpu, batch_size)
         self.tag_seq_indexer = tag_seq_indexer
         self.class_num = class_num
@@ -36,9 +37,11 @@ class TaggerBiRNNCNN(TaggerBase):
         self.char_window_size = char_window_size
         self.word_embeddings_layer = LayerWordEmbeddings(word_seq_indexer, gpu, freeze_word_embeddings)
         self.char_embeddings_layer = LayerCharEmbeddings(gpu, char_embeddings_dim, freeze_char_embeddings,
-                                                         word_len, word_seq_indexer.get_unique_characters_list())
+                                                         word_len, word_seq_indexer.get_unique_characters_list(),
+                                                         word_seq_indexer)
         self.char_cnn_layer = LayerCharCNN(gpu, char_embeddings_dim, char_cnn_filter_num, char_window_size,
                                            word_len)
+        self.char_features_cache = CharFeaturesCache(max_size=char_cache_size)
         self.dropout = torch.nn.Dropout(p=dropout_ratio)
         if rnn_type == 'GRU':
             self.birnn_layer = LayerBiGRU(input_dim=self.word_embeddings_layer.output_dim+self.char_cnn_layer.output_dim,
@@ -61,28 +64,70 @@ class TaggerBiRNNCNN(TaggerBase):
             self.cuda(device=self.gpu)
         self.nll_loss = nn.NLLLoss(ignore_index=0)  # "0" target values actually are zero-padded parts of sequences
 
+    def __setstate__(self, state):
+        # Taggers saved by the older versions have no cache of character-level features, their char embeddings layer
+        # has no access to the vocabulary
+        if 'char_features_cache' not in state:
+            state['char_features_cache'] = CharFeaturesCache()
+        char_embeddings_layer = state['_modules']['char_embeddings_layer']
+        if char_embeddings_layer.word_seq_indexer is None:
+            char_embeddings_layer.word_seq_indexer = state['word_seq_indexer']
+        super(TaggerBiRNNCNN, self).__setstate__(state)
+
+    def train(self, mode=True):
+        super(TaggerBiRNNCNN, self).train(mode)
+        if mode:
+            self.char_features_cache.invalidate()
+        return self
+
+    def load_state_dict(self, state_dict, strict=True):
+        self.char_features_cache.invalidate() # new weights are copied through .data
+        return super(TaggerBiRNNCNN, self).load_state_dict(state_dict, strict)
+
+    def get_batch(self, word_sequences, tag_sequences=None):
+        batch = super(TaggerBiRNNCNN, self).get_batch(word_sequences, tag_sequences)
+        batch.char_idx_tensor = self.char_embeddings_layer.get_char_idx_tensor(word_sequences)
+        return batch
+
+    def _forward_char_cnn(self, batch):
+        if self.training or batch.word_sequences is None:
+            z_char_embed = self.char_embeddings_layer(batch.char_idx_tensor)
+            z_char_embed_d = self.dropout(z_char_embed)
+            return self.char_cnn_layer(z_char_embed_d, batch.mask_tensor, batch)
+        # Inference mode, char features are computed only for the words that are missed in the cache
+        self.char_features_cache.check_weights(list(self.char_embeddings_layer.parameters()) +
+                                               list(self.char_cnn_layer.parameters()))
+        return self.char_features_cache.get_features(batch.word_sequences, self._get_char_cnn_features_of_words,
+                                                     pad_features=self.char_cnn_layer.conv1d.bias)
+
+    def _get_char_cnn_features_of_words(self, words):
+        char_idx_tensor = self.char_embeddings_layer.get_char_idx_tensor([words])
+        return self.char_cnn_layer(self.char_embeddings_layer(char_idx_tensor)).squeeze(0) # shape: words_num x output_dim
+
     def forward(self, word_sequences):
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        z_word_embed = self.word_embeddings_layer(word_sequences)
-        z_char_embed = self.char_embeddings_layer(word_sequences)
-        z_char_embed_d = self.dropout(z_char_embed)
-        z_char_cnn_d = self.dropout(self.char_cnn_layer(z_char_embed_d))
+        return self.forward_batch(self.get_batch(word_sequences))
+
+    def forward_batch(self, batch):
+        mask = batch.mask_tensor
+        z_word_embed = self.word_embeddings_layer(batch.word_idx_tensor)
+        z_char_cnn_d = self.dropout(self._forward_char_cnn(batch))
         z = torch.cat((z_word_embed, z_char_cnn_d), dim=2)
-        rnn_output_h = self.birnn_layer(z, mask)
+        rnn_output_h = self.birnn_layer(z, mask, batch)
         rnn_output_h_d = self.dropout(rnn_output_h) # shape: batch_size x max_seq_len x rnn_hidden_dim*2
         z_rnn_out = self.apply_mask(self.lin_layer(rnn_output_h_d), mask)
         y = self.log_softmax_layer(z_rnn_out.permute(0, 2, 1))
         return y
 
     def forward_1b(self, word_sequences):
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        z_word_embed = self.word_embeddings_layer(word_sequences)
+        batch = self.get_batch(word_sequences)
+        mask = batch.mask_tensor
+        z_word_embed = self.word_embeddings_layer(batch.word_idx_tensor)
         z_word_embed_d = self.dropout(z_word_embed)
-        z_char_embed = self.char_embeddings_layer(word_sequences)
+        z_char_embed = self.char_embeddings_layer(batch.char_idx_tensor)
         z_char_embed_d = self.dropout(z_char_embed)
-        z_char_cnn = self.char_cnn_layer(z_char_embed_d)
+        z_char_cnn = self.char_cnn_layer(z_char_embed_d, mask, batch)
         z = torch.cat((z_word_embed_d, z_char_cnn), dim=2)
-        rnn_output_h = self.birnn_layer(z, mask)
+        rnn_output_h = self.birnn_layer(z, mask, batch)
         #rnn_output_h_d = self.dropout(rnn_output_h) # shape: batch_size x max_seq_len x rnn_hidden_dim*2
         #z_rnn_out = self.lin_layer(rnn_output_h_d).permute(0, 2, 1) # shape: batch_size x class_num + 1 x max_seq_len
         z_rnn_out = self.apply_mask(self.lin_layer(rnn_output_h), mask)
@@ -91,7 +136,9 @@ class TaggerBiRNNCNN(TaggerBase):
 
 
     def get_loss(self, word_sequences_train_batch, tag_sequences_train_batch):
-        outputs_tensor_train_batch_one_hot = self.forward(word_sequences_train_batch)
-        targets_tensor_train_batch = self.tag_seq_indexer.items2tensor(tag_sequences_train_batch)
-        loss = self.nll_loss(outputs_tensor_train_batch_one_hot, targets_tensor_train_batch)
+        return self.get_loss_batch(self.get_batch(word_sequences_train_batch, tag_sequences_train_batch))
+
+    def get_loss_batch(self, batch):
+        outputs_tensor_train_batch_one_hot = self.forward_batch(batch)
+        loss = self.nll_loss(outputs_tensor_train_batch_one_hot, batch.tag_idx_tensor)
         return loss
@@ -10,7 +10,7 @@ import math
 import torch
 import torch.nn as nn
 
-from models.tagger_base import TaggerBase
+from models.tagger_crf_base import TaggerCRFBase
 from layers.layer_word_embeddings import LayerWordEmbeddings
 from layers.layer_bivanilla import LayerBiVanilla
 from layers.layer_bilstm import LayerBiLSTM
@@ -18,12 +18,13 @@ from layers.layer_bigru import LayerBiGRU
 from layers.layer_char_embeddings import LayerCharEmbeddings
 from layers.layer_char_cnn import LayerCharCNN
 from layers.layer_crf import LayerCRF
+from classes.char_features_cache import CharFeaturesCache
 
-class TaggerBiRNNCNNCRF(TaggerBase):
+class TaggerBiRNNCNNCRF(TaggerCRFBase):
     def __init__(self, word_seq_indexer, tag_seq_indexer, class_num, batch_size=1, rnn_hidden_dim=100,
                  freeze_word_embeddings=False, dropout_ratio=0.5, rnn_type='GRU', gpu=-1,
                  freeze_char_embeddings = False, char_embeddings_dim=25, word_len=20, char_cnn_filter_num=30,
-                 char_window_size=3):
+                 char_window_size=3, char_cache_size=100000, crf_sparse_transitions=False):
         super(TaggerBiRNNCNNCRF, self).__init__(word_seq_indexer, tag_seq_indexer, gpu, batch_size)
         self.tag_seq_indexer = tag_seq_indexer
         self.class_num = class_num
@@ -40,9 +41,11 @@ class TaggerBiRNNCNNCRF(TaggerBase):
         self.char_window_size = char_window_size
         self.word_embeddings_layer = LayerWordEmbeddings(word_seq_indexer, gpu, freeze_word_embeddings)
         self.char_embeddings_layer = LayerCharEmbeddings(gpu, char_embeddings_dim, freeze_char_embeddings,
-                                                         word_len, word_seq_indexer.get_unique_characters_list())
+                                                         word_len, word_seq_indexer.get_unique_characters_list(),
+                                                         word_seq_indexer)
         self.char_cnn_layer = LayerCharCNN(gpu, char_embeddings_dim, char_cnn_filter_num, char_window_size,
                                            word_len)
+        self.char_features_cache = CharFeaturesCache(max_size=char_cache_size)
         self.dropout = torch.nn.Dropout(p=dropout_ratio)
 
         if rnn_type == 'GRU':
@@ -61,57 +64,78 @@ class TaggerBiRNNCNNCRF(TaggerBase):
             raise ValueError('Unknown rnn_type = %s, must be either "LSTM" or "GRU"')
         self.lin_layer = nn.Linear(in_features=self.birnn_layer.output_dim, out_features=class_num + 2)
         self.crf_layer = LayerCRF(gpu, states_num=class_num + 2, pad_idx=tag_seq_indexer.pad_idx, sos_idx=class_num + 1,
-                                  tag_seq_indexer=tag_seq_indexer)
+                                  tag_seq_indexer=tag_seq_indexer, sparse_transitions=crf_sparse_transitions)
         self.softmax = nn.Softmax(dim=2)
         if gpu >= 0:
             self.cuda(device=self.gpu)
 
-    def _forward_birnn(self, word_sequences):
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        z_word_embed = self.word_embeddings_layer(word_sequences)
+    def __setstate__(self, state):
+        # Taggers saved by the older versions have no cache of character-level features, their char embeddings layer
+        # has no access to the vocabulary
+        if 'char_features_cache' not in state:
+            state['char_features_cache'] = CharFeaturesCache()
+        char_embeddings_layer = state['_modules']['char_embeddings_layer']
+        if char_embeddings_layer.word_seq_indexer is None:
+            char_embeddings_layer.word_seq_indexer = state['word_seq_indexer']
+        super(TaggerBiRNNCNNCRF, self).__setstate__(state)
+
+    def train(self, mode=True):
+        super(TaggerBiRNNCNNCRF, self).train(mode)
+        if mode:
+            self.char_features_cache.invalidate()
+        return self
+
+    def load_state_dict(self, state_dict, strict=True):
+        self.char_features_cache.invalidate() # new weights are copied through .data
+        return super(TaggerBiRNNCNNCRF, self).load_state_dict(state_dict, strict)
+
+    def get_batch(self, word_sequences, tag_sequences=None):
+        batch = super(TaggerBiRNNCNNCRF, self).get_batch(word_sequences, tag_sequences)
+        batch.char_idx_tensor = self.char_embeddings_layer.get_char_idx_tensor(word_sequences)
+        return batch
+
+    def _forward_char_cnn(self, batch):
+        if self.training or batch.word_sequences is None:
+            z_char_embed = self.char_embeddings_layer(batch.char_idx_tensor)
+            z_char_embed_d = self.dropout(z_char_embed)
+            return self.char_cnn_layer(z_char_embed_d, batch.mask_tensor, batch)
+        # Inference mode, char features are computed only for the words that are missed in the cache
+        self.char_features_cache.check_weights(list(self.char_embeddings_layer.parameters()) +
+                                               list(self.char_cnn_layer.parameters()))
+        return self.char_features_cache.get_features(batch.word_sequences, self._get_char_cnn_features_of_words,
+                                                     pad_features=self.char_cnn_layer.conv1d.bias)
+
+    def _get_char_cnn_features_of_words(self, words):
+        char_idx_tensor = self.char_embeddings_layer.get_char_idx_tensor([words])
+        return self.char_cnn_layer(self.char_embeddings_layer(char_idx_tensor)).squeeze(0) # shape: words_num x output_dim
+
+    def _forward_birnn(self, batch):
+        mask = batch.mask_tensor
+        z_word_embed = self.word_embeddings_layer(batch.word_idx_tensor)
         z_word_embed_d = self.dropout(z_word_embed)
-        z_char_embed = self.char_embeddings_layer(word_sequences)
-        z_char_embed_d = self.dropout(z_char_embed)
-        z_char_cnn = self.char_cnn_layer(z_char_embed_d)
+        z_char_cnn = self._forward_char_cnn(batch)
         z = torch.cat((z_word_embed_d, z_char_cnn), dim=2)
-        rnn_output_h = self.apply_mask(self.birnn_layer(z, mask), mask)
+        rnn_output_h = self.apply_mask(self.birnn_layer(z, mask, batch), mask)
         features_rnn_compressed = self.lin_layer(rnn_output_h)
         return self.apply_mask(features_rnn_compressed, mask)
 
     def get_loss(self, word_sequences_train_batch, tag_sequences_train_batch):
-        targets_tensor_train_batch = self.tag_seq_indexer.items2tensor(tag_sequences_train_batch)
-        features_rnn = self._forward_birnn(word_sequences_train_batch) # batch_num x max_seq_len x class_num
-        mask = self.get_mask_from_word_sequences(word_sequences_train_batch)  # batch_num x max_seq_len
-        numerator = self.crf_layer.numerator(features_rnn, targets_tensor_train_batch, mask)
-        denominator = self.crf_layer.denominator(features_rnn, mask)
+        return self.get_loss_batch(self.get_batch(word_sequences_train_batch, tag_sequences_train_batch))
+
+    def get_loss_batch(self, batch):
+        features_rnn = self._forward_birnn(batch) # batch_num x max_seq_len x class_num
+        mask = batch.mask_tensor # batch_num x max_seq_len
+        numerator = self.crf_layer.numerator(features_rnn, batch.tag_idx_tensor, mask)
+        denominator = self.crf_layer.denominator(features_rnn, mask, batch)
         nll_loss = -torch.mean(numerator - denominator)
         return nll_loss
 
     def predict_idx_from_words(self, word_sequences, no=-1):
+        return self.predict_idx_from_batch(self.get_batch(word_sequences))
+
+    def predict_idx_from_batch(self, batch):
         self.eval()
-        features_rnn_compressed_masked  = self._forward_birnn(word_sequences)
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        idx_sequences = self.crf_layer.decode_viterbi(features_rnn_compressed_masked, mask)
+        features_rnn_compressed_masked  = self._forward_birnn(batch)
+        idx_sequences = self.crf_layer.decode_viterbi(features_rnn_compressed_masked, batch.mask_tensor, batch)
         return idx_sequences
 
-    def predict_tags_from_words(self, word_sequences, batch_size=-1):
-        if batch_size == -1:
-            batch_size = self.batch_size
-        print('\n')
-        batch_num = math.floor(len(word_sequences) / batch_size)
-        output_tag_sequences = list()
-        for n in range(batch_num):
-            i = n*batch_size
-            if n < batch_num - 1:
-                j = (n + 1)*batch_size
-            else:
-                j = len(word_sequences)
-            if batch_size == 1:
-                curr_output_idx = self.predict_idx_from_words(word_sequences[i:j], n)
-            else:
-                curr_output_idx = self.predict_idx_from_words(word_sequences[i:j], -1)
-            curr_output_tag_sequences = self.tag_seq_indexer.idx2items(curr_output_idx)
-            output_tag_sequences.extend(curr_output_tag_sequences)
-            print('\r++ predicting, batch %d/%d (%1.2f%%).' % (n + 1, batch_num, math.ceil(n * 100.0 / batch_num)),
-                  end='', flush=True)
-        return output_tag_sequences
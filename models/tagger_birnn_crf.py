@@ -10,16 +10,17 @@ import math
 import torch
 import torch.nn as nn
 
-from models.tagger_base import TaggerBase
+from models.tagger_crf_base import TaggerCRFBase
 from layers.layer_word_embeddings import LayerWordEmbeddings
 from layers.layer_bivanilla import LayerBiVanilla
 from layers.layer_bilstm import LayerBiLSTM
 from layers.layer_bigru import LayerBiGRU
 from layers.layer_crf import LayerCRF
 
-class TaggerBiRNNCRF(TaggerBase):
+class TaggerBiRNNCRF(TaggerCRFBase):
     def __init__(self, word_seq_indexer, tag_seq_indexer, class_num, batch_size=1, rnn_hidden_dim=100,
-                 freeze_word_embeddings=False, dropout_ratio=0.5, rnn_type='GRU', gpu=-1):
+                 freeze_word_embeddings=False, dropout_ratio=0.5, rnn_type='GRU', gpu=-1,
+                 crf_sparse_transitions=False):
         super(TaggerBiRNNCRF, self).__init__(word_seq_indexer, tag_seq_indexer, gpu, batch_size)
         self.tag_seq_indexer = tag_seq_indexer
         self.class_num = class_num
@@ -46,55 +47,40 @@ class TaggerBiRNNCRF(TaggerBase):
             raise ValueError('Unknown rnn_type = %s, must be either "LSTM" or "GRU"')
         self.lin_layer = nn.Linear(in_features=self.birnn_layer.output_dim, out_features=class_num + 2)
         self.crf_layer = LayerCRF(gpu, states_num=class_num + 2, pad_idx=tag_seq_indexer.pad_idx, sos_idx=class_num + 1,
-                                  tag_seq_indexer=tag_seq_indexer)
+                                  tag_seq_indexer=tag_seq_indexer, sparse_transitions=crf_sparse_transitions)
         if gpu >= 0:
             self.cuda(device=self.gpu)
 
-    def _forward_birnn(self, word_sequences):
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        z_word_embed = self.word_embeddings_layer(word_sequences)
+    def _forward_birnn(self, batch):
+        mask = batch.mask_tensor
+        z_word_embed = self.word_embeddings_layer(batch.word_idx_tensor)
         z_word_embed_d = self.dropout(z_word_embed)
-        rnn_output_h = self.birnn_layer(z_word_embed_d, mask)
+        rnn_output_h = self.birnn_layer(z_word_embed_d, mask, batch)
         #rnn_output_h_d = self.dropout(rnn_output_h) # shape: batch_size x max_seq_len x rnn_hidden_dim*2
         #features_rnn_compressed = self.lin_layer(rnn_output_h_d) # shape: batch_size x max_seq_len x class_num
         features_rnn_compressed = self.lin_layer(rnn_output_h) # shape: batch_size x max_seq_len x class_num
         return self.apply_mask(features_rnn_compressed, mask)
 
     def get_loss(self, word_sequences_train_batch, tag_sequences_train_batch):
-        targets_tensor_train_batch = self.tag_seq_indexer.items2tensor(tag_sequences_train_batch)
-        features_rnn = self._forward_birnn(word_sequences_train_batch) # batch_num x max_seq_len x class_num
-        mask = self.get_mask_from_word_sequences(word_sequences_train_batch)  # batch_num x max_seq_len
-        numerator = self.crf_layer.numerator(features_rnn, targets_tensor_train_batch, mask)
-        denominator = self.crf_layer.denominator(features_rnn, mask)
+        return self.get_loss_batch(self.get_batch(word_sequences_train_batch, tag_sequences_train_batch))
+
+    def get_loss_batch(self, batch):
+        features_rnn = self._forward_birnn(batch) # batch_num x max_seq_len x class_num
+        mask = batch.mask_tensor # batch_num x max_seq_len
+        numerator = self.crf_layer.numerator(features_rnn, batch.tag_idx_tensor, mask)
+        denominator = self.crf_layer.denominator(features_rnn, mask, batch)
         nll_loss = -torch.mean(numerator - denominator)
         return nll_loss
 
     def predict_idx_from_words(self, word_sequences):
+        return self.predict_idx_from_batch(self.get_batch(word_sequences))
+
+    def predict_idx_from_batch(self, batch):
         self.eval()
-        features_rnn_compressed  = self._forward_birnn(word_sequences)
-        mask = self.get_mask_from_word_sequences(word_sequences)
-        idx_sequences = self.crf_layer.decode_viterbi(features_rnn_compressed, mask)
+        features_rnn_compressed  = self._forward_birnn(batch)
+        idx_sequences = self.crf_layer.decode_viterbi(features_rnn_compressed, batch.mask_tensor, batch)
         return idx_sequences
 
-    def predict_tags_from_words(self, word_sequences, batch_size=-1):
-        if batch_size == -1:
-            batch_size = self.batch_size
-        print('\n')
-        batch_num = math.floor(len(word_sequences) / batch_size)
-        output_tag_sequences = list()
-        for n in range(batch_num):
-            i = n*batch_size
-            if n < batch_num - 1:
-                j = (n + 1)*batch_size
-            else:
-                j = len(word_sequences)
-            curr_output_idx = self.predict_idx_from_words(word_sequences[i:j])
-            curr_output_tag_sequences = self.tag_seq_indexer.idx2items(curr_output_idx)
-            output_tag_sequences.extend(curr_output_tag_sequences)
-            print('\r++ predicting, batch %d/%d (%1.2f%%).' % (n + 1, batch_num, math.ceil(n * 100.0 / batch_num)),
-                  end='', flush=True)
-        return output_tag_sequences
-
     '''
     def forward(self, word_sequences):
         # outputs_tensor = self.forward(word_sequences)  # batch_num x class_num x max_seq_len
@@ -0,0 +1,39 @@
+"""
+.. module:: TaggerCRFBase
+    :synopsis: TaggerCRFBase is an abstract class for tagger models with the CRF output layer. It implements the N-best
+    decoding of tag sequences, abstract method `_forward_birnn` that produces the features of the CRF layer for the
+    batch has to be implemented in ancestors.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+from models.tagger_base import TaggerBase
+
+class TaggerCRFBase(TaggerBase):
+    def _forward_birnn(self, batch):
+        pass
+
+    def predict_idx_nbest_from_words(self, word_sequences, k):
+        return self.predict_idx_nbest_from_batch(self.get_batch(word_sequences), k)
+
+    def predict_idx_nbest_from_batch(self, batch, k):
+        self.eval()
+        features_rnn_compressed = self._forward_birnn(batch)
+        idx_sequences_nbest, scores_nbest = self.crf_layer.decode_viterbi_nbest(features_rnn_compressed,
+                                                                                batch.mask_tensor, k, batch)
+        return idx_sequences_nbest, scores_nbest
+
+    def predict_tags_nbest_from_batch(self, batch, k):
+        # Returns the list of (up to k best tag sequences, their scores) for each sequence of the batch
+        idx_sequences_nbest, scores_nbest = self.predict_idx_nbest_from_batch(batch, k)
+        return [(self.tag_seq_indexer.idx2items(idx_seq_nbest), curr_scores_nbest)
+                for idx_seq_nbest, curr_scores_nbest in zip(idx_sequences_nbest, scores_nbest)]
+
+    def predict_tags_nbest_from_words(self, word_sequences, k, batch_size=-1, max_tokens=-1):
+        # Returns up to k best tag sequences and their scores for each of word sequences, batches are formed by the
+        # sorted lengths under the tokens budget as in predict_tags_from_words
+        outputs = self.predict_sorted([len(word_seq) for word_seq in word_sequences],
+                                      lambda indices: self.get_batch([word_sequences[i] for i in indices]),
+                                      lambda batch: self.predict_tags_nbest_from_batch(batch, k),
+                                      batch_size, max_tokens, verbose=False)
+        return [tag_sequences_nbest for tag_sequences_nbest, _ in outputs], [scores for _, scores in outputs]
@@ -62,7 +62,8 @@ class TaggerIO():
                                     freeze_word_embeddings=args.freeze_word_embeddings,
                                     dropout_ratio=args.dropout_ratio,
                                     rnn_type=args.rnn_type,
-                                    gpu=args.gpu)
+                                    gpu=args.gpu,
+                                    crf_sparse_transitions=args.crf_sparse_transitions)
             tagger.crf_layer.init_transition_matrix_empirical(tag_sequences_train)
         elif args.model == 'BiRNNCNNCRF':
             tagger = TaggerBiRNNCNNCRF(word_seq_indexer=word_seq_indexer,
@@ -78,7 +79,8 @@ class TaggerIO():
                                        char_embeddings_dim=args.char_embeddings_dim,
                                        word_len=args.word_len,
                                        char_cnn_filter_num=args.char_cnn_filter_num,
-                                       char_window_size=args.char_window_size)
+                                       char_window_size=args.char_window_size,
+                                       crf_sparse_transitions=args.crf_sparse_transitions)
             tagger.crf_layer.init_transition_matrix_empirical(tag_sequences_train)
         else:
             raise ValueError('Unknown tagger model, must be one of "BiRNN"/"BiRNNCNN"/"BiRNNCRF"/"BiRNNCNNCRF".')
@@ -30,8 +30,9 @@ class SeqIndexerBase():
         self.embeddings_dim = embeddings_dim
         self.verbose = verbose
         self.out_of_vocabulary_list = list()
+        self.items_list = list() # append-only, idx -> item
         self.item2idx_dict = dict()
-        self.idx2item_dict = dict()
+        self.items_array = None # object array of items for decoding, it is rebuilt after adding new items
         if load_embeddings:
             self.embeddings_loaded = False
             self.embedding_vectors_list = list()
@@ -44,21 +45,52 @@ class SeqIndexerBase():
             if load_embeddings:
                 self.add_emb_vector(self.generate_random_emb_vector())
 
+    def __getstate__(self):
+        # Items are saved as a single string and an array of their lengths instead of dicts of Python objects
+        state = self.__dict__.copy()
+        del state['item2idx_dict']
+        state['items_array'] = None
+        if all(isinstance(item, str) for item in self.items_list):
+            state['items_list'] = (''.join(self.items_list),
+                                   np.asarray([len(item) for item in self.items_list], dtype=np.int32))
+        if 'embedding_vectors_list' in state and len(self.embedding_vectors_list) > 0:
+            state['embedding_vectors_list'] = np.asarray(self.embedding_vectors_list, dtype=np.float32)
+        return state
+
+    def __setstate__(self, state):
+        if 'items_list' not in state: # indexers saved by the older versions
+            state['items_list'] = [state['idx2item_dict'][idx] for idx in range(len(state['idx2item_dict']))]
+            del state['idx2item_dict']
+            state['items_array'] = None
+        elif isinstance(state['items_list'], tuple):
+            items_str, items_len = state['items_list']
+            offsets = np.zeros(len(items_len) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(items_len)
+            state['items_list'] = [items_str[offsets[i]:offsets[i + 1]] for i in range(len(items_len))]
+        if isinstance(state.get('embedding_vectors_list', None), np.ndarray):
+            state['embedding_vectors_list'] = list(state['embedding_vectors_list'])
+        state['item2idx_dict'] = dict(zip(state['items_list'], range(len(state['items_list']))))
+        self.__dict__.update(state)
+
     def get_items_list(self):
-        return list(self.item2idx_dict.keys())
+        return list(self.items_list)
 
     def get_items_count(self):
-        return len(self.get_items_list())
+        return len(self.items_list)
 
     def item_exists(self, item):
-        return item in self.item2idx_dict.keys()
+        return item in self.item2idx_dict
 
     def add_item(self, item):
-        idx = len(self.get_items_list())
+        idx = len(self.items_list)
+        self.items_list.append(item)
         self.item2idx_dict[item] = idx
-        self.idx2item_dict[idx] = item
+        self.items_array = None
         return idx
 
+    def get_item(self, idx):
+        return self.items_list[idx]
+
     def get_class_num(self):
         if self.pad is not None and self.unk is not None:
             return self.get_items_count() - 2
@@ -66,27 +98,33 @@ class SeqIndexerBase():
             return self.get_items_count() - 1
         return self.get_items_count()
 
+    def get_default_idx(self):
+        # Index for the items which are not in the indexer
+        if self.unk is not None:
+            return self.item2idx_dict[self.unk]
+        if self.pad is not None:
+            return self.item2idx_dict[self.pad]
+        return None
+
     def items2idx(self, item_sequences):
-        idx_sequences = []
-        for item_seq in item_sequences:
-            idx_seq = list()
-            for item in item_seq:
-                if item in self.item2idx_dict:
-                    idx_seq.append(self.item2idx_dict[item])
-                else:
-                    if self.unk is not None:
-                        idx_seq.append(self.item2idx_dict[self.unk])
-                    else:
-                        idx_seq.append(self.item2idx_dict[self.pad])
-            idx_sequences.append(idx_seq)
-        return idx_sequences
+        item2idx_dict = self.item2idx_dict
+        default_idx = self.get_default_idx()
+        if default_idx is None:
+            return [[item2idx_dict[item] for item in item_seq] for item_seq in item_sequences]
+        return [[item2idx_dict.get(item, default_idx) for item in item_seq] for item_seq in item_sequences]
 
     def idx2items(self, idx_sequences):
-        item_sequences = []
-        for idx_seq in idx_sequences:
-            item_seq = [self.idx2item_dict[idx] for idx in idx_seq]
-            item_sequences.append(item_seq)
-        return item_sequences
+        # All sequences are decoded by the single NumPy indexing operation
+        if self.items_array is None:
+            self.items_array = np.empty(len(self.items_list), dtype=object)
+            self.items_array[:] = self.items_list
+        seq_lens = [len(idx_seq) for idx_seq in idx_sequences]
+        if sum(seq_lens) == 0:
+            return [list() for _ in idx_sequences]
+        items = self.items_array[np.concatenate([np.asarray(idx_seq, dtype=np.int64).reshape(-1)
+                                                 for idx_seq in idx_sequences])].tolist()
+        offsets = np.cumsum([0] + seq_lens).tolist()
+        return [items[offsets[k]:offsets[k + 1]] for k in range(len(idx_sequences))]
 
     def items2tensor(self, item_sequences, align='left', word_len=-1):
         idx = self.items2idx(item_sequences)
@@ -96,23 +134,20 @@ class SeqIndexerBase():
         batch_size = len(idx_sequences)
         if word_len == -1:
             word_len = max([len(idx_seq) for idx_seq in idx_sequences])
-        # tensor = torch.zeros(batch_size, word_len, dtype=torch.long)
-        if self.gpu >= 0:
-            tensor = torch.cuda.LongTensor(batch_size, word_len).fill_(0)
-        else:
-            tensor = torch.LongTensor(batch_size, word_len).fill_(0)
-        for k, idx_seq in enumerate(idx_sequences):
-            curr_seq_len = len(idx_seq)
-            if curr_seq_len > word_len:
-                idx_seq = [idx_seq[i] for i in range(word_len)]
-                curr_seq_len = word_len
-            if align == 'left':
-                tensor[k, :curr_seq_len] = torch.LongTensor(np.asarray(idx_seq))
-            elif align == 'center':
-                start_idx = (word_len - curr_seq_len) // 2
-                tensor[k, start_idx:start_idx+curr_seq_len] = torch.LongTensor(np.asarray(idx_seq))
-            else:
-                raise ValueError('Unknown align string.')
+        if align not in ['left', 'center']:
+            raise ValueError('Unknown align string.')
+        # Sequences longer than word_len are truncated, all sequences are placed to the padded array at once
+        idx_sequences = [idx_seq[:word_len] for idx_seq in idx_sequences]
+        seq_lens = np.asarray([len(idx_seq) for idx_seq in idx_sequences], dtype=np.int64)
+        array = np.zeros((batch_size, word_len), dtype=np.int64)
+        if seq_lens.sum() > 0:
+            rows = np.repeat(np.arange(batch_size), seq_lens)
+            cols = np.arange(rows.shape[0]) - np.repeat(np.cumsum(seq_lens) - seq_lens, seq_lens)
+            if align == 'center':
+                cols += np.repeat((word_len - seq_lens) // 2, seq_lens)
+            array[rows, cols] = np.concatenate([np.asarray(idx_seq, dtype=np.int64).reshape(-1)
+                                                for idx_seq in idx_sequences])
+        tensor = torch.from_numpy(array)
         if self.gpu >= 0:
             tensor = tensor.cuda(device=self.gpu)
         return tensor
@@ -42,4 +42,4 @@ class SeqIndexerBaseEmbeddings(SeqIndexerBase):
         self.embedding_vectors_list.append(emb_vector)
 
     def get_loaded_embeddings_tensor(self):
-        return torch.FloatTensor(np.asarray(self.embedding_vectors_list))
+        return torch.FloatTensor(np.asarray(self.embedding_vectors_list, dtype=np.float32))
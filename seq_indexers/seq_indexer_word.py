@@ -12,6 +12,7 @@ import torch
 #from jellyfish import soundex
 from autocorrect import spell
 
+from classes.embeddings_cache import EmbeddingsCache
 from seq_indexers.seq_indexer_base_embeddings import SeqIndexerBaseEmbeddings
 
 class SeqIndexerWord(SeqIndexerBaseEmbeddings):
@@ -24,44 +25,40 @@ class SeqIndexerWord(SeqIndexerBaseEmbeddings):
         self.zero_digits_replaced_num = 0
         self.zero_digits_replaced_lowercase_num = 0
 
-    def get_embeddings_word(self, word, embeddings_word_list):
-        if word in embeddings_word_list:
+    def get_embeddings_word(self, word, embeddings_word2row_dict):
+        if word in embeddings_word2row_dict:
             self.original_words_num += 1
             return word
-        elif self.check_for_lowercase and word.lower() in embeddings_word_list:
+        elif self.check_for_lowercase and word.lower() in embeddings_word2row_dict:
             self.lowercase_words_num += 1
             return word.lower()
-        elif self.zero_digits and re.sub('\d', '0', word) in embeddings_word_list:
+        elif self.zero_digits and re.sub('\d', '0', word) in embeddings_word2row_dict:
             self.zero_digits_replaced_num += 1
             return re.sub('\d', '0', word)
-        elif self.check_for_lowercase and self.zero_digits and re.sub('\d', '0', word.lower()) in embeddings_word_list:
+        elif self.check_for_lowercase and self.zero_digits and re.sub('\d', '0', word.lower()) in embeddings_word2row_dict:
             self.zero_digits_replaced_lowercase_num += 1
             return re.sub('\d', '0', word.lower())
         return None
 
-    def load_items_from_embeddings_file_and_unique_words_list(self, emb_fn, emb_delimiter, unique_words_list):
-        # Get the full list of available case-sensitive words from text file with pretrained embeddings
-        embeddings_words_list = [emb_word for emb_word, _ in SeqIndexerBaseEmbeddings.load_embeddings_from_file(emb_fn,
-                                                                                                          emb_delimiter,
-                                                                                                          verbose=True)]
-        # Create reverse mapping word from the embeddings file -> list of unique words from the dataset
-        emb_word_dict2unique_word_list = dict()
+    def load_items_from_embeddings_file_and_unique_words_list(self, emb_fn, emb_delimiter, unique_words_list,
+                                                               workers_num=1, use_cache=True):
+        # Text file with pretrained embeddings is parsed only once, next runs use its binary memory-mapped cache
+        embeddings_cache = EmbeddingsCache(emb_fn, emb_delimiter, workers_num=workers_num, use_cache=use_cache,
+                                           verbose=self.verbose)
+        # Find the row of the embeddings matrix for each unique word from the dataset
+        rows_unique_words_list = list()
         out_of_vocabulary_words_list = list()
         for unique_word in unique_words_list:
-            emb_word = self.get_embeddings_word(unique_word, embeddings_words_list)
+            emb_word = self.get_embeddings_word(unique_word, embeddings_cache.word2row_dict)
             if emb_word is None:
                 out_of_vocabulary_words_list.append(unique_word)
             else:
-                if emb_word not in emb_word_dict2unique_word_list:
-                    emb_word_dict2unique_word_list[emb_word] = [unique_word]
-                else:
-                    emb_word_dict2unique_word_list[emb_word].append(unique_word)
-        # Add pretrained embeddings for unique_words
-        for emb_word, emb_vec in SeqIndexerBaseEmbeddings.load_embeddings_from_file(emb_fn, emb_delimiter,verbose=True):
-            if emb_word in emb_word_dict2unique_word_list:
-                for unique_word in emb_word_dict2unique_word_list[emb_word]:
-                    self.add_item(unique_word)
-                    self.add_emb_vector(emb_vec)
+                rows_unique_words_list.append((embeddings_cache.word2row_dict[emb_word], unique_word))
+        # Add pretrained embeddings for unique_words, in the order of the embeddings file
+        rows_unique_words_list.sort(key=lambda row_word: row_word[0])
+        for row, unique_word in rows_unique_words_list:
+            self.add_item(unique_word)
+            self.add_emb_vector(np.array(embeddings_cache.matrix[row]))
         if self.verbose:
             print('\nload_vocabulary_from_embeddings_file_and_unique_words_list:')
             print('    First 50 OOV words:')
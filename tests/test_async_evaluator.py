@@ -0,0 +1,47 @@
+"""
+.. module:: test_async_evaluator
+    :synopsis: Checks that errors of the evaluation worker process are reported to the main process and that the
+    evaluator is closed when its worker has failed or stopped.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import tempfile
+import types
+import unittest
+
+from classes.async_evaluator import AsyncEvaluator
+from models.tagger_birnn_crf import TaggerBiRNNCRF
+from tests.test_tagger_io import make_tagger
+
+def make_async_evaluator():
+    with tempfile.TemporaryDirectory() as emb_dir:
+        tagger = make_tagger(TaggerBiRNNCRF, emb_dir)
+    # Datasets without the pre-indexed data can not be evaluated, so the worker fails on the first snapshot
+    datasets_bank = types.SimpleNamespace(indexed_train=None, indexed_dev=None, indexed_test=None)
+    return AsyncEvaluator(tagger, datasets_bank, eval_params=dict()), tagger
+
+class TestAsyncEvaluator(unittest.TestCase):
+    def test_worker_error(self):
+        async_evaluator, tagger = make_async_evaluator()
+        async_evaluator.submit(1, tagger, 0.0)
+        with self.assertRaisesRegex(RuntimeError, 'Evaluation of epoch 1 has failed in the worker process'):
+            async_evaluator.get_results(wait_all=True)
+        async_evaluator.close(timeout=10.0)
+        self.assertFalse(async_evaluator.worker.is_alive())
+
+    def test_close_stopped_worker(self):
+        async_evaluator, _ = make_async_evaluator()
+        async_evaluator.worker.terminate()
+        async_evaluator.worker.join()
+        with self.assertRaisesRegex(RuntimeError, 'stopped unexpectedly'):
+            async_evaluator.check_worker()
+        async_evaluator.close(timeout=10.0)
+
+    def test_close(self):
+        async_evaluator, _ = make_async_evaluator()
+        async_evaluator.close(timeout=30.0)
+        self.assertEqual(async_evaluator.worker.exitcode, 0)
+
+if __name__ == '__main__':
+    unittest.main()
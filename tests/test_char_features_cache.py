@@ -0,0 +1,49 @@
+"""
+.. module:: test_char_features_cache
+    :synopsis: Checks LRU eviction, invalidation and pickling of CharFeaturesCache.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import pickle
+import unittest
+
+import torch
+
+from classes.char_features_cache import CharFeaturesCache
+
+def compute_features(words):
+    return torch.tensor([[float(len(word)), float(ord(word[0]))] for word in words])
+
+class TestCharFeaturesCache(unittest.TestCase):
+    def test_get_features(self):
+        cache = CharFeaturesCache(max_size=3)
+        word_sequences = [['a', 'bb', 'a'], ['ccc']]
+        features = cache.get_features(word_sequences, compute_features, torch.zeros(2))
+        self.assertEqual(features.shape, (2, 3, 2))
+        self.assertTrue(torch.equal(features[0, :2], compute_features(['a', 'bb'])))
+        self.assertTrue(torch.equal(features[1, 1:], torch.zeros(2, 2)))
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+        cache.get_features([['dddd', 'a']], compute_features, torch.zeros(2))
+        self.assertEqual(list(cache.features_dict.keys()), ['ccc', 'a', 'dddd'])
+        self.assertEqual(cache.get_stats(), {'size': 3, 'hits': 1, 'misses': 4, 'evictions': 1})
+
+    def test_check_weights(self):
+        cache = CharFeaturesCache()
+        weights = torch.zeros(3)
+        cache.check_weights([weights])
+        cache.get_features([['a']], compute_features, torch.zeros(2))
+        cache.check_weights([weights])
+        self.assertEqual(len(cache.features_dict), 1)
+        cache.check_weights([weights.clone()])
+        self.assertEqual(len(cache.features_dict), 0)
+
+    def test_pickle(self):
+        cache = CharFeaturesCache(max_size=10)
+        cache.check_weights([torch.zeros(3)])
+        cache.get_features([['a']], compute_features, torch.zeros(2))
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual((len(cache.features_dict), cache.weights_key, cache.max_size), (0, None, 10))
+
+if __name__ == '__main__':
+    unittest.main()
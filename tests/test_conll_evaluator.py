@@ -0,0 +1,76 @@
+"""
+.. module:: test_conll_evaluator
+    :synopsis: Compares the in-process ConllEvaluator with the bundled perl script "conlleval" on random tag sequences
+    with unusual tags, and checks that merged EvaluationAccumulators give the same counts as a single pass.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from classes.conll_evaluator import ConllEvaluator
+from classes.data_io import DataIO
+from classes.evaluation_accumulator import EvaluationAccumulator
+
+CONLLEVAL_FN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'conlleval')
+# Sentence boundary, brackets, "0" type (false in perl), hyphenated types and tags without types
+TAGS = ['O', 'B-PER', 'I-PER', 'E-PER', 'B-LOC', 'I-LOC', 'B-NP-SUB', 'I-NP-SUB', 'B-0', 'I-0', '[', ']', '[-NP', ']-NP',
+        '-X-', '.', 'X', 'B-', 'I']
+WORDS = ['the', 'cat', 'sat', 'on', 'mat', '-X-']
+
+def make_sequences(seed, sequences_num=30):
+    random_state = random.Random(seed)
+    word_sequences, targets_tag_sequences, outputs_tag_sequences = list(), list(), list()
+    for _ in range(sequences_num):
+        seq_len = random_state.randint(1, 12)
+        word_sequences.append([random_state.choice(WORDS) for _ in range(seq_len)])
+        targets_tag_sequences.append([random_state.choice(TAGS) for _ in range(seq_len)])
+        # Outputs are mostly equal to targets, so there are correct chunks of all kinds
+        outputs_tag_sequences.append([tag if random_state.random() < 0.7 else random_state.choice(TAGS)
+                                      for tag in targets_tag_sequences[-1]])
+    return word_sequences, targets_tag_sequences, outputs_tag_sequences
+
+class TestConllEvaluator(unittest.TestCase):
+    @unittest.skipIf(shutil.which('perl') is None, 'perl is not installed')
+    def test_perl_script(self):
+        for seed in range(20):
+            word_sequences, targets_tag_sequences, outputs_tag_sequences = make_sequences(seed)
+            with tempfile.TemporaryDirectory() as out_dir:
+                fn_out = os.path.join(out_dir, 'out.txt')
+                DataIO.write_CoNNL_2003_two_columns(fn_out, word_sequences, targets_tag_sequences, outputs_tag_sequences)
+                with open(fn_out) as f:
+                    perl_report_str = subprocess.run(['perl', CONLLEVAL_FN], stdin=f, stdout=subprocess.PIPE,
+                                                     check=True, universal_newlines=True).stdout
+            counts = ConllEvaluator.get_counts(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+            self.assertEqual(ConllEvaluator.get_report_str(counts), perl_report_str)
+            f1, _ = ConllEvaluator.get_f1(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+            self.assertEqual(f1, float(perl_report_str.split('\n')[1].split(':')[-1].strip()))
+
+    def test_merged_accumulators(self):
+        word_sequences, targets_tag_sequences, outputs_tag_sequences = make_sequences(0, sequences_num=60)
+        accumulator = EvaluationAccumulator()
+        accumulator.add(word_sequences, targets_tag_sequences, outputs_tag_sequences)
+        shards_accumulators = list()
+        for start, end in [(0, 7), (7, 31), (31, 60)]:
+            shards_accumulators.append(EvaluationAccumulator())
+            shards_accumulators[-1].add(word_sequences[start:end], targets_tag_sequences[start:end],
+                                        outputs_tag_sequences[start:end])
+        merged_accumulator = EvaluationAccumulator()
+        for shard_accumulator in shards_accumulators:
+            merged_accumulator.merge(shard_accumulator)
+        for other_accumulator in [merged_accumulator, shards_accumulators[0] + shards_accumulators[1] +
+                                  shards_accumulators[2]]:
+            self.assertEqual(other_accumulator.__dict__, accumulator.__dict__)
+            self.assertEqual(other_accumulator.get_connl_str(), accumulator.get_connl_str())
+            self.assertEqual(other_accumulator.get_f1(), accumulator.get_f1())
+            self.assertEqual(other_accumulator.get_accuracy(), accumulator.get_accuracy())
+        self.assertEqual(accumulator.get_connl_str(),
+                         ConllEvaluator.get_f1(word_sequences, targets_tag_sequences, outputs_tag_sequences)[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+.. module:: test_datasets_bank
+    :synopsis: Checks that DatasetsBankSorted samples the same train batches from the memory-mapped train corpus as
+    from the train sequences in memory.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from classes.data_io import DataIO
+from classes.datasets_bank import DatasetsBankSorted
+from classes.mmap_corpus import MmapCorpus
+
+FN_DEV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'NER',
+                      'CoNNL_2003_shared_task', 'dev.txt')
+
+class TestDatasetsBankSorted(unittest.TestCase):
+    def test_train_corpus(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            fn_train = os.path.join(data_dir, 'train.txt')
+            with open(FN_DEV, 'r') as f_in, open(fn_train, 'w') as f_out:
+                f_out.write(''.join(f_in.readlines()[:2000]))
+            word_sequences, tag_sequences = DataIO.read_CoNNL_universal(fn_train, verbose=False)
+            datasets_bank = DatasetsBankSorted(verbose=False)
+            datasets_bank.add_train_sequences(word_sequences, tag_sequences)
+            corpus_dir = os.path.join(data_dir, 'corpus')
+            corpus_datasets_bank = DatasetsBankSorted(verbose=False)
+            corpus_datasets_bank.add_train_corpus(MmapCorpus(fn_train, corpus_dir=corpus_dir, verbose=False))
+            self.assertEqual(sorted(os.listdir(data_dir)), ['corpus', 'train.txt'])
+            self.assertEqual(corpus_datasets_bank.unique_words_list, datasets_bank.unique_words_list)
+            for batch_size in [1, 7, 10]:
+                batches = list()
+                for curr_datasets_bank in [datasets_bank, corpus_datasets_bank]:
+                    random.seed(batch_size)
+                    np.random.seed(batch_size)
+                    batches_indices = curr_datasets_bank.get_train_batches_indices(batch_size)
+                    batches.append([[curr_datasets_bank.word_sequences_train[i] for i in batch_indices]
+                                    for batch_indices in batches_indices])
+                    random.seed(batch_size)
+                    np.random.seed(batch_size)
+                    batches.append(list(curr_datasets_bank.get_train_batches(batch_size)))
+                self.assertEqual(batches[2], batches[0])
+                self.assertEqual(batches[3], batches[1])
+
+if __name__ == '__main__':
+    unittest.main()
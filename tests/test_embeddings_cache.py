@@ -0,0 +1,59 @@
+"""
+.. module:: test_embeddings_cache
+    :synopsis: Checks building, reusing and invalidation of the binary cache of the word embeddings file, and parsing
+    in memory when the cache is disabled or can not be written.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from classes.embeddings_cache import EmbeddingsCache
+
+WORDS = ['the', 'cat', 'sat', 'on', 'mat', 'the']
+
+def write_embeddings_file(emb_fn, delimiter=' ', seed=0):
+    matrix = np.random.RandomState(seed).uniform(-1, 1, (len(WORDS), 6)).astype(np.float32)
+    with open(emb_fn, 'w', encoding='utf-8') as f:
+        for word, vector in zip(WORDS, matrix):
+            f.write(delimiter.join([word] + ['%1.6f' % value for value in vector]) + '\n')
+    return np.array([[float('%1.6f' % value) for value in vector] for vector in matrix], dtype=np.float32)
+
+class TestEmbeddingsCache(unittest.TestCase):
+    def check_embeddings(self, embeddings_cache, matrix):
+        self.assertEqual(embeddings_cache.words_list, WORDS)
+        self.assertEqual(embeddings_cache.word2row_dict['the'], 0)
+        np.testing.assert_array_equal(np.asarray(embeddings_cache.matrix), matrix)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            emb_fn = os.path.join(emb_dir, 'emb.txt')
+            matrix = write_embeddings_file(emb_fn)
+            self.check_embeddings(EmbeddingsCache(emb_fn, ' ', verbose=False), matrix)
+            self.assertTrue(os.path.isfile(emb_fn + '.words.txt') and os.path.isfile(emb_fn + '.npy'))
+            embeddings_cache = EmbeddingsCache(emb_fn, ' ', verbose=False)
+            self.assertTrue(isinstance(embeddings_cache.matrix, np.memmap))
+            self.check_embeddings(embeddings_cache, matrix)
+            # The cache is rebuilt for another delimiter and for the changed embeddings file
+            matrix = write_embeddings_file(emb_fn, delimiter='\t', seed=1)
+            self.check_embeddings(EmbeddingsCache(emb_fn, '\t', verbose=False), matrix)
+            self.assertEqual(EmbeddingsCache(emb_fn, ' ', verbose=False).words_list, [])
+            self.check_embeddings(EmbeddingsCache(emb_fn, '\t', verbose=False), matrix)
+
+    def test_in_memory(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            emb_fn = os.path.join(emb_dir, 'emb.txt')
+            matrix = write_embeddings_file(emb_fn)
+            self.check_embeddings(EmbeddingsCache(emb_fn, ' ', use_cache=False, verbose=False), matrix)
+            self.assertEqual(os.listdir(emb_dir), ['emb.txt'])
+            # Location where the cache can not be written
+            os.mkdir(emb_fn + '.npy.tmp')
+            self.check_embeddings(EmbeddingsCache(emb_fn, ' ', verbose=False), matrix)
+            self.assertEqual(sorted(os.listdir(emb_dir)), ['emb.txt', 'emb.txt.npy.tmp'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+"""
+.. module:: test_layer_crf
+    :synopsis: Compares numerator, denominator and Viterbi decoding of LayerCRF (dense and sparse transitions, with
+    and without the Batch) with the straightforward per-sequence reference computed in float64.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import pickle
+import unittest
+
+import numpy as np
+import torch
+
+from classes.batch import Batch
+from layers.layer_crf import LayerCRF
+from seq_indexers.seq_indexer_tag import SeqIndexerTag
+
+TAGS = ['O', 'B-PER', 'I-PER', 'B-LOC', 'I-LOC', 'B-ORG', 'I-ORG', 'B-MISC', 'I-MISC']
+
+def make_crf(sparse_transitions, seed=0):
+    tag_seq_indexer = SeqIndexerTag(gpu=-1)
+    tag_seq_indexer.verbose = False
+    tag_seq_indexer.load_items_from_tag_sequences([TAGS])
+    torch.manual_seed(seed)
+    crf = LayerCRF(-1, states_num=len(TAGS) + 2, pad_idx=tag_seq_indexer.pad_idx, sos_idx=len(TAGS) + 1,
+                   tag_seq_indexer=tag_seq_indexer, verbose=False)
+    if sparse_transitions:
+        # BIO constraints: I-X may follow only B-X or I-X
+        for i, curr_tag in enumerate(TAGS):
+            for j, prev_tag in enumerate(TAGS + ['<sos>']):
+                if curr_tag.startswith('I-') and prev_tag[2:] != curr_tag[2:]:
+                    crf.transition_matrix.data[tag_seq_indexer.item2idx_dict[curr_tag], j + 1] = -9999.0
+        crf.sparse_transitions = True
+        crf.init_sparse_transitions()
+    return crf
+
+def make_inputs(crf, seed=0, batch_num=12, max_seq_len=15):
+    random_state = np.random.RandomState(seed)
+    seq_len_list = random_state.randint(1, max_seq_len + 1, batch_num).tolist()
+    seq_len_list[0] = max_seq_len
+    batch = Batch(torch.zeros(batch_num, max_seq_len, dtype=torch.long), seq_len_list)
+    features = torch.from_numpy(random_state.randn(batch_num, max_seq_len, crf.states_num).astype(np.float32))
+    features = features * batch.mask_tensor.unsqueeze(-1)
+    states = torch.from_numpy(random_state.randint(1, len(TAGS) + 1, (batch_num, max_seq_len)))
+    states = (states * batch.mask_tensor.long()) # padded positions are pad_idx = 0
+    return batch, features, states
+
+def get_legal_transitions(crf):
+    transition_matrix = crf.transition_matrix.data.numpy().astype(np.float64)
+    if crf.sparse_transitions: # illegal transitions are left out by the sparse mode
+        transition_matrix[transition_matrix <= -9999.0 / 2] = -np.inf
+    return transition_matrix
+
+def numerator_reference(crf, features, states, seq_len_list):
+    transition_matrix = crf.transition_matrix.data.numpy().astype(np.float64)
+    features = features.numpy().astype(np.float64)
+    scores = list()
+    for k, seq_len in enumerate(seq_len_list):
+        score, prev_state = 0.0, crf.sos_idx
+        for n in range(seq_len):
+            curr_state = int(states[k, n])
+            score += features[k, n, curr_state] + transition_matrix[curr_state, prev_state]
+            prev_state = curr_state
+        scores.append(score)
+    return np.array(scores)
+
+def denominator_reference(crf, features, seq_len_list):
+    transition_matrix = get_legal_transitions(crf)
+    features = features.numpy().astype(np.float64)
+    scores = list()
+    for k, seq_len in enumerate(seq_len_list):
+        score = np.full(crf.states_num, -9999.0)
+        score[crf.sos_idx] = 0.0
+        for n in range(seq_len):
+            score = np.logaddexp.reduce(score[np.newaxis, :] + transition_matrix, axis=1) + features[k, n]
+        scores.append(np.logaddexp.reduce(score))
+    return np.array(scores)
+
+def viterbi_reference(crf, features, seq_len_list):
+    transition_matrix = get_legal_transitions(crf)
+    features = features.numpy().astype(np.float64)
+    paths = list()
+    for k, seq_len in enumerate(seq_len_list):
+        score = np.full(crf.states_num, -9999.0)
+        score[crf.sos_idx] = 0.0
+        backpointers = list()
+        for n in range(seq_len):
+            curr_score = score[np.newaxis, :] + transition_matrix
+            backpointers.append(curr_score.argmax(axis=1))
+            score = curr_score.max(axis=1) + features[k, n]
+        path = [int(score.argmax())]
+        for n in reversed(range(1, seq_len)):
+            path.append(int(backpointers[n][path[-1]]))
+        paths.append(path[::-1])
+    return paths
+
+class TestLayerCRF(unittest.TestCase):
+    def check_crf(self, sparse_transitions):
+        crf = make_crf(sparse_transitions)
+        for seed in range(3):
+            batch, features, states = make_inputs(crf, seed)
+            # Random gold paths may contain illegal transitions, their float32 sums of -9999 terms are off by a few
+            # 1e-3 (about 1e-7 relative), so the optimized paths are not exactly equal to the reference
+            numerator = crf.numerator(features, states, batch.mask_tensor).detach().numpy()
+            np.testing.assert_allclose(numerator, numerator_reference(crf, features, states, batch.seq_len_list),
+                                       rtol=1e-6, atol=1e-5)
+            denominator_target = denominator_reference(crf, features, batch.seq_len_list)
+            for curr_batch in [None, batch]:
+                denominator = crf.denominator(features, batch.mask_tensor, curr_batch).detach().numpy()
+                np.testing.assert_allclose(denominator, denominator_target, rtol=1e-6, atol=1e-5)
+            viterbi_target = viterbi_reference(crf, features, batch.seq_len_list)
+            for curr_batch in [None, batch]:
+                self.assertEqual(crf.decode_viterbi(features, batch.mask_tensor, curr_batch), viterbi_target)
+
+    def test_dense(self):
+        self.check_crf(sparse_transitions=False)
+
+    def test_sparse(self):
+        self.check_crf(sparse_transitions=True)
+
+    def test_matmul_step(self):
+        # Large emissions with BIO constraints make the scaled exp-matmul sums underflow for some states
+        crf = make_crf(sparse_transitions=True)
+        crf.sparse_transitions = False # dense steps over the BIO-constrained transitions
+        batch, features, _ = make_inputs(crf)
+        features = features * 40.0
+        features.requires_grad_()
+        results = list()
+        for matmul_min_states_num in [crf.states_num + 1, 1]:
+            crf.matmul_min_states_num = matmul_min_states_num
+            denominator = crf.denominator(features, batch.mask_tensor, batch)
+            gradients = torch.autograd.grad(denominator.sum(), [features, crf.transition_matrix])
+            results.append([denominator.detach().numpy()] + [gradient.numpy() for gradient in gradients])
+        np.testing.assert_allclose(results[0][0], denominator_reference(crf, features.detach(), batch.seq_len_list),
+                                   rtol=1e-5)
+        for broadcast_result, matmul_result in zip(*results):
+            np.testing.assert_allclose(matmul_result, broadcast_result, rtol=1e-4, atol=1e-3)
+
+    def test_decode_viterbi_nbest(self):
+        crf = make_crf(sparse_transitions=False)
+        batch, features, _ = make_inputs(crf)
+        k = 4
+        best_paths_batch, best_scores_batch = crf.decode_viterbi_nbest(features, batch.mask_tensor, k, batch)
+        transition_matrix = crf.transition_matrix.data.numpy().astype(np.float64)
+        for best_paths, best_scores, best_path, seq_len, seq_features in zip(best_paths_batch, best_scores_batch,
+                                                                           crf.decode_viterbi(features, batch.mask_tensor),
+                                                                           batch.seq_len_list, features.numpy()):
+            self.assertEqual(best_paths[0], best_path)
+            self.assertEqual(len(best_paths), k)
+            self.assertEqual(len(set(tuple(path) for path in best_paths)), k)
+            self.assertEqual(best_scores, sorted(best_scores, reverse=True))
+            for path, score in zip(best_paths, best_scores):
+                self.assertEqual(len(path), seq_len)
+                prev_states = [crf.sos_idx] + path[:-1]
+                target_score = sum(seq_features[n, state] + transition_matrix[state, prev_state]
+                                   for n, (state, prev_state) in enumerate(zip(path, prev_states)))
+                self.assertAlmostEqual(score, target_score, places=3)
+
+    def test_decode_viterbi_nbest_legal_paths_only(self):
+        # Sequence of one token has only len(TAGS) legal paths, the rest of k hypotheses are left out
+        crf = make_crf(sparse_transitions=False)
+        batch = Batch(torch.zeros(2, 1, dtype=torch.long), [1, 1])
+        features = torch.randn(2, 1, crf.states_num)
+        best_paths_batch, best_scores_batch = crf.decode_viterbi_nbest(features, batch.mask_tensor, 20, batch)
+        for best_paths, best_scores in zip(best_paths_batch, best_scores_batch):
+            self.assertEqual(sorted(path[0] for path in best_paths), list(range(1, len(TAGS) + 1)))
+            self.assertTrue(all(score > -9999.0 / 2 for score in best_scores))
+        with self.assertRaises(ValueError):
+            make_crf(sparse_transitions=True).decode_viterbi_nbest(features, batch.mask_tensor, 2, batch)
+
+    def test_shuffled_and_sorted_batches(self):
+        crf = make_crf(sparse_transitions=False)
+        batch, features, _ = make_inputs(crf)
+        sort_index = batch.sort_index_tensor
+        sorted_batch = Batch(batch.word_idx_tensor[sort_index], batch.sorted_seq_len_list)
+        self.assertTrue(sorted_batch.is_sorted)
+        denominator = crf.denominator(features, batch.mask_tensor, batch)
+        sorted_denominator = crf.denominator(features[sort_index], sorted_batch.mask_tensor, sorted_batch)
+        np.testing.assert_allclose(sorted_denominator.detach().numpy(), denominator[sort_index].detach().numpy(),
+                                   rtol=1e-6)
+
+    def test_load_legacy_pickle(self):
+        # Layers pickled by the older versions have no sparse_transitions attribute
+        crf = make_crf(sparse_transitions=False)
+        del crf.sparse_transitions
+        crf = pickle.loads(pickle.dumps(crf))
+        self.assertFalse(crf.sparse_transitions)
+        batch, features, _ = make_inputs(crf)
+        self.assertEqual(crf.decode_viterbi(features, batch.mask_tensor, batch),
+                         viterbi_reference(crf, features, batch.seq_len_list))
+
+if __name__ == '__main__':
+    unittest.main()
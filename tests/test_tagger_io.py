@@ -0,0 +1,117 @@
+"""
+.. module:: test_tagger_io
+    :synopsis: Checks that taggers pickled by the older versions (without the attributes added later) are loaded and
+    work, and that the derived vocabulary tables are not saved together with the tagger.
+
+.. moduleauthor:: Artem Chernodub
+"""
+
+import copy
+import copyreg
+import io
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+import torch
+
+from models.tagger_birnn_cnn import TaggerBiRNNCNN
+from models.tagger_birnn_cnn_crf import TaggerBiRNNCNNCRF
+from models.tagger_birnn_crf import TaggerBiRNNCRF
+from seq_indexers.seq_indexer_char import SeqIndexerBaseChar
+from seq_indexers.seq_indexer_tag import SeqIndexerTag
+from seq_indexers.seq_indexer_word import SeqIndexerWord
+
+WORD_SEQUENCES = [['John', 'lives', 'in', 'London', '.'], ['Mary', 'works', 'at', 'Google', 'in', 'Paris', '.'],
+                  ['Peter', 'visited', 'New', 'York', '.'], ['Google', 'is', 'in', 'California']]
+TAG_SEQUENCES = [['B-PER', 'O', 'O', 'B-LOC', 'O'], ['B-PER', 'O', 'O', 'B-ORG', 'O', 'B-LOC', 'O'],
+                 ['B-PER', 'O', 'B-LOC', 'I-LOC', 'O'], ['B-ORG', 'O', 'O', 'B-LOC']]
+# Unknown words and words with characters beyond the vocabulary go through the out-of-vocabulary path
+TEST_WORD_SEQUENCES = [['Zoe', 'lives', 'in', 'Zürich', '.'], ['john'], ['Mary', 'visited', 'York', 'in', '2018']]
+
+def make_tagger(tagger_class, emb_dir, **kwargs):
+    emb_fn = os.path.join(emb_dir, 'emb.txt')
+    random_state = np.random.RandomState(0)
+    with open(emb_fn, 'w') as f:
+        for word in ['john', 'lives', 'in', 'london', '.', 'works', 'at', 'google', 'paris', 'visited', 'new', 'york']:
+            f.write(word + ' ' + ' '.join('%1.4f' % value for value in random_state.uniform(-1, 1, 5)) + '\n')
+    word_seq_indexer = SeqIndexerWord(gpu=-1, check_for_lowercase=True, embeddings_dim=5, verbose=False)
+    unique_words_list = sorted(set(word for word_seq in WORD_SEQUENCES for word in word_seq))
+    word_seq_indexer.load_items_from_embeddings_file_and_unique_words_list(emb_fn, ' ', unique_words_list)
+    tag_seq_indexer = SeqIndexerTag(gpu=-1)
+    tag_seq_indexer.verbose = False
+    tag_seq_indexer.load_items_from_tag_sequences(TAG_SEQUENCES)
+    torch.manual_seed(0)
+    tagger = tagger_class(word_seq_indexer=word_seq_indexer, tag_seq_indexer=tag_seq_indexer,
+                          class_num=tag_seq_indexer.get_class_num(), batch_size=2, rnn_hidden_dim=8, **kwargs)
+    tagger.eval()
+    return tagger
+
+def reduce_legacy_seq_indexer(seq_indexer):
+    # Older versions pickled dicts of items instead of the packed items list
+    state = seq_indexer.__dict__.copy()
+    state['idx2item_dict'] = dict(enumerate(state.pop('items_list')))
+    del state['items_array']
+    return copyreg.__newobj__, (type(seq_indexer),), state
+
+def dumps_legacy(tagger):
+    # Returns the pickle of the tagger in the format of the older versions, without the attributes added later
+    tagger = copy.deepcopy(tagger)
+    if hasattr(tagger, 'char_embeddings_layer'):
+        del tagger.__dict__['char_features_cache']
+        del tagger.char_embeddings_layer.__dict__['word_seq_indexer']
+        del tagger.char_embeddings_layer.__dict__['word_char_idx_table']
+    if hasattr(tagger, 'crf_layer'):
+        del tagger.crf_layer.__dict__['sparse_transitions']
+    f = io.BytesIO()
+    pickler = pickle.Pickler(f, protocol=2)
+    pickler.dispatch_table = copyreg.dispatch_table.copy()
+    for seq_indexer_class in [SeqIndexerWord, SeqIndexerTag, SeqIndexerBaseChar]:
+        pickler.dispatch_table[seq_indexer_class] = reduce_legacy_seq_indexer
+    pickler.dump(tagger)
+    return f.getvalue()
+
+class TestTaggerIO(unittest.TestCase):
+    def check_legacy_pickle(self, tagger):
+        tags_target = tagger.predict_tags_from_words(TEST_WORD_SEQUENCES, verbose=False)
+        loaded_tagger = pickle.loads(dumps_legacy(tagger))
+        self.assertEqual(loaded_tagger.predict_tags_from_words(TEST_WORD_SEQUENCES, verbose=False), tags_target)
+        loaded_tagger.train()
+        loaded_tagger.get_loss(WORD_SEQUENCES, TAG_SEQUENCES).backward()
+        loaded_tagger.load_state_dict(tagger.state_dict())
+        loaded_tagger.eval()
+        self.assertEqual(loaded_tagger.predict_tags_from_words(TEST_WORD_SEQUENCES, verbose=False), tags_target)
+        return loaded_tagger
+
+    def test_load_legacy_birnn_crf(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            tagger = make_tagger(TaggerBiRNNCRF, emb_dir)
+        self.assertFalse(self.check_legacy_pickle(tagger).crf_layer.sparse_transitions)
+
+    def test_load_legacy_birnn_cnn(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            tagger = make_tagger(TaggerBiRNNCNN, emb_dir)
+        loaded_tagger = self.check_legacy_pickle(tagger)
+        self.assertIs(loaded_tagger.char_embeddings_layer.word_seq_indexer, loaded_tagger.word_seq_indexer)
+
+    def test_load_legacy_birnn_cnn_crf(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            tagger = make_tagger(TaggerBiRNNCNNCRF, emb_dir)
+        loaded_tagger = self.check_legacy_pickle(tagger)
+        self.assertIs(loaded_tagger.char_embeddings_layer.word_seq_indexer, loaded_tagger.word_seq_indexer)
+
+    def test_char_idx_tensor(self):
+        with tempfile.TemporaryDirectory() as emb_dir:
+            tagger = make_tagger(TaggerBiRNNCNNCRF, emb_dir)
+        char_embeddings_layer = tagger.char_embeddings_layer
+        self.assertTrue(torch.equal(char_embeddings_layer.get_char_idx_tensor(TEST_WORD_SEQUENCES),
+                                    char_embeddings_layer.get_char_idx_tensor_slow(TEST_WORD_SEQUENCES)))
+        # Vocabulary table is derived from the word indexer, it is neither in the state dict nor in the pickle
+        self.assertFalse(any('word_char_idx_table' in key for key in tagger.state_dict()))
+        self.assertIsNotNone(char_embeddings_layer.word_char_idx_table)
+        self.assertIsNone(pickle.loads(pickle.dumps(tagger)).char_embeddings_layer.word_char_idx_table)
+
+if __name__ == '__main__':
+    unittest.main()